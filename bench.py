@@ -0,0 +1,357 @@
+#!env python
+# -*- coding: utf-8 -*-
+u""" Run benchmarks on performance-sensitive parts of FTR.
+
+Usage::
+
+    # All benchmarks
+    python bench.py
+
+    # Only some of them
+    python bench.py memory parser
+
+Benchmarks use all siteconfigs of a local ``ftr-site-config`` checkout,
+found in ``FTR_SITECONFIG_PATH`` (default: ``~/sources/ftr-site-config``),
+like :file:`test.py`.
+"""
+
+import os
+import gc
+import sys
+import time
+import types
+import pickle
+import codecs
+import logging
+
+import ftr
+import lxml.etree
+import readability.readability
+
+from ftr.config import ftr_string_to_instance
+
+FTR_SITECONFIG_PATH = os.environ.get(
+    'FTR_SITECONFIG_PATH',
+    os.path.expanduser(u'~/sources/ftr-site-config')
+)
+
+# Not part of any config: shared by all of them.
+IGNORED_TYPES = (type, types.ModuleType, types.FunctionType,
+                 types.BuiltinFunctionType, types.MethodType)
+
+
+def load_siteconfigs():
+    """ Return ``(filename, content)`` of all siteconfigs, sorted. """
+
+    siteconfigs = []
+
+    for filename in sorted(os.listdir(FTR_SITECONFIG_PATH)):
+        if filename.endswith(u'.txt'):
+            with codecs.open(os.path.join(FTR_SITECONFIG_PATH, filename),
+                             'rb', encoding='utf8') as f:
+                siteconfigs.append((filename, f.read()))
+
+    return siteconfigs
+
+
+def deep_sizeof(objects):
+    """ Return the size of Python objects reachable from ``objects``.
+
+    Objects shared between them (eg. equal interned strings) are counted
+    once. Memory allocated by C libraries (eg. compiled XPath expressions
+    in libxml2) is not visible here, see :func:`rss`.
+    """
+
+    seen = set()
+    pending = list(objects)
+    size = 0
+
+    while pending:
+        obj = pending.pop()
+
+        if id(obj) in seen or isinstance(obj, IGNORED_TYPES):
+            continue
+
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+
+    return size
+
+
+def rss():
+    """ Return the current resident memory of the process, in bytes. """
+
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def bench_memory(siteconfigs):
+    """ Memory used per config, all configs of the repository loaded. """
+
+    count = len(siteconfigs)
+
+    gc.collect()
+    start_rss = rss()
+    start = time.time()
+
+    configs = []
+    for filename, content in siteconfigs:
+        try:
+            configs.append(ftr.SiteConfig(site_config_text=content,
+                                          host=filename[:-4]))
+
+        except ftr.InvalidSiteConfig:
+            continue
+
+    loading_time = time.time() - start
+    gc.collect()
+    configs_rss = rss() - start_rss
+    configs_size = deep_sizeof(configs)
+
+    start = time.time()
+    frozen = [config.freeze() for config in configs]
+    freezing_time = time.time() - start
+
+    # Frozen configs share the XPath objects of their source. Measure
+    # them alone: drop the sources, pickle and reload without XPaths.
+    pickled = pickle.dumps(frozen, pickle.HIGHEST_PROTOCOL)
+    del configs, frozen
+    gc.collect()
+    start_rss = rss()
+
+    start = time.time()
+    frozen = pickle.loads(pickled)
+    unpickling_time = time.time() - start
+
+    gc.collect()
+    frozen_rss = rss() - start_rss
+    frozen_size = deep_sizeof(frozen)
+
+    for config in frozen:
+        config.strip_xpaths()
+
+    gc.collect()
+    compiled_rss = rss() - start_rss
+
+    loaded = len(frozen)
+
+    print u'{0} siteconfigs, {1} loaded.'.format(count, loaded)
+    print u'SiteConfig:       {0:7.0f} bytes/config (Python objects), ' \
+        u'{1:7.0f} bytes/config (RSS, compiled), {2:.2f}s to load.'.format(
+            float(configs_size) / loaded, float(configs_rss) / loaded,
+            loading_time)
+    print u'FrozenSiteConfig: {0:7.0f} bytes/config (Python objects), ' \
+        u'{1:7.0f} bytes/config (RSS), {2:7.0f} bytes/config (RSS, ' \
+        u'compiled), {3:.2f}s to freeze.'.format(
+            float(frozen_size) / loaded, float(frozen_rss) / loaded,
+            float(compiled_rss) / loaded, freezing_time)
+    print u'Pickled:          {0:7.0f} bytes/config, {1:.2f}s to ' \
+        u'unpickle all.'.format(float(len(pickled)) / loaded,
+                                unpickling_time)
+
+
+def bench_parser(siteconfigs, repeat=5):
+    """ Siteconfig parser speed, all configs of the repository parsed. """
+
+    lines = sum(len(content.splitlines()) for filename, content in siteconfigs)
+    best_time = None
+
+    for iteration in range(repeat):
+        invalid = 0
+        start = time.time()
+
+        for filename, content in siteconfigs:
+            try:
+                ftr_string_to_instance(content)
+
+            except ftr.InvalidSiteConfig:
+                invalid += 1
+
+        parsing_time = time.time() - start
+
+        if best_time is None or parsing_time < best_time:
+            best_time = parsing_time
+
+    print u'{0} siteconfigs ({1} invalid), {2} lines.'.format(
+        len(siteconfigs), invalid, lines)
+    print u'Best of {0}: {1:.3f}s total, {2:.0f} lines/s, {3:.0f} ' \
+        u'siteconfigs/s.'.format(repeat, best_time, lines / best_time,
+                                 len(siteconfigs) / best_time)
+
+
+def make_page(parts=4, paragraphs=10):
+    """ Return a synthetic article page, with some clutter around. """
+
+    paragraph = (u'<p>Some <a href="/link">article</a> text, with commas, '
+                 u'long enough to be scored by readability; lorem ipsum '
+                 u'dolor sit amet, consectetur adipiscing elit.</p>')
+
+    return (
+        u'<!DOCTYPE html><html><head><title>An article</title>'
+        u'<style>p {{ color: red; }}</style></head><body>'
+        u'<ul id="nav">{0}</ul><script>var x = 1;</script>'
+        u'<div id="content"><h1>An article</h1>{1}</div>'
+        u'<div id="sidebar">{0}</div></body></html>'
+    ).format(
+        u''.join(u'<li><a href="/{0}">Link {0}</a></li>'.format(x)
+                 for x in range(30)),
+        u''.join(u'<div class="part" style="width: 10px">{0}</div>'.format(
+            paragraph * paragraphs) for x in range(parts)),
+    )
+
+
+EXTRACTION_CASES = (
+    ('one body', u'body: //div[@id="content"]\nprune: yes\ntidy: no\n'),
+    ('bodies', u'body: //div[@class="part"]\nprune: yes\ntidy: no\n'),
+    ('autodetect', u'body: //div[@id="missing"]\ntidy: no\n'),
+)
+
+
+def count_calls(module, name, counters):
+    """ Count calls to ``module.name`` in ``counters[name]``.
+
+    :returns: the original function, to restore it.
+    """
+
+    function = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        counters[name] += 1
+        return function(*args, **kwargs)
+
+    setattr(module, name, wrapper)
+
+    return function
+
+
+def bench_extraction(siteconfigs, repeat=50):
+    """ Extraction pipeline, HTML parsings and time per page. """
+
+    html = make_page()
+
+    for name, config_text in EXTRACTION_CASES:
+        config = ftr.SiteConfig(site_config_text=config_text).freeze()
+
+        # Full documents parsed by us, and by readability.
+        counters = {'parse': 0, 'build_doc': 0}
+        parse = count_calls(lxml.etree, 'parse', counters)
+        build_doc = count_calls(readability.readability, 'build_doc',
+                                counters)
+
+        try:
+            start = time.time()
+
+            for iteration in range(repeat):
+                ftr.ContentExtractor(config).process(html)
+
+            extraction_time = time.time() - start
+
+        finally:
+            lxml.etree.parse = parse
+            readability.readability.build_doc = build_doc
+
+        print u'{0:10}: {1:4.1f} parsings/page ({2:.1f} by readability), ' \
+            u'{3:5.1f}ms/page.'.format(
+                name, float(sum(counters.values())) / repeat,
+                float(counters['build_doc']) / repeat,
+                extraction_time * 1000 / repeat)
+
+
+def make_comments_page(threads=500, replies=5):
+    """ Return a page of ``threads`` comments with nested replies. """
+
+    comment = u'<div class="comment"><p>A comment.</p>{0}</div>'
+    thread = u''
+
+    for reply in range(replies + 1):
+        thread = comment.format(thread)
+
+    return u'<html><body><div id="comments">{0}</div></body></html>'.format(
+        thread * threads)
+
+
+def bench_bodies(siteconfigs, repeat=5):
+    """ Extraction of thousands of nested body items. """
+
+    html = make_comments_page()
+    config = ftr.SiteConfig(site_config_text=u'body: //div[@class="comment"]'
+                            u'\nprune: no\ntidy: no\n').freeze()
+    best_time = None
+
+    for iteration in range(repeat):
+        extractor = ftr.ContentExtractor(config)
+        start = time.time()
+
+        extractor.process(html)
+
+        extraction_time = time.time() - start
+
+        if best_time is None or extraction_time < best_time:
+            best_time = extraction_time
+
+    kept = len(lxml.etree.fromstring(extractor.body))
+
+    print u'{0} body items, {1} kept: best of {2}: {3:.3f}s.'.format(
+        html.count(u'class="comment"'), kept, repeat, best_time)
+
+
+def bench_replacements(siteconfigs, repeat=20):
+    """ find_string/replace_string pairs, done in turn or compiled. """
+
+    html = make_page(parts=20) * 10
+
+    for count in (5, 30, 50):
+        config = ftr.SiteConfig(site_config_text=u''.join(
+            u'replace_string(<p class="x{0}">): <p>\n'.format(x)
+            for x in range(count)) + u'replace_string(<ul id="nav">): <ul>\n')
+
+        start = time.time()
+
+        for iteration in range(repeat):
+            result = html
+
+            for find_string, replace_string in config.replace_patterns:
+                result = result.replace(find_string, replace_string)
+
+        sequential_time = time.time() - start
+
+        start = time.time()
+
+        for iteration in range(repeat):
+            config.replace(html)
+
+        compiled_time = time.time() - start
+
+        print u'{0:2} pairs on {1}KiB: {2:5.2f}ms in turn, {3:5.2f}ms ' \
+            u'compiled.'.format(count + 1, len(html) // 1024,
+                                sequential_time * 1000 / repeat,
+                                compiled_time * 1000 / repeat)
+
+
+BENCHMARKS = (
+    ('memory', bench_memory),
+    ('parser', bench_parser),
+    ('extraction', bench_extraction),
+    ('bodies', bench_bodies),
+    ('replacements', bench_replacements),
+)
+
+
+def bench():
+    """ Run benchmarks given on the command line, or all of them. """
+
+    logging.disable(logging.WARNING)
+
+    names = sys.argv[1:] or [name for name, function in BENCHMARKS]
+
+    siteconfigs = load_siteconfigs()
+
+    for name, function in BENCHMARKS:
+        if name in names:
+            print u'-- {0}: {1}'.format(name, function.__doc__.strip())
+            function(siteconfigs)
+            print
+
+if __name__ == '__main__':
+    bench()
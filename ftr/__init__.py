@@ -29,6 +29,14 @@ from .version import version  # NOQA
 
 from .config import (  # NOQA
     ftr_get_config as get_config,
+    ftr_get_site_config as get_site_config,
+    ftr_get_config_async as get_config_async,
+    ftr_get_site_config_async as get_site_config_async,
+    ftr_config_cache_stats as config_cache_stats,
+    ftr_invalidate_not_found as invalidate_not_found,
+    ftr_resolve_hosts as resolve_hosts,
+    ftr_reload_siteconfigs as reload_siteconfigs,
+    ftr_preload_siteconfigs as preload_siteconfigs,
     SiteConfig,
     SiteConfigException,
     SiteConfigNotFound,
@@ -36,7 +44,12 @@ from .config import (  # NOQA
     NoTestUrlException,
 )
 
+from .repository import (  # NOQA
+    ftr_repositories_health as repositories_health,
+)
+
 from .extractor import (  # NOQA
+    ftr_extraction_stats as extraction_stats,
     ContentExtractor
 )
 
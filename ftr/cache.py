@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+u""" Python FTR in-process cache utilities.
+
+:mod:`cacheops` stays the main cache for site configs when it is installed.
+The caches here are helpers for things that must not or cannot go
+through it (eg. negative lookups that need their own expiration delay),
+in-process or on disk.
+
+.. Copyright 2015 Olivier Cortès <oc@1flow.io>.
+
+    This file is part of the python-ftr project.
+
+    python-ftr is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of
+    the License, or (at your option) any later version.
+
+    python-ftr is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public
+    License along with python-ftr. If not, see http://www.gnu.org/licenses/
+"""
+
+import os
+import time
+import zlib
+import errno
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MemoryCache(object):
+
+    """ A thread-safe, size-bounded LRU cache with optional expiration.
+
+    :param maxsize: the maximum number of entries. When full, the least
+        recently used entry is evicted.
+    :type maxsize: int
+
+    :param timeout: entries expiration delay, in seconds. ``None`` or
+        ``0`` means entries never expire (they still can be evicted).
+    :type timeout: int or None
+    """
+
+    def __init__(self, maxsize=1024, timeout=None):
+        """ Create an empty cache. """
+
+        self.maxsize = maxsize
+        self.timeout = timeout or None
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """ Return the number of entries, including expired ones. """
+
+        return len(self._data)
+
+    def __contains__(self, key):
+        """ Return ``True`` if ``key`` is in the cache and not expired. """
+
+        missing = object()
+
+        return self.get(key, missing, _count=False) is not missing
+
+    def get(self, key, default=None, _count=True):
+        """ Return the value cached for ``key``, or ``default``. """
+
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+
+            except KeyError:
+                if _count:
+                    self.misses += 1
+                return default
+
+            if expires is not None and expires < time.time():
+                if _count:
+                    self.misses += 1
+                return default
+
+            # Re-insert to mark the entry as the most recently used.
+            self._data[key] = (expires, value)
+
+            if _count:
+                self.hits += 1
+
+            return value
+
+    def set(self, key, value, timeout=None):
+        """ Cache ``value`` for ``key``.
+
+        :param timeout: overrides the cache default timeout for this entry.
+        """
+
+        timeout = timeout or self.timeout
+        expires = None if timeout is None else time.time() + timeout
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """ Remove ``key`` from the cache, if present. """
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_matching(self, predicate):
+        """ Remove all entries whose key satisfies ``predicate(key)``.
+
+        :returns: int -- the number of removed entries.
+        """
+
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+
+            for key in keys:
+                del self._data[key]
+
+        return len(keys)
+
+    def clear(self):
+        """ Remove all entries. Hit and miss counters are kept. """
+
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """ Return a ``dict`` with ``size``, ``hits`` and ``misses`` keys. """
+
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class DiskCache(object):
+
+    """ A size-bounded cache of pickled objects, one file per entry.
+
+    Entries are zlib-compressed pickles, written atomically, and read
+    only when requested. Unreadable entries are considered missing. When
+    the cache holds more than ``maxsize`` entries, the least recently
+    written ones are removed.
+
+    Write errors (eg. read-only filesystem) are logged and ignored: the
+    cache is an optimization, not a requirement.
+
+    .. warning:: Entries are unpickled, and unpickling can run arbitrary
+        code. Anyone who can write in ``directory`` can thus run code in
+        the processes using the cache: it must be writable only by the
+        users running them, never shared with untrusted ones.
+
+    :param directory: where to store entries. Created when needed.
+    :type directory: str or unicode
+
+    :param maxsize: the maximum number of entries, or ``None``.
+    :type maxsize: int or None
+    """
+
+    def __init__(self, directory, maxsize=10000):
+        """ Create a cache, without touching the disk yet. """
+
+        self.directory = directory
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._writes = 0
+
+    def _filename(self, key):
+        """ Return the entry filename for ``key``. """
+
+        return os.path.join(self.directory,
+                            hashlib.sha1(repr(key)).hexdigest())
+
+    def get(self, key, default=None):
+        """ Return the value cached for ``key``, or ``default``. """
+
+        try:
+            with open(self._filename(key), 'rb') as f:
+                stored_key, value = pickle.loads(zlib.decompress(f.read()))
+
+        except Exception:
+            # Missing, truncated, or written by an incompatible version.
+            stored_key = None
+
+        if stored_key != key:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """ Cache ``value`` for ``key``, replacing any previous value. """
+
+        try:
+            try:
+                os.makedirs(self.directory)
+
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+            data = zlib.compress(
+                pickle.dumps((key, value), pickle.HIGHEST_PROTOCOL))
+
+            descriptor, temporary = tempfile.mkstemp(dir=self.directory,
+                                                     prefix='.')
+            with os.fdopen(descriptor, 'wb') as f:
+                f.write(data)
+
+            # Concurrent readers see the old entry or the new one.
+            os.rename(temporary, self._filename(key))
+
+        except (IOError, OSError, pickle.PicklingError), e:
+            LOGGER.debug(u'Could not write cache entry in %s: %s.',
+                         self.directory, e)
+            return
+
+        self._writes += 1
+
+        if self.maxsize and self._writes % max(self.maxsize // 10, 1) == 0:
+            self.prune()
+
+    def delete(self, key):
+        """ Remove ``key`` from the cache, if present. """
+
+        try:
+            os.unlink(self._filename(key))
+
+        except OSError:
+            pass
+
+    def _entries(self):
+        """ Return entries filenames, ignoring temporary files. """
+
+        try:
+            return [
+                os.path.join(self.directory, x)
+                for x in os.listdir(self.directory) if not x.startswith('.')
+            ]
+
+        except OSError:
+            return []
+
+    def prune(self):
+        """ Remove the oldest entries if there are more than ``maxsize``. """
+
+        if not self.maxsize:
+            return
+
+        entries = []
+
+        for filename in self._entries():
+            try:
+                entries.append((os.stat(filename).st_mtime, filename))
+
+            except OSError:
+                continue
+
+        entries.sort()
+
+        for mtime, filename in entries[:-self.maxsize]:
+            try:
+                os.unlink(filename)
+
+            except OSError:
+                pass
+
+    def clear(self):
+        """ Remove all entries. """
+
+        for filename in self._entries():
+            try:
+                os.unlink(filename)
+
+            except OSError:
+                pass
+
+    def stats(self):
+        """ Return a ``dict`` with ``size``, ``hits`` and ``misses`` keys. """
+
+        return {
+            'size': len(self._entries()),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
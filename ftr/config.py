@@ -27,8 +27,14 @@ named after the website they hold rules for.
 """
 import os
 import re
+import time
+import hashlib
 import codecs
 import logging
+import sqlite3
+import threading
+
+from itertools import imap, izip
 
 LOGGER = logging.getLogger(__name__)
 
@@ -38,6 +44,7 @@ if bool(os.environ.get('FTR_TEST_ENABLE_SQLITE_LOGGING', False)):
 
 try:
     import requests
+    from lxml import etree
     from ordered_set import OrderedSet
     from sparks.utils.http import split_url
 
@@ -47,10 +54,29 @@ except ImportError:
     # Yeah I know it's an evil hack.
     pass
 
+from .version import version as ftr_version
+from .cache import MemoryCache, DiskCache
+from .repository import (
+    SQLITE_PREFIX,
+    SiteConfigTrie,
+    ftr_get_local_index,
+    ftr_get_repository_health,
+    ftr_get_sqlite_repository,
+    ftr_get_thread_pool,
+    ftr_get_validators,
+    ftr_http_get,
+    ftr_http_get_conditional,
+)
+
 try:
     from cacheops import cached
 
+    # Lookups are cached, and must be invalidated when siteconfigs change.
+    LOOKUPS_CACHED = True
+
 except Exception, e:
+    LOOKUPS_CACHED = False
+
     LOGGER.warning(u'Cacheops seems not installed or not importable '
                    u'(exception was: %s). Running without cache.', e)
     from functools import wraps
@@ -62,197 +88,1547 @@ except Exception, e:
             @wraps(func)
             def wrapper(*args, **kwargs):
                 return func(*args, **kwargs)
+
+            # Same API as cacheops, used by ftr_reload_siteconfigs().
+            wrapper.invalidate = lambda *args, **kwargs: None
             return wrapper
         return decorator
 
 
-# defaults to 3 days of caching for website configuration
-CACHE_TIMEOUT = int(os.environ.get('PYTHON_FTR_CACHE_TIMEOUT', 345600))
+# defaults to 3 days of caching for website configuration
+CACHE_TIMEOUT = int(os.environ.get('PYTHON_FTR_CACHE_TIMEOUT', 345600))
+
+# Lookups are kept longer than CACHE_TIMEOUT, to revalidate expired remote
+# siteconfigs from their cached validators. Defaults to 30 days.
+VALIDATORS_TIMEOUT = max(CACHE_TIMEOUT, int(os.environ.get(
+    'PYTHON_FTR_VALIDATORS_TIMEOUT', 2592000)))
+
+# test.py will set this to any random integer to fake cache
+# invalidation without invalidating the fetched HTML pages.
+FTR_CONFIG_ALWAYS_RELOAD = 0
+
+# Counters for the siteconfig cache, see ftr_config_cache_stats().
+CONFIG_CACHE_STATS = {'lookups': 0, 'misses': 0, 'joined': 0}
+CONFIG_CACHE_STATS_LOCK = threading.Lock()
+
+# Running asynchronous lookups, by key, see _ftr_submit_lookup().
+IN_FLIGHT_LOOKUPS = {}
+IN_FLIGHT_LOOKUPS_LOCK = threading.Lock()
+
+# Revalidated lookup results, by lookup key, to be cached again by
+# _ftr_lookup_config(), see _ftr_revalidate_lookup().
+REVALIDATED_LOOKUPS = {}
+REVALIDATED_LOOKUPS_LOCK = threading.Lock()
+
+# Negative lookups (SiteConfigNotFound) are cached separately, for a
+# shorter time than positive ones: a siteconfig can be created at any
+# moment. Default: 1 hour, 10000 hosts. Set the timeout to 0 to disable.
+NOT_FOUND_CACHE_TIMEOUT = int(os.environ.get(
+    'PYTHON_FTR_NOT_FOUND_CACHE_TIMEOUT', 3600))
+NOT_FOUND_CACHE = MemoryCache(
+    maxsize=int(os.environ.get('PYTHON_FTR_NOT_FOUND_CACHE_SIZE', 10000)),
+    timeout=NOT_FOUND_CACHE_TIMEOUT,
+)
+
+# Probe repositories in parallel, see _ftr_lookup_config().
+CONCURRENT_LOOKUPS = bool(int(os.environ.get(
+    'PYTHON_FTR_CONCURRENT_LOOKUPS', 0)))
+
+# Outcomes of repository probes, see _ftr_lookup_config().
+PROBE_FOUND = 'found'
+PROBE_MISS = 'miss'
+PROBE_SKIP = 'skip'
+PROBE_UNREACHABLE = 'unreachable'
+PROBE_CANCELLED = 'cancelled'
+PROBE_BREAKER_OPEN = 'breaker_open'
+
+# Parsed and frozen SiteConfig instances, see ftr_get_site_config().
+SITECONFIG_CACHE = MemoryCache(maxsize=int(os.environ.get(
+    'PYTHON_FTR_SITECONFIG_CACHE_SIZE', 1000)))
+
+# Parsed SiteConfig instances can also be kept on disk, for new processes
+# to start hot. Disabled unless PYTHON_FTR_DISK_CACHE_DIR is set: entries
+# are unpickled, the directory must be writable only by trusted users.
+DISK_CACHE_DIR = os.environ.get('PYTHON_FTR_DISK_CACHE_DIR', u'')
+SITECONFIG_DISK_CACHE = DiskCache(
+    os.path.join(DISK_CACHE_DIR, u'siteconfigs'),
+    maxsize=int(os.environ.get('PYTHON_FTR_DISK_CACHE_SIZE', 10000)),
+) if DISK_CACHE_DIR else None
+
+# Merge siteconfigs of parent domains and the global one, see the
+# cascade parameter of ftr_get_site_config().
+CASCADE = bool(int(os.environ.get('PYTHON_FTR_CASCADE', 0)))
+GLOBAL_SITECONFIG = os.environ.get('PYTHON_FTR_GLOBAL_SITECONFIG', u'global')
+
+# Compiled XPath expressions inherited from a parent process, see
+# SiteConfigXPathsMixin._get_xpaths().
+FORKED_XPATHS = []
+
+# Siteconfigs read by ftr_preload_siteconfigs(): for each repository, a
+# SiteConfigTrie of _ftr_find_config() tuples. Lookups find them there
+# until the repository changes, see _ftr_probe_preloaded().
+PRELOADED_REPOSITORIES = {}
+
+# From this number of consecutive find_string/replace_string pairs, they
+# are replaced in one regular expression pass; below, one str.replace()
+# per pair is faster. See _ftr_compile_replacements().
+REPLACEMENTS_SINGLE_PASS = int(os.environ.get(
+    'PYTHON_FTR_REPLACEMENTS_SINGLE_PASS', 30))
+
+# Hot reload of local siteconfigs, see ftr_reload_siteconfigs(). Set to
+# a delay in seconds to check local repositories at most that often.
+RELOAD_INTERVAL = float(os.environ.get('PYTHON_FTR_RELOAD_INTERVAL', 0))
+RELOAD_NEXT_CHECK = 0
+RELOAD_LOCK = threading.Lock()
+
+# Part of lookup cache keys, increased when local repositories change.
+RELOAD_GENERATION = 0
+
+# Local repository → version (see _ftr_repository_version()).
+RELOAD_REPOSITORIES = {}
+
+# Local siteconfig filename → SiteConfigWatch, see _ftr_watch_siteconfig().
+RELOAD_WATCHES = {}
+RELOAD_WATCHES_LOCK = threading.Lock()
+
+# Above this number of lookups returning the same siteconfig (eg. a
+# wildcard one), they are not recorded: all lookups are forgotten when
+# it changes.
+RELOAD_MAX_LOOKUP_KEYS = 100
+
+HOSTNAME_REGEX = re.compile(
+    r'/^(([a-z0-9-]*[a-z0-9])\.)*([a-z0-9-]*[a-z0-9])$/',
+    re.IGNORECASE | re.UNICODE
+)
+
+
+class SiteConfigException(Exception):
+
+    """ Abstract base class for all :class:`SiteConfig` related exceptions.
+
+    Never raised directly, but you can catch it in an `except` block to
+    get them all at once.
+    """
+
+    pass
+
+
+class SiteConfigNotFound(SiteConfigException):
+
+    """ Raised when no site config can be found for a given website or url. """
+
+    pass
+
+
+class InvalidSiteConfig(SiteConfigException):
+
+    """ Raised when an unrecoverable error is found in a site config.
+
+    Eg. when it has a very bad syntax error or a missing mandatory directive.
+
+    As of version 0.5, all directives are optional, thus this exception
+    is raised only in case of a non-matching number of ``find_string``
+    / ``replace_string`` pairs, or of an XPath expression that does not
+    compile (see :meth:`SiteConfig.compile`). This could change in the
+    future.
+    """
+
+    pass
+
+
+class NoTestUrlException(SiteConfigException):
+
+    """ Raised when a site config does not contain any test URL. """
+
+    def __init__(self, filename, siteconfig_name, *args, **kwargs):
+        """ pep257, you know how MUCH I love you. """
+        self.filename = filename
+        self.siteconfig_name = siteconfig_name
+
+        super(NoTestUrlException, self).__init__(*args, **kwargs)
+
+
+def ftr_get_repositories():
+    """ Return the list of siteconfig repositories to look configs up in.
+
+    Repositories are read from the ``PYTHON_FTR_REPOSITORIES`` environment
+    variable (space separated). They can be local directories, SQLite
+    databases (``sqlite:///path/to/siteconfigs.db``, see
+    :mod:`ftr.repository`) or remote ``http(s)`` URLs. Order matters: the
+    first repository has precedence.
+
+    :returns: list of unicode strings.
+    """
+
+    return [
+        x.strip() for x in os.environ.get(
+            'PYTHON_FTR_REPOSITORIES',
+            os.path.expandvars(u'${HOME}/sources/ftr-site-config') + u' '
+            + u'https://raw.githubusercontent.com/1flow/ftr-site-config/master/ '  # NOQA
+            + u'https://raw.githubusercontent.com/fivefilters/ftr-site-config/master/'  # NOQA
+        ).split() if x.strip() != u'']
+
+
+def ftr_get_domain_names(website_url, exact_host_match=False):
+    """ Return the domain names to look siteconfigs up, most specific first.
+
+    :param website_url: see :func:`ftr_get_config`.
+    :param exact_host_match: see :func:`ftr_get_config`.
+
+    :returns: list of unicode strings. For ``http://www.test.example.org/a``
+        it will be ``[u'test.example.org', u'example.org']``, or only
+        ``[u'test.example.org']`` if ``exact_host_match`` is ``True``.
+    """
+
+    try:
+        proto, host_and_port, remaining = split_url(website_url)
+
+    except:
+        host_and_port = website_url
+
+    # Host names are case insensitive, siteconfig names are lowercase.
+    host_domain_parts = host_and_port.lower().split(u'.')
+
+    # we don't store / use the “www.” part of domain name in siteconfig.
+    if host_domain_parts[0] == u'www':
+        host_domain_parts = host_domain_parts[1:]
+
+    if exact_host_match:
+        return [u'.'.join(host_domain_parts)]
+
+    return [
+        u'.'.join(host_domain_parts[-i:])
+        for i in reversed(range(2, len(host_domain_parts) + 1))
+    ]
+
+
+def ftr_resolve_hosts(website_urls, exact_host_match=False):
+    """ Find the siteconfig names of many websites at once, quickly.
+
+    Only local repositories (directories and SQLite databases) are
+    considered: their siteconfig names are indexed in a
+    :class:`~ftr.repository.SiteConfigTrie`, and each website costs one
+    walk in it. Remote repositories cannot be listed and are ignored.
+    Nothing is downloaded, parsed nor cached.
+
+    :param website_urls: URLs or domain names, see :func:`ftr_get_config`.
+    :type website_urls: iterable of str or unicode
+
+    :param exact_host_match: see :func:`ftr_get_config`.
+
+    :returns: a ``dict`` of website URL → ``(repository,
+        siteconfig_name)`` tuple, or ``None`` if no local repository
+        holds a siteconfig for it.
+    """
+
+    tries = []
+
+    for repository in ftr_get_repositories():
+        if repository.startswith('http'):
+            continue
+
+        elif repository.startswith(SQLITE_PREFIX):
+            try:
+                trie = ftr_get_sqlite_repository(repository).get_trie()
+
+            except (OSError, sqlite3.Error), e:
+                LOGGER.error(u'“%s” repository could not be read (%s).',
+                             repository, e)
+                continue
+
+        else:
+            index = ftr_get_local_index(repository)
+
+            if index is None:
+                continue
+
+            trie = index.trie
+
+        tries.append((repository, trie))
+
+    resolved = {}
+
+    for website_url in website_urls:
+        domain_names = ftr_get_domain_names(website_url, exact_host_match)
+        resolved[website_url] = None
+
+        for repository, trie in tries:
+            found = trie.lookup(domain_names)
+
+            if found is not None:
+                resolved[website_url] = repository, found[1]
+                break
+
+    return resolved
+
+
+class SiteConfigWatch(object):
+
+    """ What to invalidate when a local siteconfig file changes.
+
+    See :func:`ftr_reload_siteconfigs`.
+    """
+
+    __slots__ = ('version', 'lookup_keys', 'cache_keys', 'previous_keys', )
+
+    def __init__(self, version, previous_keys=()):
+        """ Watch a siteconfig file, at ``version``. """
+
+        self.version = version
+
+        # Arguments of _ftr_lookup_config() calls that returned the file,
+        # ``None`` if there are too many, see RELOAD_MAX_LOOKUP_KEYS.
+        self.lookup_keys = set()
+
+        # SITECONFIG_CACHE keys of its parsed instances.
+        self.cache_keys = set()
+
+        # Those of previous versions, to serve them if this one is
+        # invalid, see _ftr_previous_site_config().
+        self.previous_keys = set(previous_keys)
+
+
+def _ftr_watch_siteconfig(source, version, lookup_key=None, cache_key=None):
+    """ Record that a lookup or a parsed config comes from ``source``.
+
+    Only local siteconfig files are watched, see
+    :func:`ftr_reload_siteconfigs`.
+    """
+
+    if source.startswith(u'http') or source.startswith(SQLITE_PREFIX):
+        return
+
+    with RELOAD_WATCHES_LOCK:
+        watch = RELOAD_WATCHES.get(source)
+
+        if watch is None:
+            watch = RELOAD_WATCHES[source] = SiteConfigWatch(version)
+
+        elif watch.version != version:
+            # Changed without ftr_reload_siteconfigs() noticing yet.
+            watch = RELOAD_WATCHES[source] = SiteConfigWatch(
+                version, (key for key in watch.cache_keys | watch.previous_keys
+                          if key in SITECONFIG_CACHE))
+
+        if lookup_key is not None and LOOKUPS_CACHED \
+                and watch.lookup_keys is not None:
+            if len(watch.lookup_keys) < RELOAD_MAX_LOOKUP_KEYS:
+                watch.lookup_keys.add(lookup_key)
+
+            else:
+                watch.lookup_keys = None
+
+        if cache_key is not None:
+            watch.cache_keys.add(cache_key)
+
+
+def _ftr_previous_site_config(source, matched_host, cache_key):
+    """ Return a valid parsed version of a siteconfig that became invalid.
+
+    :returns: a :class:`FrozenSiteConfig` instance, or ``None``.
+    """
+
+    with RELOAD_WATCHES_LOCK:
+        watch = RELOAD_WATCHES.get(source)
+
+        if watch is None:
+            return None
+
+        keys = watch.cache_keys | watch.previous_keys
+
+    for key in keys:
+        if key != cache_key and key[0] == matched_host:
+            config = SITECONFIG_CACHE.get(key)
+
+            if config is not None:
+                return config
+
+
+def _ftr_repository_version(repository):
+    """ Return what changes when siteconfigs are added to a repository.
+
+    That is the path and modification time of a directory (or of its
+    target, for a symlink), or the inode and modification time of an
+    SQLite database. ``None`` if the repository is not accessible.
+    """
+
+    try:
+        if repository.startswith(SQLITE_PREFIX):
+            stat = os.stat(repository[len(SQLITE_PREFIX):])
+            return stat.st_ino, stat.st_mtime
+
+        realpath = os.path.realpath(repository)
+        return realpath, os.stat(realpath).st_mtime
+
+    except OSError:
+        return None
+
+
+def _ftr_reload_repositories():
+    """ Forget all lookups if any local repository changed.
+
+    :returns: list of changed repositories.
+    """
+
+    global RELOAD_GENERATION
+
+    changed = []
+
+    for repository in ftr_get_repositories():
+        if repository.startswith(u'http'):
+            continue
+
+        version = _ftr_repository_version(repository)
+
+        if repository in RELOAD_REPOSITORIES \
+                and RELOAD_REPOSITORIES[repository] != version:
+            changed.append(repository)
+            ftr_invalidate_not_found(repository=repository)
+            PRELOADED_REPOSITORIES.pop(repository, None)
+
+        RELOAD_REPOSITORIES[repository] = version
+
+    if changed:
+        # Siteconfigs were added, removed or renamed. They can shadow
+        # any lookup result, even from other repositories.
+        RELOAD_GENERATION += 1
+
+        LOGGER.info(u'Local repositories %s changed, forgetting all '
+                    u'lookups.', u', '.join(changed))
+
+    return changed
+
+
+def _ftr_reload_siteconfig(filename, watch):
+    """ Re-parse a changed siteconfig, and invalidate the old one.
+
+    :returns: bool -- ``False`` if the new version is invalid, in which
+        case the old one is kept (see :func:`_ftr_build_site_config`).
+    """
+
+    global RELOAD_GENERATION
+
+    new_cache_keys = set()
+
+    try:
+        with codecs.open(filename, 'rb', encoding='utf8') as f:
+            config_string = f.read()
+
+    except IOError:
+        # Removed: the next lookup will find another siteconfig.
+        config_string = None
+
+    if config_string is not None:
+        content_hash = hashlib.sha1(config_string.encode('utf-8')).hexdigest()
+
+        # Merged configs (see _ftr_find_cascade()) are keyed by a tuple
+        # of hosts. They will be merged again, when next used.
+        for matched_host in set(x[0] for x in watch.cache_keys
+                                | watch.previous_keys
+                                if isinstance(x[0], basestring)):
+            cache_key = (matched_host, content_hash)
+
+            if cache_key in SITECONFIG_CACHE:
+                # Unchanged content, eg. a touched file.
+                new_cache_keys.add(cache_key)
+                continue
+
+            try:
+                config = SiteConfig(site_config_text=config_string,
+                                    host=matched_host).freeze()
+
+            except InvalidSiteConfig, e:
+                LOGGER.error(u'Changed siteconfig %s is invalid, keeping '
+                             u'the previous version (%s).', filename, e)
+                return False
+
+            # Ready before anyone looks it up. In-flight extractions
+            # keep using the previous instance.
+            SITECONFIG_CACHE.set(cache_key, config)
+            new_cache_keys.add(cache_key)
+
+    if watch.lookup_keys is None:
+        RELOAD_GENERATION += 1
+
+    else:
+        for lookup_key in watch.lookup_keys:
+            _ftr_lookup_config.invalidate(*lookup_key)
+
+    for cache_key in (watch.cache_keys | watch.previous_keys) \
+            - new_cache_keys:
+        SITECONFIG_CACHE.delete(cache_key)
+
+    LOGGER.info(u'Reloaded siteconfig %s.', filename)
+
+    return True
+
+
+def ftr_reload_siteconfigs():
+    """ Pick up changes in local repositories, without restarting.
+
+    Siteconfig files used by this process are checked with one
+    ``stat()`` each. For each changed file, the new version is parsed
+    and compiled, and put in the cache of :func:`ftr_get_site_config`
+    before the cached lookups that led to the old one are forgotten:
+    lookups switch to the new instance atomically, while extractions
+    running with the old one are left alone. If the new version is
+    invalid, the old one is kept, and returned by
+    :func:`ftr_get_site_config` until the file changes again.
+
+    When siteconfigs are added, removed or renamed in a local
+    repository (directory or SQLite database), all lookups are
+    forgotten. Their results are then looked up again, but parsed
+    siteconfigs that did not change are not parsed again.
+
+    Set the ``PYTHON_FTR_RELOAD_INTERVAL`` environment variable to a
+    delay in seconds to call this automatically, at most once per delay,
+    from :func:`ftr_get_config` and :func:`ftr_get_site_config`. Other
+    threads do not wait for the check. It is disabled by default.
+
+    :returns: list of the changed siteconfig file names.
+    """
+
+    with RELOAD_LOCK:
+        return _ftr_reload_siteconfigs()
+
+
+def _ftr_reload_siteconfigs():
+    """ Implement :func:`ftr_reload_siteconfigs`, with the lock held. """
+
+    _ftr_reload_repositories()
+
+    changed = []
+
+    for filename, watch in RELOAD_WATCHES.items():
+        try:
+            version = _ftr_local_version(os.stat(filename))
+
+        except OSError:
+            version = None
+
+        if version == watch.version:
+            continue
+
+        changed.append(filename)
+
+        for repository in PRELOADED_REPOSITORIES.keys():
+            if filename.startswith(os.path.join(repository, u'')):
+                PRELOADED_REPOSITORIES.pop(repository, None)
+
+        if _ftr_reload_siteconfig(filename, watch):
+            with RELOAD_WATCHES_LOCK:
+                if RELOAD_WATCHES.get(filename) is watch:
+                    del RELOAD_WATCHES[filename]
+
+        else:
+            # Do not try again until it changes.
+            watch.version = version
+
+    return changed
+
+
+def _ftr_poll_reload():
+    """ Run :func:`ftr_reload_siteconfigs` if no other thread does. """
+
+    global RELOAD_NEXT_CHECK
+
+    if not RELOAD_LOCK.acquire(False):
+        return
+
+    try:
+        if time.time() >= RELOAD_NEXT_CHECK:
+            RELOAD_NEXT_CHECK = time.time() + RELOAD_INTERVAL
+            _ftr_reload_siteconfigs()
+
+    except Exception:
+        LOGGER.exception(u'Could not reload siteconfigs.')
+
+    finally:
+        RELOAD_LOCK.release()
+
+
+def ftr_config_cache_stats():
+    """ Return the :func:`ftr_get_config` cache counters.
+
+    :returns: a ``dict`` with ``lookups``, ``hits``, ``misses`` and
+        ``joined`` keys. A miss is a lookup that had to probe the
+        repositories; without :mod:`cacheops` installed, every lookup is
+        a miss. ``joined`` counts asynchronous lookups that joined the
+        same lookup already running, see :func:`ftr_get_config_async`.
+    """
+
+    with CONFIG_CACHE_STATS_LOCK:
+        lookups = CONFIG_CACHE_STATS['lookups']
+        misses = CONFIG_CACHE_STATS['misses']
+        joined = CONFIG_CACHE_STATS['joined']
+
+    return {
+        'lookups': lookups,
+        'hits': lookups - misses,
+        'misses': misses,
+        'joined': joined,
+    }
+
+
+def ftr_reset_config_cache_stats():
+    """ Reset the counters returned by :func:`ftr_config_cache_stats`. """
+
+    with CONFIG_CACHE_STATS_LOCK:
+        for key in CONFIG_CACHE_STATS:
+            CONFIG_CACHE_STATS[key] = 0
+
+
+def ftr_invalidate_not_found(website_url=None, repository=None):
+    """ Forget cached :class:`SiteConfigNotFound` lookups.
+
+    Call it after a siteconfig has been added to a repository. Without
+    arguments, the whole negative cache is cleared.
+
+    :param website_url: only forget lookups that involved the domain
+        names of this URL or hostname (see :func:`ftr_get_domain_names`).
+    :type website_url: str, unicode or None
+
+    :param repository: only forget lookups that involved this repository.
+    :type repository: str, unicode or None
+
+    :returns: int -- the number of forgotten lookups.
+    """
+
+    if website_url is None and repository is None:
+        count = len(NOT_FOUND_CACHE)
+        NOT_FOUND_CACHE.clear()
+        return count
+
+    domain_names = set() if website_url is None else set(
+        ftr_get_domain_names(website_url))
+
+    def matches(key):
+        key_domain_names, key_repositories = key
+
+        if repository is not None and repository not in key_repositories:
+            return False
+
+        return not domain_names or bool(domain_names & set(key_domain_names))
+
+    return NOT_FOUND_CACHE.delete_matching(matches)
+
+
+def ftr_get_config(website_url, exact_host_match=False):
+    """ Download the Five Filters config from centralized repositories.
+
+    Repositories can be local if you need to override siteconfigs.
+
+    The first entry found is returned. If no configuration is found,
+    `None` is returned. If :mod:`cacheops` is installed, the result will
+    be cached with a default expiration delay of 3 days.
+
+    The cache is keyed on the domain names derived from ``website_url``
+    (see :func:`ftr_get_domain_names`), not on the URL itself: all
+    articles from ``www.example.com`` share the same cache entry. See
+    :func:`ftr_config_cache_stats` for hit/miss counters.
+
+    Failed lookups are cached too, in a bounded in-process cache with
+    its own expiration delay (environment variable
+    ``PYTHON_FTR_NOT_FOUND_CACHE_TIMEOUT``, 1 hour by default). See
+    :func:`ftr_invalidate_not_found` to forget them earlier.
+
+    Set the ``PYTHON_FTR_CONCURRENT_LOOKUPS`` environment variable to
+    ``1`` to probe remote repositories in parallel; the result is the
+    same as with the default, sequential probing.
+
+    When the cache expires, remote siteconfigs are revalidated with
+    conditional requests, from the ``ETag`` / ``Last-Modified`` stored
+    with the cached result: unchanged ones are not downloaded again, and
+    they are kept until the next expiration if their repository cannot
+    be reached. The result is thus kept in cache longer than its
+    expiration delay (environment variable
+    ``PYTHON_FTR_VALIDATORS_TIMEOUT``, 30 days by default).
+
+    :param exact_host_match: If ``False`` (default), we will look for
+        wildcard config matches. For example if host is
+        ``www.test.example.org``, we will try looking up
+        ``test.example.org`` and ``example.org``.
+    :param exact_host_match: bool
+
+    :param website_url: either a full web URI (eg.
+        ``http://www.website.com:PORT/path/to/a/page.html``) or simply
+        a domain name (eg. ``www.website.com``). In case of a domain name,
+        no check is performed yet, be careful of what you pass.
+    :type website_url: str or unicode
+
+    :returns: tuple -- the loaded site config (as unicode string) and
+        the hostname matched (unicode string too).
+
+    :raises: :class:`SiteConfigNotFound` if no config could be found.
+        Remote repositories that cannot be reached are skipped, and
+        listed in the exception ``unreachable_repositories`` attribute.
+        So are repositories that failed repeatedly, for a cooldown
+        period (see :class:`~ftr.repository.RepositoryHealth` and
+        :func:`~ftr.repository.ftr_repositories_health`).
+
+    .. note:: Whatever ``exact_host_match`` value is, the ``www`` part is
+        always removed from the URL or domain name.
+
+    .. note:: Only the first siteconfig found is returned. See the
+        ``cascade`` parameter of :func:`ftr_get_site_config` to merge
+        all of them, like the original Five Filters implementation.
+    """
+
+    return _ftr_find_config(website_url, exact_host_match)[:2]
+
+
+def ftr_get_config_async(website_url, exact_host_match=False):
+    """ Run :func:`ftr_get_config` without blocking the caller.
+
+    The lookup runs in a thread pool (see
+    :func:`ftr.repository.ftr_get_thread_pool`), and shares all caches
+    with synchronous lookups. Concurrent lookups of the same website
+    (more exactly, of the same domain names) share a single run.
+
+    :param website_url: see :func:`ftr_get_config`.
+    :param exact_host_match: see :func:`ftr_get_config`.
+
+    :returns: a :class:`multiprocessing.pool.AsyncResult`. Its ``get()``
+        method returns what :func:`ftr_get_config` returns, or raises
+        the same exceptions. It can be shared with other callers.
+    """
+
+    return _ftr_submit_lookup(
+        ('config', tuple(ftr_get_domain_names(website_url, exact_host_match)),
+         exact_host_match),
+        ftr_get_config, website_url, exact_host_match)
+
+
+def ftr_get_site_config_async(website_url, exact_host_match=False,
+                              cascade=None):
+    """ Run :func:`ftr_get_site_config` without blocking the caller.
+
+    See :func:`ftr_get_config_async` for details. The result is the
+    shared :class:`FrozenSiteConfig` instance.
+    """
+
+    if cascade is None:
+        cascade = CASCADE
+
+    return _ftr_submit_lookup(
+        ('site_config',
+         tuple(ftr_get_domain_names(website_url, exact_host_match)),
+         exact_host_match, cascade),
+        ftr_get_site_config, website_url, exact_host_match, cascade)
+
+
+def _ftr_submit_lookup(key, function, *args):
+    """ Run ``function(*args)`` in the async pool, once per ``key``.
+
+    If a lookup with the same ``key`` is running, its result is returned
+    instead of starting another one. It is forgotten once finished:
+    following lookups hit the caches.
+    """
+
+    def run():
+        try:
+            return function(*args)
+
+        finally:
+            with IN_FLIGHT_LOOKUPS_LOCK:
+                IN_FLIGHT_LOOKUPS.pop(key, None)
+
+    with IN_FLIGHT_LOOKUPS_LOCK:
+        result = IN_FLIGHT_LOOKUPS.get(key)
+
+        if result is None:
+            result = IN_FLIGHT_LOOKUPS[key] = ftr_get_thread_pool(
+                'async').apply_async(run)
+            return result
+
+    with CONFIG_CACHE_STATS_LOCK:
+        CONFIG_CACHE_STATS['joined'] += 1
+
+    return result
+
+
+def _ftr_find_config(website_url, exact_host_match=False):
+    """ Implement :func:`ftr_get_config`, with siteconfig source details.
+
+    :returns: tuple -- the loaded site config, the hostname matched, the
+        file name or URL the config comes from, and its version (local
+        file modification time and size, remote ``(ETag, Last-Modified)``
+        validators, or ``None``).
+    """
+
+    if RELOAD_INTERVAL > 0 and time.time() >= RELOAD_NEXT_CHECK:
+        _ftr_poll_reload()
+
+    domain_names = tuple(ftr_get_domain_names(website_url, exact_host_match))
+    repositories = tuple(ftr_get_repositories())
+
+    with CONFIG_CACHE_STATS_LOCK:
+        CONFIG_CACHE_STATS['lookups'] += 1
+
+    cache_key = (domain_names, repositories)
+    not_found_args = NOT_FOUND_CACHE.get(cache_key)
+
+    if not_found_args is not None:
+        LOGGER.debug(u'Negative cache hit for domains %s.', domain_names)
+        raise SiteConfigNotFound(*not_found_args)
+
+    lookup_key = (domain_names, repositories, RELOAD_GENERATION)
+
+    try:
+        found = _ftr_lookup_config(*lookup_key)
+
+        if time.time() - found[4] >= CACHE_TIMEOUT:
+            found = _ftr_revalidate_lookup(lookup_key, found)
+
+    except SiteConfigNotFound, e:
+        # Do not remember lookups that failed because of a network error.
+        if NOT_FOUND_CACHE_TIMEOUT > 0 \
+                and not getattr(e, 'unreachable_repositories', None):
+            NOT_FOUND_CACHE.set(cache_key, e.args)
+        raise
+
+    _ftr_watch_siteconfig(found[2], found[3], lookup_key=lookup_key)
+
+    return found[:4]
+
+
+def _ftr_revalidate_lookup(lookup_key, found):
+    """ Refresh an expired result of :func:`_ftr_lookup_config`.
+
+    Remote siteconfigs are revalidated with a conditional request: if
+    unchanged, or if the repository cannot be reached, the result is
+    cached again as is. If changed, the new content is used unless a
+    siteconfig of higher precedence appeared, see
+    :func:`_ftr_revalidate_precedence`. Otherwise, and for local
+    siteconfigs, the lookup runs again.
+
+    The result is handed to :func:`_ftr_lookup_config` through
+    :data:`REVALIDATED_LOOKUPS`, for its cache to store it again.
+    """
+
+    config_string, matched_host, source, version, checked = found
+    revalidated = None
+
+    if source.startswith(u'http') and version is not None:
+        try:
+            response = ftr_http_get_conditional(source, version)
+
+        except requests.RequestException, e:
+            # Served again as is, until the next expiration.
+            LOGGER.warning(u'Could not revalidate siteconfig %s, keeping '
+                           u'it (%s).', source, e)
+            revalidated = found[:4] + (time.time(), )
+
+        else:
+            if response.status_code == requests.codes.not_modified:
+                LOGGER.debug(u'Siteconfig %s was not modified.', source)
+                revalidated = found[:4] + (time.time(), )
+
+            elif response.status_code == requests.codes.ok \
+                    and _ftr_check_requests_result(response):
+                LOGGER.debug(u'Siteconfig %s was modified.', source)
+                revalidated = _ftr_revalidate_precedence(
+                    lookup_key, source,
+                    (response.text, matched_host, source,
+                     ftr_get_validators(response), time.time()))
+
+    _ftr_lookup_config.invalidate(*lookup_key)
+
+    if revalidated is None:
+        return _ftr_lookup_config(*lookup_key)
+
+    with REVALIDATED_LOOKUPS_LOCK:
+        REVALIDATED_LOOKUPS[lookup_key] = revalidated
+
+    try:
+        return _ftr_lookup_config(*lookup_key)
+
+    finally:
+        with REVALIDATED_LOOKUPS_LOCK:
+            REVALIDATED_LOOKUPS.pop(lookup_key, None)
+
+
+def _ftr_revalidate_precedence(lookup_key, source, modified):
+    """ Return the result of a lookup whose remote siteconfig changed.
+
+    Another siteconfig of higher precedence could have appeared since
+    the lookup (eg. in a local repository, or a more specific one in
+    the same repository). Only the probes that come before ``source``
+    run again: ``modified``, built from the response that was already
+    downloaded, is the result if none of them finds anything.
+
+    :returns: a result of :func:`_ftr_lookup_config`, or ``None`` if
+        ``source`` is not among the lookup probes. The whole lookup
+        must then run again.
+    """
+
+    domain_names, repositories, generation = lookup_key
+    probes = _ftr_lookup_probes(domain_names, repositories)
+
+    for index, (repository, probe_function, arguments) in enumerate(probes):
+        if probe_function is _ftr_probe_remote \
+                and repository + arguments[1] == source:
+            break
+
+    else:
+        return None
+
+    try:
+        return _ftr_run_probes(domain_names, repositories, probes[:index])
+
+    except SiteConfigNotFound:
+        return modified
+
+
+def ftr_get_site_config(website_url, exact_host_match=False, cascade=None):
+    """ Return the :class:`SiteConfig` instance for a website.
+
+    Configs are looked up with :func:`ftr_get_config`, and parsed once:
+    instances are kept in a process-local cache (keyed by matched host
+    and config content hash) of ``PYTHON_FTR_SITECONFIG_CACHE_SIZE``
+    entries (default: 1000), least recently used ones being evicted.
+
+    The same instance is thus shared by all articles of a website. It is
+    a :class:`FrozenSiteConfig`, to be safe against mutation.
+
+    If the ``PYTHON_FTR_DISK_CACHE_DIR`` environment variable is set
+    (it is not by default), parsed instances are also stored in that
+    directory, keyed by the siteconfig file name or URL, its
+    modification time or ``ETag``, and the :mod:`ftr` version. New
+    processes thus find them already parsed. Entries are unpickled:
+    only trusted users must be able to write in the directory, see
+    :class:`~ftr.cache.DiskCache`.
+
+    Long-running processes can pick up changes of local siteconfigs
+    without waiting for cache expiration, see
+    :func:`ftr_reload_siteconfigs`.
+
+    :param website_url: see :func:`ftr_get_config`.
+    :param exact_host_match: see :func:`ftr_get_config`.
+
+    :param cascade: if ``True``, like in the original Five Filters
+        implementation, merge all siteconfigs of the website: the most
+        specific one first, then those of parent domains (eg.
+        ``example.org`` for ``test.example.org``), then the global one
+        (``global.txt`` in repositories, or the name given in the
+        ``PYTHON_FTR_GLOBAL_SITECONFIG`` environment variable). The
+        global siteconfig is used alone for websites without any. Merged
+        configs are cached like single ones: they are merged once. If
+        ``None`` (default), the ``PYTHON_FTR_CASCADE`` environment
+        variable decides (default: ``0``, only the most specific
+        siteconfig is used).
+    :type cascade: bool or None
+
+    :returns: a :class:`FrozenSiteConfig` instance.
+    :raises: :class:`SiteConfigNotFound` if no config could be found,
+        :class:`InvalidSiteConfig` if the config is invalid.
+    """
+
+    if cascade is None:
+        cascade = CASCADE
+
+    if cascade:
+        return _ftr_build_site_config(
+            _ftr_find_cascade(website_url, exact_host_match))
+
+    return _ftr_build_site_config([_ftr_find_config(website_url,
+                                                    exact_host_match)])
+
+
+def _ftr_find_cascade(website_url, exact_host_match=False):
+    """ Find all siteconfigs of a website, most specific first.
+
+    That is, for each of its domain names (see
+    :func:`ftr_get_domain_names`), the first siteconfig found in
+    repositories, then the global siteconfig if any.
+
+    :returns: a list of tuples as returned by :func:`_ftr_find_config`.
+    :raises: :class:`SiteConfigNotFound` if no siteconfig, not even the
+        global one, could be found.
+    """
+
+    cascade = []
+    not_found = None
+
+    for domain_name in ftr_get_domain_names(website_url, exact_host_match):
+        try:
+            cascade.append(_ftr_find_config(domain_name,
+                                            exact_host_match=True))
+
+        except SiteConfigNotFound, e:
+            if not_found is None:
+                not_found = e
+
+    try:
+        cascade.append(_ftr_find_config(GLOBAL_SITECONFIG,
+                                        exact_host_match=True))
+
+    except SiteConfigNotFound, e:
+        if not cascade:
+            # No domain names at all for single-label hosts (eg. localhost).
+            raise not_found or e
+
+    return cascade
+
+
+def _ftr_build_site_config(cascade):
+    """ Return the cached :class:`FrozenSiteConfig` of siteconfigs.
+
+    They are merged in order, with :meth:`SiteConfig.append`, and parsed
+    only if found neither in memory nor on disk.
+
+    :param cascade: a list of tuples as returned by :func:`_ftr_find_config`.
+        Usually only one.
+    """
+
+    config_strings = [x[0] for x in cascade]
+    matched_hosts = tuple(x[1] for x in cascade)
+
+    content_hash = hashlib.sha1(
+        u'\0'.join(config_strings).encode('utf-8')).hexdigest()
+    cache_key = (matched_hosts[0] if len(cascade) == 1 else matched_hosts,
+                 content_hash)
+
+    for config_string, matched_host, source, version in cascade:
+        _ftr_watch_siteconfig(source, version, cache_key=cache_key)
+
+    config = SITECONFIG_CACHE.get(cache_key)
+
+    if config is not None:
+        return config
+
+    if SITECONFIG_DISK_CACHE is not None:
+        # Entries written by other versions are ignored: parsing or
+        # compiling could have changed, not only FrozenSiteConfig.
+        disk_cache_key = (ftr_version, ) + tuple(
+            (x[2], x[3] or content_hash) for x in cascade)
+
+        config = SITECONFIG_DISK_CACHE.get(disk_cache_key)
+
+    if config is None:
+        config = SiteConfig()
+        config.host = matched_hosts[0]
+
+        try:
+            for index, config_string in enumerate(config_strings, start=1):
+                config.append(ftr_string_to_instance(config_string),
+                              complete=index == len(config_strings))
+
+        except InvalidSiteConfig:
+            if len(cascade) == 1:
+                # A local siteconfig that was valid before this change.
+                config = _ftr_previous_site_config(cascade[0][2],
+                                                   matched_hosts[0],
+                                                   cache_key)
+
+                if config is not None:
+                    LOGGER.error(u'Siteconfig %s is invalid, using its '
+                                 u'previous version.', cascade[0][2])
+                    SITECONFIG_CACHE.set(cache_key, config)
+                    return config
+
+            raise
+
+        config = config.freeze()
+
+        if SITECONFIG_DISK_CACHE is not None:
+            SITECONFIG_DISK_CACHE.set(disk_cache_key, config)
+
+    SITECONFIG_CACHE.set(cache_key, config)
+
+    return config
+
+
+def ftr_preload_siteconfigs():
+    """ Load, parse and compile all siteconfigs of local repositories.
+
+    Meant for pre-fork servers (eg. gunicorn with ``preload_app``, or
+    :mod:`multiprocessing`): call it in the parent process, before
+    forking. Parsed configs are then shared copy-on-write by all
+    children, instead of being loaded and parsed again in each of them.
+
+    Siteconfigs of local directories and SQLite databases (see
+    :func:`ftr_get_repositories`) are put in the cache of
+    :func:`ftr_get_site_config`, whatever its size. They are compiled
+    too, which validates them; invalid ones are logged and skipped.
+    Remote repositories are ignored.
+
+    Lookups then find them without reading these repositories again,
+    until :func:`ftr_reload_siteconfigs` notices a change in one: it is
+    then read again, like before preloading.
+
+    Compiled XPath expressions belong to the process that compiled them:
+    children compile their own, lazily, for the siteconfigs they use.
+
+    :returns: int -- the number of preloaded siteconfigs.
+    """
+
+    preloaded = {}
+
+    for repository in ftr_get_repositories():
+        if repository.startswith(u'http'):
+            continue
+
+        # Before reading it: later changes must be noticed.
+        RELOAD_REPOSITORIES.setdefault(repository,
+                                       _ftr_repository_version(repository))
+
+        trie = SiteConfigTrie()
+
+        if repository.startswith(SQLITE_PREFIX):
+            try:
+                rows = ftr_get_sqlite_repository(repository).siteconfigs()
+
+            except (OSError, sqlite3.Error), e:
+                LOGGER.error(u'“%s” repository could not be read (%s).',
+                             repository, e)
+                continue
+
+            for name, content, sha1 in rows:
+                trie.add(name, (content, name,
+                                u'{0}#{1}'.format(repository, name), sha1))
+
+        else:
+            index = ftr_get_local_index(repository)
+
+            if index is None:
+                continue
+
+            for siteconfig_name, filename in index.trie:
+                try:
+                    with codecs.open(filename, 'rb', encoding='utf8') as f:
+                        trie.add(siteconfig_name, (
+                            f.read(), siteconfig_name, filename,
+                            _ftr_local_version(os.fstat(f.fileno()))))
+
+                except IOError, e:
+                    LOGGER.warning(u'Could not read siteconfig %s: %s.',
+                                   filename, e)
+
+        preloaded[repository] = trie
+
+    siteconfigs = [siteconfig for trie in preloaded.values()
+                   for name, siteconfig in trie]
+
+    # Make room for all of them, at once: evicting
+    # some would defeat the purpose of preloading.
+    SITECONFIG_CACHE.maxsize = max(SITECONFIG_CACHE.maxsize,
+                                   len(SITECONFIG_CACHE) + len(siteconfigs))
+
+    count = 0
+
+    for siteconfig in siteconfigs:
+        try:
+            _ftr_build_site_config([siteconfig]).strip_xpaths()
+
+        except InvalidSiteConfig, e:
+            LOGGER.warning(u'Skipped invalid siteconfig %s: %s.',
+                           siteconfig[2], e)
+            continue
+
+        count += 1
+
+    PRELOADED_REPOSITORIES.update(preloaded)
+
+    LOGGER.info(u'Preloaded %s siteconfigs.', count)
+
+    return count
+
+
+def _ftr_check_requests_result(result):
+    """ Return ``True`` if a remote repository answer looks like a siteconfig.
+
+    Some misbehaving repositories serve HTML pages for missing files.
+    """
+
+    return (
+        u'text/plain' in result.headers.get('content-type')
+        and u'<!DOCTYPE html>' not in result.text
+        and u'<html ' not in result.text
+        and u'</html>' not in result.text
+    )
+
+
+def _ftr_read_local_siteconfig(filename, siteconfig_name):
+    """ Return the content of a local siteconfig, its name and source.
+
+    See :func:`_ftr_find_config` for the returned tuple.
+    """
+
+    domain_name = siteconfig_name.lstrip(u'.')
+
+    LOGGER.info(u'Using local siteconfig for domain %s from %s.',
+                domain_name, filename, extra={'siteconfig': domain_name})
+
+    with codecs.open(filename, 'rb', encoding='utf8') as f:
+        return (f.read(), siteconfig_name, filename,
+                _ftr_local_version(os.fstat(f.fileno())))
+
+
+def _ftr_local_version(stat):
+    """ Return the version of a local siteconfig, from its ``stat()``. """
+
+    return u'{0}-{1}'.format(stat.st_mtime, stat.st_size)
+
+
+def _ftr_probe_local(repository, domain_names):
+    """ Look ``domain_names`` up in a local repository.
+
+    :returns: a ``(outcome, value)`` tuple. ``outcome`` is
+        ``PROBE_FOUND`` (``value`` is the tuple described in
+        :func:`_ftr_find_config`) or ``PROBE_MISS``.
+    """
+
+    index = ftr_get_local_index(repository)
+
+    if index is not None:
+        found = index.lookup(domain_names)
+
+        if found is None:
+            return PROBE_MISS, None
+
+        filename, siteconfig_name = found
+
+        try:
+            return PROBE_FOUND, _ftr_read_local_siteconfig(
+                filename, siteconfig_name)
+
+        except IOError:
+            # Removed since last indexing. The probe loop
+            # below will find any other matching file.
+            LOGGER.warning(u'Indexed siteconfig %s vanished.', filename)
+
+    # try, in turn:
+    #   website.ext.txt
+    #   .website.ext.txt
+    for domain_name in domain_names:
+        for siteconfig_name in (domain_name, u'.' + domain_name):
+            filename = os.path.join(repository, siteconfig_name + u'.txt')
+
+            if os.path.exists(filename):
+                return PROBE_FOUND, _ftr_read_local_siteconfig(
+                    filename, siteconfig_name)
+
+    return PROBE_MISS, None
+
+
+def _ftr_probe_sqlite(repository, domain_names):
+    """ Look ``domain_names`` up in an SQLite repository, in one query.
+
+    :returns: a ``(outcome, value)`` tuple. ``outcome`` is
+        ``PROBE_FOUND`` (``value`` is the tuple described in
+        :func:`_ftr_find_config`), ``PROBE_MISS``, or
+        ``PROBE_UNREACHABLE`` if the database cannot be read.
+    """
+
+    try:
+        found = ftr_get_sqlite_repository(repository).lookup(domain_names)
+
+    except (OSError, sqlite3.Error), e:
+        LOGGER.error(u'“%s” repository could not be read (%s).',
+                     repository, e)
+        return PROBE_UNREACHABLE, None
+
+    if found is None:
+        return PROBE_MISS, None
 
-# test.py will set this to any random integer to fake cache
-# invalidation without invalidating the fetched HTML pages.
-FTR_CONFIG_ALWAYS_RELOAD = 0
+    content, siteconfig_name, sha1 = found
+    domain_name = siteconfig_name.lstrip(u'.')
 
-HOSTNAME_REGEX = re.compile(
-    r'/^(([a-z0-9-]*[a-z0-9])\.)*([a-z0-9-]*[a-z0-9])$/',
-    re.IGNORECASE | re.UNICODE
-)
+    LOGGER.info(u'Using SQLite siteconfig for domain %s from %s.',
+                domain_name, repository, extra={'siteconfig': domain_name})
 
+    return PROBE_FOUND, (content, siteconfig_name,
+                         u'{0}#{1}'.format(repository, siteconfig_name), sha1)
 
-class SiteConfigException(Exception):
 
-    """ Abstract base class for all :class:`SiteConfig` related exceptions.
+def _ftr_probe_preloaded(repository, domain_names):
+    """ Look ``domain_names`` up in what :func:`ftr_preload_siteconfigs` read.
 
-    Never raised directly, but you can catch it in an `except` block to
-    get them all at once.
+    If the repository changed since, it is probed like any other one.
+
+    :returns: see :func:`_ftr_probe_local`.
     """
 
-    pass
+    trie = PRELOADED_REPOSITORIES.get(repository)
 
+    if trie is None:
+        if repository.startswith(SQLITE_PREFIX):
+            return _ftr_probe_sqlite(repository, domain_names)
 
-class SiteConfigNotFound(SiteConfigException):
+        return _ftr_probe_local(repository, domain_names)
 
-    """ Raised when no site config can be found for a given website or url. """
+    found = trie.lookup(domain_names)
 
-    pass
+    if found is None:
+        return PROBE_MISS, None
 
+    LOGGER.debug(u'Using preloaded siteconfig %s.', found[0][2],
+                 extra={'siteconfig': found[1].lstrip(u'.')})
 
-class InvalidSiteConfig(SiteConfigException):
+    return PROBE_FOUND, found[0]
 
-    """ Raised when an unrecoverable error is found in a site config.
 
-    Eg. when it has a very bad syntax error or a missing mandatory directive.
+def _ftr_probe_remote(repository, txt_siteconfig_name):
+    """ Try to download one siteconfig file from a remote repository.
 
-    As of version 0.5, all directives are optional, thus this exception
-    is raised only in case of a non-matching number of ``find_string``
-    / ``replace_string`` pairs. This could change in the future.
+    :returns: a ``(outcome, value)`` tuple. ``outcome`` is
+        ``PROBE_FOUND`` (``value`` is the tuple described in
+        :func:`_ftr_find_config`), ``PROBE_MISS``, ``PROBE_SKIP`` if the
+        repository misbehaves or ``PROBE_UNREACHABLE`` in case of a
+        network error.
     """
 
-    pass
-
+    siteconfig_url = repository + txt_siteconfig_name
+    domain_name = txt_siteconfig_name[:-4].lstrip(u'.')
 
-class NoTestUrlException(SiteConfigException):
+    try:
+        result = ftr_http_get(siteconfig_url)
 
-    """ Raised when a site config does not contain any test URL. """
+    except requests.RequestException, e:
+        LOGGER.error(u'“%s” repository could not be reached (%s).',
+                     repository, e)
+        return PROBE_UNREACHABLE, None
 
-    def __init__(self, filename, siteconfig_name, *args, **kwargs):
-        """ pep257, you know how MUCH I love you. """
-        self.filename = filename
-        self.siteconfig_name = siteconfig_name
+    if result.status_code == requests.codes.ok:
+        if not _ftr_check_requests_result(result):
+            LOGGER.error(u'“%s” repository URL does not return '
+                         u'text/plain results.', repository)
+            return PROBE_SKIP, None
 
-        super(NoTestUrlException, self).__init__(*args, **kwargs)
+        LOGGER.info(u'Using remote siteconfig for domain %s from %s.',
+                    domain_name, siteconfig_url,
+                    extra={'siteconfig': domain_name})
+        return PROBE_FOUND, (result.text, txt_siteconfig_name[:-4],
+                             siteconfig_url, ftr_get_validators(result))
 
+    if result.status_code >= 500:
+        LOGGER.error(u'“%s” repository answered HTTP %s.',
+                     repository, result.status_code)
+        return PROBE_UNREACHABLE, None
 
-@cached(timeout=CACHE_TIMEOUT, extra=FTR_CONFIG_ALWAYS_RELOAD)
-def ftr_get_config(website_url, exact_host_match=False):
-    """ Download the Five Filters config from centralized repositories.
+    return PROBE_MISS, None
 
-    Repositories can be local if you need to override siteconfigs.
 
-    The first entry found is returned. If no configuration is found,
-    `None` is returned. If :mod:`cacheops` is installed, the result will
-    be cached with a default expiration delay of 3 days.
+def _ftr_lookup_probes(domain_names, repositories):
+    """ Return all probes of a lookup, in precedence order.
 
-    :param exact_host_match: If ``False`` (default), we will look for
-        wildcard config matches. For example if host is
-        ``www.test.example.org``, we will try looking up
-        ``test.example.org`` and ``example.org``.
-    :param exact_host_match: bool
+    :returns: a list of ``(repository, probe_function, arguments)``.
+    """
 
-    :param website_url: either a full web URI (eg.
-        ``http://www.website.com:PORT/path/to/a/page.html``) or simply
-        a domain name (eg. ``www.website.com``). In case of a domain name,
-        no check is performed yet, be careful of what you pass.
-    :type website_url: str or unicode
+    probes = []
 
-    :returns: tuple -- the loaded site config (as unicode string) and
-        the hostname matched (unicode string too).
-    :raises: :class:`SiteConfigNotFound` if no config could be found.
+    for repository in repositories:
+        if repository.startswith('http'):
+            # try, in turn:
+            #   website.ext.txt
+            #   .website.ext.txt
+            for domain_name in domain_names:
+                for txt_siteconfig_name in (
+                    u'{0}.txt'.format(domain_name),
+                    u'.{0}.txt'.format(domain_name),
+                ):
+                    probes.append((repository, _ftr_probe_remote,
+                                   (repository, txt_siteconfig_name)))
+
+        elif repository in PRELOADED_REPOSITORIES:
+            probes.append((repository, _ftr_probe_preloaded,
+                           (repository, domain_names)))
+
+        elif repository.startswith(SQLITE_PREFIX):
+            probes.append((repository, _ftr_probe_sqlite,
+                           (repository, domain_names)))
 
-    .. note:: Whatever ``exact_host_match`` value is, the ``www`` part is
-        always removed from the URL or domain name.
+        else:
+            probes.append((repository, _ftr_probe_local,
+                           (repository, domain_names)))
 
-    .. todo:: there is currently no merging/cascading of site configs. In
-        the original Five Filters implementation, primary and secondary
-        configurations were merged. We could eventually re-implement this
-        part if needed by someone. PRs welcome as always.
-    """
+    return probes
 
-    def check_requests_result(result):
-        return (
-            u'text/plain' in result.headers.get('content-type')
-            and u'<!DOCTYPE html>' not in result.text
-            and u'<html ' not in result.text
-            and u'</html>' not in result.text
-        )
 
-    repositories = [
-        x.strip() for x in os.environ.get(
-            'PYTHON_FTR_REPOSITORIES',
-            os.path.expandvars(u'${HOME}/sources/ftr-site-config') + u' '
-            + u'https://raw.githubusercontent.com/1flow/ftr-site-config/master/ '  # NOQA
-            + u'https://raw.githubusercontent.com/fivefilters/ftr-site-config/master/'  # NOQA
-        ).split() if x.strip() != u'']
+@cached(timeout=VALIDATORS_TIMEOUT, extra=FTR_CONFIG_ALWAYS_RELOAD)
+def _ftr_lookup_config(domain_names, repositories, generation=0):
+    """ Probe ``repositories`` for ``domain_names``, in that order.
 
-    try:
-        proto, host_and_port, remaining = split_url(website_url)
+    This is the cached part of :func:`ftr_get_config`, which documents
+    the exceptions. See :func:`_ftr_find_config` for the return value,
+    to which the time of the lookup is appended: results older than
+    :data:`CACHE_TIMEOUT` are refreshed by :func:`_ftr_revalidate_lookup`.
 
-    except:
-        host_and_port = website_url
+    ``generation`` is not used here. It is part of the cache key, to
+    forget all lookups at once, see :func:`ftr_reload_siteconfigs`.
 
-    host_domain_parts = host_and_port.split(u'.')
+    If :data:`CONCURRENT_LOOKUPS` is enabled, probes run in parallel, in
+    the thread pool returned by :func:`ftr.repository.ftr_get_thread_pool`.
+    Their results are still examined in precedence order: the result is
+    the same as with sequential probing. Pending probes are cancelled once
+    a result is found.
+    """
 
-    # we don't store / use the “www.” part of domain name in siteconfig.
-    if host_domain_parts[0] == u'www':
-        host_domain_parts = host_domain_parts[1:]
+    with REVALIDATED_LOOKUPS_LOCK:
+        revalidated = REVALIDATED_LOOKUPS.pop(
+            (domain_names, repositories, generation), None)
 
-    if exact_host_match:
-        domain_names = [u'.'.join(host_domain_parts)]
+    if revalidated is not None:
+        return revalidated
 
-    else:
-        domain_names = [
-            u'.'.join(host_domain_parts[-i:])
-            for i in reversed(range(2, len(host_domain_parts) + 1))
-        ]
+    with CONFIG_CACHE_STATS_LOCK:
+        CONFIG_CACHE_STATS['misses'] += 1
 
     LOGGER.debug(u'Gathering configurations for domains %s from %s.',
                  domain_names, repositories)
 
-    for repository in repositories:
-        # try, in turn:
-        #   website.ext.txt
-        #   .website.ext.txt
+    return _ftr_run_probes(domain_names, repositories,
+                           _ftr_lookup_probes(domain_names, repositories))
 
-        for domain_name in domain_names:
 
-            skip_repository = False
+def _ftr_run_probes(domain_names, repositories, probes):
+    """ Run ``probes`` in order, until one finds a siteconfig.
 
-            for txt_siteconfig_name in (
-                u'{0}.txt'.format(domain_name),
-                u'.{0}.txt'.format(domain_name),
-            ):
-                if repository.startswith('http'):
-                    siteconfig_url = repository + txt_siteconfig_name
+    This is the probing part of :func:`_ftr_lookup_config`.
 
-                    result = requests.get(siteconfig_url)
+    :param probes: some of the probes of a lookup, in precedence order,
+        see :func:`_ftr_lookup_probes`.
 
-                    if result.status_code == requests.codes.ok:
-                        if not check_requests_result(result):
-                            LOGGER.error(u'“%s” repository URL does not '
-                                         u'return text/plain results.',
-                                         repository)
-                            skip_repository = True
-                            break
+    :returns: the result of the first successful probe, with the time
+        of the lookup appended.
+    :raises: :class:`SiteConfigNotFound` if none succeeded.
+    """
 
-                        LOGGER.info(u'Using remote siteconfig for domain '
-                                    u'%s from %s.', domain_name,
-                                    siteconfig_url, extra={
-                                        'siteconfig': domain_name})
-                        return result.text, txt_siteconfig_name[:-4]
+    # Repositories skipped because they misbehave or because of network
+    # errors. In the latter case a SiteConfigNotFound is not cached, see
+    # ftr_get_config().
+    skipped_repositories = set()
+    unreachable_repositories = []
+    cancelled = threading.Event()
 
-                else:
-                    filename = os.path.join(repository, txt_siteconfig_name)
+    def run_probe(probe):
+        repository, probe_function, arguments = probe
 
-                    if os.path.exists(filename):
-                        LOGGER.info(u'Using local siteconfig for domain '
-                                    u'%s from %s.', domain_name,
-                                    filename, extra={
-                                        'siteconfig': domain_name})
+        if cancelled.is_set() or repository in skipped_repositories:
+            return PROBE_CANCELLED, None, None
 
-                        with codecs.open(filename, 'rb', encoding='utf8') as f:
-                            return f.read(), txt_siteconfig_name[:-4]
+        if not ftr_get_repository_health(repository).is_available():
+            return PROBE_BREAKER_OPEN, None, None
 
-                if skip_repository:
-                    break
+        start = time.time()
+        outcome, value = probe_function(*arguments)
 
-            if skip_repository:
-                break
+        return outcome, value, time.time() - start
+
+    remote_probes_count = len([
+        x for x in probes if x[1] is _ftr_probe_remote])
+
+    if CONCURRENT_LOOKUPS and remote_probes_count > 1:
+        results = ftr_get_thread_pool().imap(run_probe, probes)
+
+    else:
+        # Lazy: a probe runs only when the previous one was examined.
+        results = imap(run_probe, probes)
+
+    try:
+        for (repository, _, _), (outcome, value, duration) in izip(probes,
+                                                                   results):
+
+            if repository in skipped_repositories:
+                continue
 
-    raise SiteConfigNotFound(
+            if duration is not None:
+                # Recorded here, not in probes: concurrent probes of a
+                # failing repository would count one error each.
+                ftr_get_repository_health(repository).record(
+                    duration, error={
+                        PROBE_SKIP: u'does not serve text/plain siteconfigs',
+                        PROBE_UNREACHABLE: u'network, server or database '
+                                           u'error',
+                    }.get(outcome))
+
+            if outcome == PROBE_FOUND:
+                return value + (time.time(), )
+
+            elif outcome in (PROBE_UNREACHABLE, PROBE_BREAKER_OPEN):
+                unreachable_repositories.append(repository)
+                skipped_repositories.add(repository)
+
+            elif outcome == PROBE_SKIP:
+                skipped_repositories.add(repository)
+
+    finally:
+        cancelled.set()
+
+    exception = SiteConfigNotFound(
         u'No configuration found for domains {0} in repositories {1}'.format(
             u', '.join(domain_names), u', '.join(repositories)
         )
     )
+    exception.unreachable_repositories = unreachable_repositories
+
+    raise exception
+
+
+def _ftr_directive_add(config, key, values):
+    """ Add to an ordered set, preserving order but squashing duplicates. """
+
+    add = getattr(config, key).add
+
+    for value in values:
+        add(value)
+
+
+def _ftr_directive_extend(config, key, values):
+    """ Extend a list. Duplicates are allowed. """
+
+    getattr(config, key).extend(values)
+
+
+def _ftr_directive_boolean(config, key, values):
+    """ Set a single statement command that evaluates to True or False. """
+
+    setattr(config, key, values[-1].lower() not in ('no', 'false', '0', ))
+
+
+def _ftr_directive_string(config, key, values):
+    """ Set a single statement command stored as a string. """
+
+    setattr(config, key, values[-1])
+
+
+def _ftr_directive_ignored(config, key, values):
+    """ Accept a directive we have no use for. """
+
+    LOGGER.debug(u'Ignored directive %s: %s.', key, u', '.join(values))
+
+
+# Directive name → handler(config, key, values), called once per directive
+# with the values of all its statements, see ftr_string_to_instance().
+SITECONFIG_DIRECTIVES = dict(
+    [(key, _ftr_directive_add) for key in (
+        'title', 'body', 'author', 'date',
+        'strip', 'strip_id_or_class', 'strip_image_src',
+        'single_page_link', 'single_page_link_in_feed',
+        'next_page_link',
+        'http_header',
+        'test_url',
+        'test_contains',
+    )]
+    + [(key, _ftr_directive_extend) for key in (
+        'find_string',
+        'replace_string',
+    )]
+    + [(key, _ftr_directive_boolean) for key in (
+        'tidy', 'prune', 'autodetect_on_failure',
+    )]
+    + [(key, _ftr_directive_string) for key in (
+        'parser',
+    )]
+    # Test expectations of the original implementation, unused here.
+    + [(key, _ftr_directive_ignored) for key in (
+        'test_title',
+        'test_date',
+        'test_author',
+        'test_language',
+    )]
+)
 
 
 def ftr_string_to_instance(config_string):
@@ -268,10 +1644,19 @@ def ftr_string_to_instance(config_string):
     :returns: a :class:`SiteConfig` instance.
     :raises: :class:`InvalidSiteConfig` in case of an unrecoverable error.
 
-    .. note:: See the source code for supported directives names.
+    .. note:: See :data:`SITECONFIG_DIRECTIVES` for supported directives
+        names, and the handler of each one.
     """
 
-    config = SiteConfig()
+    directives = SITECONFIG_DIRECTIVES
+
+    # Directive name → values, in file order. Each handler is called
+    # once, at the end, instead of once per statement.
+    statements = {}
+
+    # These 2 go by pairs, with both syntaxes.
+    find_strings = statements['find_string'] = []
+    replace_strings = statements['replace_string'] = []
 
     for line_number, line_content in enumerate(
             config_string.strip().split(u'\n'), start=1):
@@ -279,77 +1664,51 @@ def ftr_string_to_instance(config_string):
         line_content = line_content.strip()
 
         # Skip empty lines & comments.
-        if not line_content or line_content.startswith(u'#'):
+        if not line_content or line_content[0] == u'#':
             continue
 
-        try:
-            key, value = [
-                x.strip() for x in line_content.strip().split(u':', 1)
-            ]
+        key, separator, value = line_content.partition(u':')
 
-        except:
+        if not separator:
             LOGGER.warning(u'Unrecognized syntax “%s” on line #%s.',
                            line_content, line_number)
             continue
 
-        # handle some very rare title()d directives.
-        key = key.lower()
+        key = key.rstrip()
+        value = value.lstrip()
+
+        if key not in directives:
+            # handle some very rare title()d directives.
+            key = key.lower()
 
         if not key or (not value and key != 'replace_string'):
             LOGGER.warning(u'Empty key or value in “%s” on line #%s.',
                            line_content, line_number)
             continue
 
-        # Commands for which we accept multiple statements.
-        elif key in (
-            'title', 'body', 'author', 'date',
-            'strip', 'strip_id_or_class', 'strip_image_src',
-            'single_page_link', 'single_page_link_in_feed',
-            'next_page_link',
-            'http_header',
-
-            'find_string',
-            'replace_string',
-
-            'test_url',
-            'test_contains',
-            'test_title',
-            'test_date',
-            'test_author',
-            'test_language',
-        ):
-
-            if key.endswith(u'_string'):
-                # Append to list. Duplicites are allowed.
-                getattr(config, key).append(value)
-
-            else:
-                # Add to set, preserving order but squashing duplicates.
-                getattr(config, key).add(value)
-
-        # Single statement commands that evaluate to True or False.
-        elif key in ('tidy', 'prune', 'autodetect_on_failure', ):
+        if key in directives:
+            values = statements.get(key)
 
-            if value.lower() in ('no', 'false', '0', ):
-                setattr(config, key, False)
+            if values is None:
+                statements[key] = [value]
 
             else:
-                setattr(config, key, bool(value))
-
-        # Single statement commands stored as strings.
-        elif key in ('parser', ):
-            setattr(config, key, value)
+                values.append(value)
 
         # The “replace_string(………): replace_value” one-liner syntax.
         elif key.startswith('replace_string(') and key.endswith(')'):
-            # These 2 are lists, not sets.
-            config.find_string.append(key[15:-1])
-            config.replace_string.append(value)
+            find_strings.append(key[15:-1])
+            replace_strings.append(value)
 
         else:
             LOGGER.warning(u'Unsupported directive “%s” on line #%s.',
                            line_content, line_number)
 
+    config = SiteConfig()
+
+    for key, values in statements.iteritems():
+        directives[key](config, key, values)
+
     find_count = len(config.find_string)
     replace_count = len(config.replace_string)
 
@@ -361,7 +1720,293 @@ def ftr_string_to_instance(config_string):
     return config
 
 
-class SiteConfig(object):
+def _ftr_strings_overlap(first, second):
+    """ Return ``True`` if occurrences of both strings can overlap. """
+
+    if first in second or second in first:
+        return True
+
+    for length in xrange(1, min(len(first), len(second))):
+        if first.endswith(second[:length]) or second.endswith(first[:length]):
+            return True
+
+    return False
+
+
+def _ftr_replacement_depends(earlier, later):
+    """ Return ``True`` if replacing ``earlier`` can change ``later`` matches.
+
+    Both are ``(find_string, replace_string)`` pairs. This is conservative:
+    ``True`` means they must be replaced one after the other.
+    """
+
+    find_string, replace_string = earlier
+
+    if not find_string or not later[0]:
+        # str.replace() inserts at every position.
+        return True
+
+    if find_string != later[0] and _ftr_strings_overlap(find_string,
+                                                        later[0]):
+        return True
+
+    if replace_string:
+        return _ftr_strings_overlap(replace_string, later[0])
+
+    # An empty replacement joins the text around it.
+    return len(later[0]) > 1
+
+
+def _ftr_compile_replacements(replace_patterns):
+    """ Return a function doing all replacements of ``replace_patterns``.
+
+    It gives the same result as one :meth:`str.replace` per pair, in
+    order. Pairs are grouped in runs where order does not matter (no
+    pattern can overlap another, nor be created by an earlier replacement);
+    runs of at least :data:`REPLACEMENTS_SINGLE_PASS` pairs are replaced in
+    one pass of a regular expression.
+    """
+
+    runs = []
+
+    for pair in replace_patterns:
+        if runs and not any(_ftr_replacement_depends(earlier, pair)
+                            for earlier in runs[-1]):
+            runs[-1].append(pair)
+
+        else:
+            runs.append([pair])
+
+    steps = []
+
+    for run in runs:
+        if len(run) < REPLACEMENTS_SINGLE_PASS or not run[0][0]:
+            # An empty find_string is always alone in its run.
+            steps.extend(run)
+            continue
+
+        # Equal patterns: only the first one can match, as with str.replace().
+        replacements = {}
+
+        for find_string, replace_string in run:
+            replacements.setdefault(find_string, replace_string)
+
+        steps.append((re.compile(u'({0})'.format(u'|'.join(
+            re.escape(find_string) for find_string, replace_string in run
+        ))), replacements))
+
+    def replace(html):
+
+        for pattern, replacement in steps:
+            if isinstance(replacement, dict):
+                # Matched strings are at odd positions.
+                parts = pattern.split(html)
+                parts[1::2] = [replacement[match] for match in parts[1::2]]
+                html = html[:0].join(parts)
+
+            else:
+                html = html.replace(pattern, replacement)
+
+        return html
+
+    return replace
+
+
+class SiteConfigXPathsMixin(object):
+
+    """ Compiled XPath expressions handling, for all site config classes. """
+
+    __slots__ = ()
+
+    # Directives holding XPath expressions that the extractor evaluates.
+    xpath_directives = (
+        'title', 'body', 'author', 'date',
+        'strip', 'next_page_link', 'language',
+    )
+
+    def compile(self):
+        """ Compile XPath expressions into :class:`lxml.etree.XPath` objects.
+
+        This is done once, when the config is loaded or merged, and the
+        compiled expressions are reused for every extracted document. See
+        :meth:`xpaths` and :meth:`strip_xpaths`. ``find_string`` and
+        ``replace_string`` pairs are compiled too, see :meth:`replace`.
+
+        :raises: :class:`InvalidSiteConfig` if an expression is invalid.
+        """
+
+        xpaths = {}
+
+        # Some errors are raised only when an expression is evaluated, eg.
+        # unknown namespace prefixes or functions: each one is evaluated
+        # once, on an empty document.
+        document = etree.Element('html')
+
+        for attr_name in self.xpath_directives:
+            compiled = []
+
+            for expression in getattr(self, attr_name):
+                try:
+                    xpath = etree.XPath(expression)
+                    xpath(document)
+
+                except (etree.XPathSyntaxError, etree.XPathEvalError), e:
+                    raise InvalidSiteConfig(
+                        u'Invalid {0} XPath expression "{1}" ({2})'.format(
+                            attr_name, expression, e))
+
+                compiled.append(xpath)
+
+            xpaths[attr_name] = tuple(compiled)
+
+        # All attribute-based removal rules are merged into one predicate,
+        # for libxml2 to test them all in one document traversal. Quotes
+        # are removed from values because they would break the expression.
+        predicates = []
+
+        for value in self.strip_id_or_class:
+            value = value.replace('"', '').replace("'", '')
+            predicates.append(
+                u"contains(@class, '{0}') or contains(@id, '{0}')".format(
+                    value))
+
+        for value in self.strip_image_src:
+            value = value.replace('"', '').replace("'", '')
+            predicates.append(
+                u"(self::img and contains(@src, '{0}'))".format(value))
+
+        # Strip elements using Readability.com and Instapaper.com ignore
+        # classes names .entry-unrelated and .instapaper_ignore
+        # See https://www.readability.com/publishers/guidelines/#view-plainGuidelines  # NOQA
+        # and http://blog.instapaper.com/post/730281947 for details.
+        predicates.append(
+            u"contains(concat(' ',normalize-space(@class),' ')"
+            u",' entry-unrelated ') or contains(concat(' ',"
+            u"normalize-space(@class),' '),' instapaper_ignore ')"
+        )
+
+        # Strip elements that contain style="display: none;".
+        predicates.append(u"contains(@style,'display:none')")
+
+        rules_expression = u'//*[{0}]'.format(u' or '.join(predicates))
+
+        try:
+            xpaths['_strip_rules'] = etree.XPath(rules_expression)
+
+        except etree.XPathSyntaxError, e:
+            raise InvalidSiteConfig(
+                u'Invalid strip_id_or_class or strip_image_src value '
+                u'({0})'.format(e))
+
+        # Then the last `strip` expression is united with it, for what
+        # remains to be collected in one evaluation. The other ones are
+        # evaluated in turn before: each removal can change what the next
+        # expressions match (eg. with position predicates), not what the
+        # attribute-based rules match.
+        xpaths['_strip_all'] = etree.XPath(u' | '.join(
+            [u'({0})'.format(x.path) for x in xpaths['strip'][-1:]]
+            + [rules_expression]
+        ))
+
+        xpaths['_replacements'] = _ftr_compile_replacements(
+            getattr(self, 'replace_patterns', None) or ())
+
+        self._xpaths = xpaths
+        self._xpaths_signature = self._get_xpaths_signature()
+
+    def _get_xpaths_signature(self):
+        """ Return something that changes when compiled directives do.
+
+        That is their values themselves, not only their number: an
+        expression edited in place must be compiled again. The process
+        ID is part of it too: compiled expressions are not shared with
+        forked processes, see :meth:`_get_xpaths`.
+
+        For a :class:`FrozenSiteConfig`, values are already tuples and
+        are not copied.
+        """
+
+        return (
+            os.getpid(),
+            tuple(getattr(self, 'replace_patterns', None) or ()),
+        ) + tuple(
+            tuple(getattr(self, attr_name))
+            for attr_name in self.xpath_directives + (
+                'strip_id_or_class', 'strip_image_src', )
+        )
+
+    def _get_xpaths(self):
+        """ Return the compiled expressions, compiling them if needed.
+
+        If a directive was altered since the last :meth:`compile` (eg.
+        a config built manually), expressions are compiled again. So
+        they are in a forked child process: libxml2 compiled expressions
+        are not meant to be shared between processes.
+        """
+
+        xpaths = self._xpaths
+
+        if xpaths is None \
+                or self._xpaths_signature != self._get_xpaths_signature():
+
+            if xpaths is not None \
+                    and self._xpaths_signature[0] != os.getpid():
+                # Compiled by the parent process. Freeing them here would
+                # only copy their memory pages, which are shared for now.
+                FORKED_XPATHS.append(xpaths)
+
+            self.compile()
+            xpaths = self._xpaths
+
+        return xpaths
+
+    def xpaths(self, attr_name):
+        """ Return the compiled XPath expressions of a directive.
+
+        :param attr_name: one of :attr:`xpath_directives`.
+        :type attr_name: str
+
+        :returns: a tuple of :class:`lxml.etree.XPath` objects, in the
+            directive order. Their ``path`` attribute holds the expression.
+        """
+
+        return self._get_xpaths()[attr_name]
+
+    def strip_xpaths(self):
+        """ Return the compiled expressions matching elements to strip.
+
+        :returns: a tuple of 2 :class:`lxml.etree.XPath` objects. The
+            first matches everything that the last ``strip`` expression,
+            ``strip_id_or_class`` and ``strip_image_src`` directives and
+            built-in rules match, in one evaluation. Other ``strip``
+            expressions must be evaluated and their matches removed in
+            turn before, see :meth:`xpaths`. The second one matches only
+            what the ``strip_id_or_class``, ``strip_image_src`` and
+            built-in rules match, for when the first one cannot be
+            evaluated (eg. a ``strip`` expression that does not return
+            a node-set).
+        """
+
+        xpaths = self._get_xpaths()
+
+        return xpaths['_strip_all'], xpaths['_strip_rules']
+
+    def replace(self, html):
+        """ Replace ``find_string`` values by ``replace_string`` ones.
+
+        The result is the same as replacing each pair in turn, but pairs
+        that do not depend on each other may be replaced in one pass.
+
+        :param html: the document to do replacements on.
+        :type html: unicode
+
+        :returns: the document with replacements done.
+        """
+
+        return self._get_xpaths()['_replacements'](html)
+
+
+class SiteConfig(SiteConfigXPathsMixin):
 
     """ Holds extraction pattern and other directives for a given website.
 
@@ -379,6 +2024,16 @@ class SiteConfig(object):
         'autodetect_on_failure': True,
     }
 
+    # Directives that can be given more than once.
+    multiple_directives = (
+        'title', 'body', 'author', 'date',
+        'strip', 'strip_id_or_class', 'strip_image_src',
+        'single_page_link', 'single_page_link_in_feed',
+        'next_page_link', 'http_header',
+        'test_url', 'test_contains',
+        'find_string', 'replace_string',
+    )
+
     def __unicode__(self):
         """ Print title & body. """
         return u'title: %s, body: %s' % (self.title, self.body)
@@ -489,6 +2144,10 @@ class SiteConfig(object):
         # processing begins.
         self.replace_string = []
 
+        # Compiled `xpath_directives`, see compile() and xpaths().
+        self._xpaths = None
+        self._xpaths_signature = None
+
     def load(self, host, exact_host_match=False):
         """ Load a config for a hostname or url.
 
@@ -506,7 +2165,7 @@ class SiteConfig(object):
 
         self.append(ftr_string_to_instance(config_string))
 
-    def append(self, newconfig):
+    def append(self, newconfig, complete=True):
         """ Append another site config to current instance.
 
         All ``newconfig`` attributes are appended one by one to ours.
@@ -517,6 +2176,12 @@ class SiteConfig(object):
         more generic directives, append it last for specific directives
         to be tried first.
 
+        :param complete: set to ``False`` if more configs will be appended.
+            Defaults of single statement commands are then not applied
+            yet, to leave them to the next configs, and expressions are
+            not compiled.
+        :type complete: bool
+
         .. note:: this method is also aliased to :meth:`merge`.
         """
 
@@ -543,7 +2208,8 @@ class SiteConfig(object):
         ):
             if getattr(self, attr_name) is None:
                 if getattr(newconfig, attr_name) is None:
-                    setattr(self, attr_name, self.defaults[attr_name])
+                    if complete:
+                        setattr(self, attr_name, self.defaults[attr_name])
                 else:
                     setattr(self, attr_name, getattr(newconfig, attr_name))
 
@@ -563,5 +2229,127 @@ class SiteConfig(object):
         else:
             self.replace_patterns = None
 
+        if complete:
+            self.compile()
+
+    def freeze(self):
+        """ Return a read-only copy, to share it between extractions.
+
+        See :class:`FrozenSiteConfig`. Do this once the config is complete
+        (eg. after all merges).
+
+        :returns: a :class:`FrozenSiteConfig` instance.
+        """
+
+        return FrozenSiteConfig(self)
+
     # method aliasing for API compatibility.
     merge = append
+
+
+class FrozenSiteConfig(SiteConfigXPathsMixin):
+
+    """ Immutable and compact form of a :class:`SiteConfig`.
+
+    Produced by :meth:`SiteConfig.freeze`, once a config is complete. It
+    has the same attributes, all multiple-statements directives being
+    tuples, and no :meth:`~SiteConfig.append` method; setting any
+    attribute raises an :class:`AttributeError`. It can thus be shared
+    between threads and by all extractions of a website, and be consumed
+    directly by :class:`~ftr.extractor.ContentExtractor`.
+
+    Instances use ``__slots__`` and are cheap to pickle: compiled XPath
+    expressions are not pickled but compiled again, lazily, on first use.
+
+    To extend a frozen config, :meth:`~SiteConfig.append` it to a new
+    :class:`SiteConfig`.
+    """
+
+    multiple_directives = SiteConfig.multiple_directives
+
+    # Attributes other than multiple-statements directives.
+    single_attributes = (
+        'host', 'language', 'parser', 'tidy', 'prune',
+        'autodetect_on_failure', 'replace_patterns',
+    )
+
+    __slots__ = SiteConfig.multiple_directives + single_attributes + (
+        '_xpaths', '_xpaths_signature', )
+
+    # Pickled with attribute values, in the order above. Increment it
+    # when changing attributes: pickles of other versions (eg. in the
+    # disk cache) are then rejected instead of misread.
+    state_version = 1
+
+    def __init__(self, config):
+        """ Copy ``config`` attributes, compiled XPath expressions included.
+
+        :param config: the config to freeze.
+        :type config: a :class:`SiteConfig` instance.
+        """
+
+        for attr_name in self.multiple_directives:
+            object.__setattr__(self, attr_name,
+                               tuple(getattr(config, attr_name)))
+
+        for attr_name in self.single_attributes:
+            value = getattr(config, attr_name, None)
+
+            if isinstance(value, list):
+                value = tuple(value)
+
+            object.__setattr__(self, attr_name, value)
+
+        # The config was compiled when loaded or merged. Its XPath
+        # objects are reused, unless it was altered since then.
+        self._xpaths = None
+        self._xpaths_signature = None
+
+        if config._xpaths is not None \
+                and config._xpaths_signature == self._get_xpaths_signature():
+            self._xpaths = config._xpaths
+            self._xpaths_signature = config._xpaths_signature
+
+    def __setattr__(self, name, value):
+        """ Forbid public attributes changes. """
+
+        if not name.startswith('_'):
+            raise AttributeError('Cannot set {0} on a FrozenSiteConfig, '
+                                 'append it to a new SiteConfig '
+                                 'instead.'.format(name))
+
+        object.__setattr__(self, name, value)
+
+    def __unicode__(self):
+        """ Print title & body. """
+        return u'title: %s, body: %s' % (self.title, self.body)
+
+    def __getstate__(self):
+        """ Return public attribute values; XPath objects can't be pickled.
+
+        They are preceded by :attr:`state_version`.
+        """
+
+        return (self.state_version, ) + tuple(
+            getattr(self, attr_name)
+            for attr_name in self.multiple_directives + self.single_attributes
+        )
+
+    def __setstate__(self, state):
+        """ Restore public attributes, XPath expressions will be compiled.
+
+        :raises: :class:`ValueError` if ``state`` was pickled by a version
+            with other attributes.
+        """
+
+        attr_names = self.multiple_directives + self.single_attributes
+
+        if len(state) != len(attr_names) + 1 \
+                or state[0] != self.state_version:
+            raise ValueError(u'Incompatible FrozenSiteConfig pickle.')
+
+        for attr_name, value in zip(attr_names, state[1:]):
+            object.__setattr__(self, attr_name, value)
+
+        self._xpaths = None
+        self._xpaths_signature = None
@@ -20,12 +20,18 @@ u""" Python FTR content extractor class and utils.
 """
 
 import os
+import re
+import copy
+import hashlib
 import logging
+import threading
 
 try:
+    import lxml.html
     from lxml import etree
     # from lxml.cssselect import CSSSelector
     from readability.readability import Document
+    from readability.cleaners import html_cleaner
 
 except ImportError:
     # Avoid a crash during setup.py
@@ -35,6 +41,9 @@ except ImportError:
 
 from StringIO import StringIO
 
+from .cache import MemoryCache, DiskCache
+from .config import DISK_CACHE_DIR
+
 LOGGER = logging.getLogger(__name__)
 
 if bool(os.environ.get('FTR_TEST_ENABLE_SQLITE_LOGGING', False)):
@@ -54,6 +63,166 @@ except:
 
     tidylib = None
 
+# Counters of extractions and tidy fallbacks, see ftr_extraction_stats().
+EXTRACTION_STATS = {
+    'extractions': 0,
+    'tidied': 0,
+    'tidy_empty': 0,
+    'fallbacks': 0,
+    'fallback_successes': 0,
+}
+EXTRACTION_STATS_LOCK = threading.Lock()
+
+# Tidied documents, by hash of the HTML and tidy configuration, see
+# ContentExtractor._tidy(). Useful when extracting the same documents
+# again (eg. after siteconfig changes). Both are disabled by default.
+TIDY_CACHE_SIZE = int(os.environ.get('PYTHON_FTR_TIDY_CACHE_SIZE', 0))
+TIDY_CACHE = MemoryCache(maxsize=TIDY_CACHE_SIZE) if TIDY_CACHE_SIZE else None
+
+TIDY_DISK_CACHE_SIZE = int(os.environ.get('PYTHON_FTR_TIDY_DISK_CACHE_SIZE',
+                                          0))
+TIDY_DISK_CACHE = DiskCache(
+    os.path.join(DISK_CACHE_DIR, u'tidy'),
+    maxsize=TIDY_DISK_CACHE_SIZE,
+) if DISK_CACHE_DIR and TIDY_DISK_CACHE_SIZE else None
+
+
+def _ftr_count_extraction(key):
+    """ Increment ``EXTRACTION_STATS[key]``. """
+
+    with EXTRACTION_STATS_LOCK:
+        EXTRACTION_STATS[key] += 1
+
+
+def ftr_extraction_stats():
+    """ Return the :meth:`ContentExtractor.process` counters.
+
+    :returns: a ``dict`` with ``extractions``, ``tidied``,
+        ``tidy_empty``, ``fallbacks`` and ``fallback_successes`` keys.
+        ``tidy_empty`` counts documents for which tidy returned nothing
+        and that were extracted untidied straight away. ``fallbacks``
+        counts tidied documents extracted again without tidy because
+        nothing could be extracted from them, ``fallback_successes``
+        those of them that succeeded the second time.
+    """
+
+    with EXTRACTION_STATS_LOCK:
+        return dict(EXTRACTION_STATS)
+
+
+def ftr_reset_extraction_stats():
+    """ Reset the counters returned by :func:`ftr_extraction_stats`. """
+
+    with EXTRACTION_STATS_LOCK:
+        for key in EXTRACTION_STATS:
+            EXTRACTION_STATS[key] = 0
+
+
+class SummaryString(unicode):
+
+    """ A readability summary, with its tree in :attr:`tree`.
+
+    readability checks the length of the summary string to decide if it
+    should try again less ruthlessly; this keeps the tree along for
+    :meth:`TreeDocument.summary_tree`.
+    """
+
+    tree = None
+
+
+try:
+    class TreeDocument(Document):
+
+        """ A readability :class:`Document` working on an existing tree.
+
+        Given a string, readability parses it again each time it needs a
+        fresh document (up to 3 times for one summary). Instead, this one
+        starts from a copy of an already parsed element, placed in a
+        ``html`` → ``body`` skeleton like readability parsing would do.
+
+        Its summary can be returned as a tree too, see
+        :meth:`summary_tree`.
+
+        :param input: an element of a tree parsed with
+            :class:`lxml.html.HTMLParser`, eg. the root of a whole
+            document, or a body candidate.
+
+        .. note:: it overrides private methods of readability
+            (``_parse()`` and ``get_clean_html()``). Supported
+            :mod:`readability-lxml` versions are pinned in ``setup.py``.
+        """
+
+        # Attributes removed by readability from its summaries.
+        bad_attributes = re.compile(
+            r'^(?:width|height|style|[-a-z]*color|background[-a-z]*|on*)$',
+            re.I)
+
+        _return_tree = False
+
+        def _parse(self, input):
+            """ Return a cleaned copy of ``input``, instead of parsing it. """
+
+            if input.tag == 'html':
+                doc = copy.deepcopy(input)
+
+            else:
+                doc = lxml.html.Element('html')
+                body = etree.SubElement(doc, 'body')
+                body.append(copy.deepcopy(input))
+
+            # In place: clean_html() would copy it again.
+            html_cleaner(doc)
+            doc.resolve_base_href()
+
+            return doc
+
+        def get_clean_html(self):
+            """ Return the summary, as a :class:`SummaryString` in tree mode.
+
+            readability decides to retry on the length of this string, so
+            it is always serialized.
+            """
+
+            clean_html = Document.get_clean_html(self)
+
+            if not self._return_tree:
+                return clean_html
+
+            for element in self.html.iter(tag=etree.Element):
+                for attribute_name, value in element.attrib.items():
+                    if value and self.bad_attributes.match(attribute_name):
+                        del element.attrib[attribute_name]
+
+            summary = SummaryString(clean_html)
+            summary.tree = self.html
+
+            return summary
+
+        def summary_tree(self):
+            """ Return the summary as a ``html`` element.
+
+            The same as parsing :meth:`summary` output, without parsing
+            it again.
+            """
+
+            self._return_tree = True
+
+            try:
+                summary = self.summary()
+
+            finally:
+                self._return_tree = False
+
+            if getattr(summary, 'tree', None) is None:
+                # Older readability versions do not call get_clean_html().
+                return lxml.html.document_fromstring(summary)
+
+            return summary.tree
+
+except NameError:
+    # Dependencies are not installed, see above.
+    pass
+
 
 class ContentExtractor(object):
 
@@ -123,8 +292,7 @@ class ContentExtractor(object):
         """ Do raw string replacements on :param:`html`. """
 
         if self.config.find_string:
-            for find_pattern, replace_pattern in self.config.replace_patterns:
-                html = html.replace(find_pattern, replace_pattern)
+            html = self.config.replace(html)
 
             LOGGER.info(u'Done replacements.',
                         extra={'siteconfig': self.config.host})
@@ -143,19 +311,19 @@ class ContentExtractor(object):
 
         if self.config.tidy and tidylib and smart_tidy:
 
-            try:
-                document, errors = tidylib.tidy_document(html, self.tidy_config)
-
-            except UnicodeDecodeError:
-                # For some reason, pytidylib fails to decode, whereas the
-                # original html content converts perfectly manually.
-                document, errors = tidylib.tidy_document(html.encode('utf-8'),
-                                                         self.tidy_config)
-                document = document.decode('utf-8')
-            # if errors:
-            #     LOGGER.debug(u'Ignored errors returned by tidylib: %s',
-            #                  errors)
+            document = self._tidy_document(html)
 
+            if not document.strip():
+                # Nothing could be extracted from it, don't even try.
+                _ftr_count_extraction('tidy_empty')
+                self.html = html
+
+                LOGGER.warning(u'Tidy returned an empty document, using '
+                               u'the untidied one.',
+                               extra={'siteconfig': self.config.host})
+                return
+
+            _ftr_count_extraction('tidied')
             self.tidied = True
             self.html = document
 
@@ -164,6 +332,58 @@ class ContentExtractor(object):
         else:
             self.html = html
 
+    def _tidy_document(self, html):
+        """ Return :param:`html` tidied, from the tidy cache if possible. """
+
+        if TIDY_CACHE is None and TIDY_DISK_CACHE is None:
+            return self._run_tidy(html)
+
+        cache_key = hashlib.sha1(repr(sorted(self.tidy_config.items())))
+        cache_key.update(type(html).__name__)
+        cache_key.update(html.encode('utf-8')
+                         if isinstance(html, unicode) else html)
+        cache_key = cache_key.hexdigest()
+
+        if TIDY_CACHE is not None:
+            document = TIDY_CACHE.get(cache_key)
+
+            if document is not None:
+                return document
+
+        document = None
+
+        if TIDY_DISK_CACHE is not None:
+            document = TIDY_DISK_CACHE.get(cache_key)
+
+        if document is None:
+            document = self._run_tidy(html)
+
+            if TIDY_DISK_CACHE is not None:
+                TIDY_DISK_CACHE.set(cache_key, document)
+
+        if TIDY_CACHE is not None:
+            TIDY_CACHE.set(cache_key, document)
+
+        return document
+
+    def _run_tidy(self, html):
+        """ Return :param:`html` tidied by :mod:`tidylib`. """
+
+        try:
+            document, errors = tidylib.tidy_document(html, self.tidy_config)
+
+        except UnicodeDecodeError:
+            # For some reason, pytidylib fails to decode, whereas the
+            # original html content converts perfectly manually.
+            document, errors = tidylib.tidy_document(html.encode('utf-8'),
+                                                     self.tidy_config)
+            document = document.decode('utf-8')
+        # if errors:
+        #     LOGGER.debug(u'Ignored errors returned by tidylib: %s',
+        #                  errors)
+
+        return document
+
     def _parse_html(self):
         """ Load the parser and parse `self.html`. """
 
@@ -171,7 +391,8 @@ class ContentExtractor(object):
             raise NotImplementedError('%s parser not implemented' %
                                       self.config.parser)
 
-        self.parser = etree.HTMLParser()
+        # Build lxml.html elements, that readability works on directly.
+        self.parser = lxml.html.HTMLParser()
 
         try:
             self.parsed_tree = etree.parse(StringIO(self.html), self.parser)
@@ -202,8 +423,8 @@ class ContentExtractor(object):
         # HEADS UP: we do not abort if next_page_link is already set:
         #           we try to find next (eg. find 3 if already at page 2).
 
-        for pattern in self.config.next_page_link:
-            items = self.parsed_tree.xpath(pattern)
+        for xpath in self.config.xpaths('next_page_link'):
+            items = xpath(self.parsed_tree)
 
             if not items:
                 continue
@@ -225,7 +446,7 @@ class ContentExtractor(object):
 
             else:
                 LOGGER.warning(u'%s items for next-page link %s',
-                               items, pattern,
+                               items, xpath.path,
                                extra={'siteconfig': self.config.host})
 
     def _extract_title(self):
@@ -239,8 +460,8 @@ class ContentExtractor(object):
         if self.title:
             return
 
-        for pattern in self.config.title:
-            items = self.parsed_tree.xpath(pattern)
+        for xpath in self.config.xpaths('title'):
+            items = xpath(self.parsed_tree)
 
             if not items:
                 continue
@@ -286,7 +507,7 @@ class ContentExtractor(object):
 
             else:
                 LOGGER.warning(u'Multiple items (%s) for title pattern %s.',
-                               items, pattern,
+                               items, xpath.path,
                                extra={'siteconfig': self.config.host})
 
     def _extract_author(self):
@@ -295,9 +516,9 @@ class ContentExtractor(object):
         if bool(self.author):
             return
 
-        for pattern in self.config.author:
+        for xpath in self.config.xpaths('author'):
 
-            items = self.parsed_tree.xpath(pattern)
+            items = xpath(self.parsed_tree)
 
             if isinstance(items, basestring):
                 # In case xpath returns only one element.
@@ -330,8 +551,8 @@ class ContentExtractor(object):
 
         found = False
 
-        for pattern in self.config.language:
-            for item in self.parsed_tree.xpath(pattern):
+        for xpath in self.config.xpaths('language'):
+            for item in xpath(self.parsed_tree):
                 stripped_language = item.strip()
 
                 if stripped_language:
@@ -352,9 +573,9 @@ class ContentExtractor(object):
 
         found = False
 
-        for pattern in self.config.date:
+        for xpath in self.config.xpaths('date'):
 
-            items = self.parsed_tree.xpath(pattern)
+            items = xpath(self.parsed_tree)
 
             if isinstance(items, basestring):
                 # In case xpath returns only one element.
@@ -388,64 +609,81 @@ class ContentExtractor(object):
                 break
 
     def _strip_unwanted_elements(self):
+        """ Remove unwanted elements from the document.
+
+        All removal rules (``strip``, ``strip_id_or_class`` and
+        ``strip_image_src`` directives, plus built-in ones) are collected
+        by :meth:`SiteConfig.strip_xpaths` in one expression, matched in
+        one pass. Only ``strip`` expressions before the last one run in
+        turn, their matches removed before the next one is evaluated, as
+        they were before. Elements are removed in document order.
+        """
+
+        strip_all, strip_rules = self.config.strip_xpaths()
+        strip = self.config.xpaths('strip')
+
+        for xpath in strip[:-1]:
+            self._remove_items(self._strip_items(xpath))
+
+        try:
+            items = strip_all(self.parsed_tree)
+
+        except etree.XPathEvalError:
+            # The last `strip` expression does not return a node-set.
+            # Fallback to evaluating it alone.
+            items = (self._strip_items(strip[-1])
+                     + strip_rules(self.parsed_tree))
+
+        self._remove_items(items)
+
+    def _strip_items(self, xpath):
+        """ Return the elements a ``strip`` expression matches.
+
+        Expressions that cannot be evaluated, or do not return elements,
+        are logged and ignored.
+        """
+
+        try:
+            result = xpath(self.parsed_tree)
+
+        except etree.XPathEvalError, e:
+            LOGGER.warning(u'Ignored strip expression %s, it cannot be '
+                           u'evaluated (%s).', xpath.path, e,
+                           extra={'siteconfig': self.config.host})
+            return []
+
+        if not isinstance(result, list):
+            LOGGER.warning(u'Ignored strip expression %s, it does '
+                           u'not return elements.', xpath.path,
+                           extra={'siteconfig': self.config.host})
+            return []
 
-        def _remove(xpath_expression):
-            for item in self.parsed_tree.xpath(xpath_expression):
-                item.getparent().remove(item)
-                LOGGER.debug(u'Removed unwanted item %s.', item,
-                             extra={'siteconfig': self.config.host})
-
-        # Strip elements that use xpath expressions.
-        for pattern in self.config.strip:
-            _remove(pattern)
-
-        # Strip elements using #id or .class attribute values.
-        for pattern in self.config.strip_id_or_class:
-            _remove(
-                "//*[contains(@class, '{0}') or contains(@id, '{0}')]".format(
-                    pattern.replace('"', '').replace("'", '')
-                )
-            )
-
-        # Strip images using src attribute values.
-
-        for pattern in self.config.strip_image_src:
-            _remove(
-                "//img[contains(@src, '{0}')]".format(
-                    pattern.replace('"', '').replace("'", '')
-                )
-            )
-
-        # Strip elements using Readability.com and Instapaper.com ignore
-        # classes names .entry-unrelated and .instapaper_ignore
-        # See https://www.readability.com/publishers/guidelines/#view-plainGuidelines  # NOQA
-        # and http://blog.instapaper.com/post/730281947 for details.
-        _remove(
-            "//*[contains(concat(' ',normalize-space(@class),' ')"
-            ",' entry-unrelated ') or contains(concat(' ',"
-            "normalize-space(@class),' '),' instapaper_ignore ')]"
-        )
-
-        # Strip elements that contain style="display: none;".
-        _remove("//*[contains(@style,'display:none')]")
+        return result
+
+    def _remove_items(self, items):
+        """ Remove ``items`` from the document, in turn. """
+
+        for item in items:
+            parent = item.getparent()
+
+            if parent is None:
+                # The document root, or an element listed twice
+                # by the fallback evaluation and already removed.
+                continue
+
+            parent.remove(item)
+            LOGGER.debug(u'Removed unwanted item %s.', item,
+                         extra={'siteconfig': self.config.host})
 
     def _extract_body(self):
         """ Extract the body content from HTML. """
 
-        def is_descendant_node(parent, node):
-            node = node.getparent()
-            while node is not None:
-                if node == parent:
-                    return True
-                node = node.getparent()
-            return False
-
-        for pattern in self.config.body:
-            items = self.parsed_tree.xpath(pattern)
+        for xpath in self.config.xpaths('body'):
+            items = xpath(self.parsed_tree)
 
             if len(items) == 1:
                 if self.config.prune:
-                    self.body = Document(etree.tostring(items[0])).summary()
+                    self.body = TreeDocument(items[0]).summary()
 
                 else:
                     self.body = etree.tostring(items[0])
@@ -457,65 +695,46 @@ class ContentExtractor(object):
                 appended_something = False
                 body = etree.Element("root")
 
+                # All elements of the items appended so far. XPath results
+                # are in document order, thus nested items come after their
+                # ancestor and are skipped, without walking up the tree.
+                appended_nodes = set()
+
                 for item in items:
                     if item.getparent() is None:
                         continue
 
-                    is_descendant = False
-
-                    for parent in body:
-                        if (is_descendant_node(parent, item)):
-                            is_descendant = True
-                            break
-
-                    if not is_descendant:
-
-                        if self.config.prune:
-
-                            # Clean with readability. Needs
-                            # to-string conversion first.
-                            pruned_string = Document(
-                                etree.tostring(item)).summary()
-
-                            # Re-parse the readability string
-                            # output and include it in our body.
-                            new_tree = etree.parse(
-                                StringIO(pruned_string), self.parser)
+                    if item in appended_nodes:
+                        continue
 
-                            failed = False
+                    appended_nodes.update(item.iter())
 
-                            try:
-                                body.append(
-                                    new_tree.xpath('//html/body/div/div')[0]
-                                )
-                            except IndexError:
+                    if self.config.prune:
 
-                                if 'id="readabilityBody"' in pruned_string:
-                                    try:
-                                        body.append(
-                                            new_tree.xpath('//body')
-                                        )
-                                    except:
-                                        failed = True
+                        # Clean with readability, and include
+                        # its output tree in our body.
+                        new_tree = TreeDocument(item).summary_tree()
 
-                                else:
-                                    failed = True
+                        try:
+                            body.append(
+                                new_tree.xpath('//html/body/div/div')[0]
+                            )
 
-                            if failed:
-                                LOGGER.error(u'Pruning item failed:'
-                                             u'\n\n%s\n\nWe got: “%s” '
-                                             u'and skipped it.',
-                                             etree.tostring(
-                                                 item).replace(u'\n', u''),
-                                             pruned_string.replace(u'\n', u''),
-                                             extra={'siteconfig':
-                                                    self.config.host})
-                                pass
+                        except IndexError:
+                            LOGGER.error(u'Pruning item failed:'
+                                         u'\n\n%s\n\nWe got: “%s” '
+                                         u'and skipped it.',
+                                         etree.tostring(
+                                             item).replace(u'\n', u''),
+                                         etree.tostring(
+                                             new_tree).replace(u'\n', u''),
+                                         extra={'siteconfig':
+                                                self.config.host})
 
-                        else:
-                            body.append(item)
+                    else:
+                        body.append(item)
 
-                        appended_something = True
+                    appended_something = True
 
                 if appended_something:
                     self.body = etree.tostring(body)
@@ -529,7 +748,9 @@ class ContentExtractor(object):
         if not self.config.autodetect_on_failure:
             return
 
-        readabilitized = Document(self.html)
+        # Like in the original implementation, readability works on the
+        # document we already parsed, with unwanted elements stripped.
+        readabilitized = TreeDocument(self.parsed_tree.getroot())
 
         if self.title is None:
             if bool(self.config.title):
@@ -601,7 +822,9 @@ class ContentExtractor(object):
               up a config if an ``url`` is passed as argument.
 
         .. note:: If tidy is used and no result is produced, we will try
-            again without tidying.
+            again without tidying, from the HTML already replaced, all
+            previous results reset. See :func:`ftr_extraction_stats` for
+            how often this happens.
             Generally speaking, tidy helps us deal with PHP's patchy HTML
             parsing (LOOOOOL. Zeriously?) most of the time but it has
             problems of its own which we try to avoid with this option.
@@ -616,11 +839,32 @@ class ContentExtractor(object):
         if self.config is None:
             raise RuntimeError(u'extractor site config is not set.')
 
-        # TODO: If re-running ourselves over an already-replaced string,
-        #       this should just do nothing because everything has been
-        #       done. We should have a test for that.
+        _ftr_count_extraction('extractions')
+
         html = self._process_replacements(html)
 
+        self._extract(html, smart_tidy)
+
+        # if we've had no success and we've used tidy, there's a chance
+        # that tidy has messed up. So let's try again without tidy, on
+        # the same replaced HTML, and from a clean state.
+        if not self.success and self.tidied:
+            _ftr_count_extraction('fallbacks')
+
+            config = self.config
+            self.reset()
+            self.config = config
+
+            self._extract(html, smart_tidy=False)
+
+            if self.success:
+                _ftr_count_extraction('fallback_successes')
+
+        return self.success
+
+    def _extract(self, html, smart_tidy):
+        """ Extract everything from already replaced :param:`html`. """
+
         # We keep the html untouched after replacements.
         # All processing happens on self.html after this point.
         self._tidy(html, smart_tidy)
@@ -653,10 +897,3 @@ class ContentExtractor(object):
             or bool(self.author) or self.date is not None \
                 or self.language is not None:
             self.success = True
-
-        # if we've had no success and we've used tidy, there's a chance
-        # that tidy has messed up. So let's try again without tidy...
-        if not self.success and self.tidied and smart_tidy:
-            self.process(html, url=None, smart_tidy=False)
-
-        return self.success
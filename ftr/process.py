@@ -41,7 +41,7 @@ except ImportError:
     # Happens during installation before setup.py finishes installing deps.
     requests = None
 
-from .config import ftr_get_config, SiteConfig, CACHE_TIMEOUT, cached
+from .config import ftr_get_site_config, CACHE_TIMEOUT, cached
 from .extractor import ContentExtractor
 
 try:
@@ -136,6 +136,8 @@ def ftr_process(url=None, content=None, config=None, base_url=None):
           Please RFTD carefully, and report strange unicornic edge-cases.
         - :class:`SiteConfigNotFound` if no five-filter site config can
           be found.
+        - :class:`InvalidSiteConfig` if the site config found contains
+          an invalid XPath expression.
         - any raw ``requests.*`` exception, network related, if anything
           goes wrong during url fetching.
 
@@ -187,9 +189,9 @@ def ftr_process(url=None, content=None, config=None, base_url=None):
             raise
 
     if config is None:
-        # This can eventually raise SiteConfigNotFound
-        config_string, matched_host = ftr_get_config(url)
-        config = SiteConfig(site_config_text=config_string, host=matched_host)
+        # This can eventually raise SiteConfigNotFound. The
+        # returned instance is shared, frozen and already compiled.
+        config = ftr_get_site_config(url)
 
     extractor = ContentExtractor(config)
 
@@ -0,0 +1,790 @@
+# -*- coding: utf-8 -*-
+u""" Python FTR siteconfig repositories helpers.
+
+Repositories are listed in the ``PYTHON_FTR_REPOSITORIES`` environment
+variable (see :func:`ftr.config.ftr_get_repositories`). This module holds
+the machinery used by :func:`ftr.config.ftr_get_config` to query them
+efficiently.
+
+Besides directories and remote URLs, a repository can be a single SQLite
+database, given as ``sqlite:///path/to/siteconfigs.db``. It is faster to
+query, copy and update than thousands of tiny files. Build it from an
+``ftr-site-config`` checkout with :func:`ftr_build_sqlite_repository`, or
+the ``ftr-sync --sqlite`` command (see :mod:`ftr.sync`).
+
+.. Copyright 2015 Olivier Cortès <oc@1flow.io>.
+
+    This file is part of the python-ftr project.
+
+    python-ftr is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of
+    the License, or (at your option) any later version.
+
+    python-ftr is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public
+    License along with python-ftr. If not, see http://www.gnu.org/licenses/
+"""
+
+import os
+import time
+import codecs
+import hashlib
+import logging
+import sqlite3
+import tempfile
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+
+except ImportError:
+    # Avoid a crash during setup.py
+    # In normal conditions where deps are installed, this should not happen.
+    pass
+
+from .version import version
+
+LOGGER = logging.getLogger(__name__)
+
+# Connections to remote repositories. All hosts share the same settings.
+HTTP_POOL_SIZE = int(os.environ.get('PYTHON_FTR_HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get(
+    'PYTHON_FTR_HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('PYTHON_FTR_HTTP_READ_TIMEOUT', 15))
+
+# See ftr_get_http_session(). The PID is checked to never share
+# connections with a parent process after a fork().
+HTTP_SESSION = None
+HTTP_SESSION_PID = None
+HTTP_SESSION_LOCK = threading.Lock()
+
+# Circuit breaker: a repository failing this many times in a row is
+# skipped for the cooldown delay (in seconds), see RepositoryHealth.
+BREAKER_THRESHOLD = int(os.environ.get('PYTHON_FTR_BREAKER_THRESHOLD', 3))
+BREAKER_COOLDOWN = int(os.environ.get('PYTHON_FTR_BREAKER_COOLDOWN', 300))
+
+# One RepositoryHealth per repository, see ftr_get_repository_health().
+REPOSITORIES_HEALTH = {}
+REPOSITORIES_HEALTH_LOCK = threading.Lock()
+
+# Threads for concurrent probes, and for asynchronous lookups, see
+# ftr_get_thread_pool(). Pools are separate: lookups wait for probes.
+LOOKUP_THREADS = int(os.environ.get('PYTHON_FTR_LOOKUP_THREADS', 8))
+ASYNC_THREADS = int(os.environ.get('PYTHON_FTR_ASYNC_THREADS', 8))
+THREAD_POOLS = {}
+THREAD_POOLS_LOCK = threading.Lock()
+
+# One index per local repository path, see ftr_get_local_index().
+LOCAL_INDEXES = {}
+LOCAL_INDEXES_LOCK = threading.Lock()
+
+# Directories modified less than this number of seconds before they were
+# listed are listed again, see LocalRepositoryIndex.
+INDEX_MTIME_GRANULARITY = 2
+
+# Prefix of SQLite repositories in PYTHON_FTR_REPOSITORIES.
+SQLITE_PREFIX = u'sqlite://'
+
+# One SQLiteRepository per database, see ftr_get_sqlite_repository().
+SQLITE_REPOSITORIES = {}
+SQLITE_REPOSITORIES_LOCK = threading.Lock()
+
+SQLITE_SCHEMA = u"""
+    CREATE TABLE siteconfigs (
+        name TEXT PRIMARY KEY,
+        content TEXT NOT NULL,
+        sha1 TEXT NOT NULL
+    );
+"""
+
+
+class SiteConfigTrie(object):
+
+    """ Siteconfig names, indexed by reversed domain labels.
+
+    ``example.com`` and ``.example.com`` are both stored under the
+    ``com`` → ``example`` path. Finding the most specific siteconfig of
+    a host is a single walk down its labels, whatever the number of
+    siteconfigs or the depth of the host.
+
+    Values are whatever the repository needs to load a siteconfig (eg.
+    its file name).
+    """
+
+    # Keys of values in trie nodes. Labels are strings, they never clash.
+    EXACT = 0
+    WILDCARD = 1
+
+    def __init__(self):
+        """ Create an empty trie. """
+
+        self.root = {}
+        self.size = 0
+
+    def __len__(self):
+        """ Return the number of siteconfig names. """
+
+        return self.size
+
+    def __iter__(self):
+        """ Yield all ``(siteconfig_name, value)`` tuples, in no order. """
+
+        pending = [((), self.root)]
+
+        while pending:
+            labels, node = pending.pop()
+
+            for key, child in node.iteritems():
+                if key == self.EXACT:
+                    yield u'.'.join(reversed(labels)), child
+
+                elif key == self.WILDCARD:
+                    yield u'.' + u'.'.join(reversed(labels)), child
+
+                else:
+                    pending.append((labels + (key, ), child))
+
+    def add(self, siteconfig_name, value):
+        """ Add a siteconfig name, eg. ``example.com`` or ``.example.com``.
+        """
+
+        if siteconfig_name.startswith(u'.'):
+            kind, domain_name = self.WILDCARD, siteconfig_name[1:]
+
+        else:
+            kind, domain_name = self.EXACT, siteconfig_name
+
+        node = self.root
+
+        for label in reversed(domain_name.split(u'.')):
+            node = node.setdefault(label, {})
+
+        if kind not in node:
+            self.size += 1
+
+        node[kind] = value
+
+    def lookup(self, domain_names):
+        """ Find the siteconfig of the most specific matching domain name.
+
+        The result is the same as trying, for each domain name in turn,
+        ``name`` then ``.name``, but only the most specific domain name
+        is walked.
+
+        :param domain_names: domain names, most specific first, each
+            one a suffix of the first, as returned by
+            :func:`ftr.config.ftr_get_domain_names`.
+        :type domain_names: sequence of unicode strings
+
+        :returns: a ``(value, siteconfig_name)`` tuple, or ``None``.
+        """
+
+        if not domain_names:
+            return None
+
+        labels = domain_names[0].split(u'.')
+
+        # Suffixes shorter than the least specific domain name do not count.
+        min_depth = domain_names[-1].count(u'.') + 1
+
+        node = self.root
+        found = None
+        depth = 0
+
+        for label in reversed(labels):
+            node = node.get(label)
+
+            if node is None:
+                break
+
+            depth += 1
+
+            if depth < min_depth:
+                continue
+
+            if self.EXACT in node:
+                found = depth, self.EXACT, node[self.EXACT]
+
+            elif self.WILDCARD in node:
+                found = depth, self.WILDCARD, node[self.WILDCARD]
+
+        if found is None:
+            return None
+
+        depth, kind, value = found
+        domain_name = u'.'.join(labels[-depth:])
+
+        return value, (domain_name if kind == self.EXACT
+                       else u'.' + domain_name)
+
+
+class LocalRepositoryIndex(object):
+
+    """ In-memory index of the siteconfig files of a local repository.
+
+    The repository directory is listed once, and listed again only when
+    its modification time changes (eg. a file was added, removed or
+    renamed), or when it is a symlink that now points somewhere else
+    (eg. the ``current`` version of an :mod:`ftr.sync` mirror). A lookup
+    thus costs resolving the directory path (:func:`os.path.realpath`,
+    one ``lstat()`` per path component) and one ``stat()`` of it,
+    instead of two ``stat()`` calls per domain name, and one walk in a
+    :class:`SiteConfigTrie`.
+
+    Modification times are coarse on some filesystems: a directory
+    changed in the same tick as its listing keeps the same one. It is
+    thus listed again until :data:`INDEX_MTIME_GRANULARITY` seconds have
+    passed since its last change.
+
+    :param path: the repository directory.
+    :type path: str or unicode
+    """
+
+    def __init__(self, path):
+        """ Create an empty index, filled at first :meth:`refresh`. """
+
+        self.path = path
+        self.realpath = None
+        self.mtime = None
+        self.listed = None
+
+        # siteconfig name (eg. `example.com` or `.example.com`) → filename.
+        self.trie = SiteConfigTrie()
+
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """ Re-list the repository directory if it changed.
+
+        :param force: re-list even if the directory did not change.
+        :type force: bool
+
+        :returns: bool -- ``True`` if the directory was listed again.
+        :raises: :class:`OSError` if the directory is not accessible.
+        """
+
+        realpath = os.path.realpath(self.path)
+        mtime = os.stat(realpath).st_mtime
+
+        if not force and realpath == self.realpath and mtime == self.mtime \
+                and self.listed - mtime > INDEX_MTIME_GRANULARITY:
+            return False
+
+        with self._lock:
+            listed = time.time()
+            trie = SiteConfigTrie()
+
+            for filename in os.listdir(realpath):
+                if filename.endswith(u'.txt'):
+                    trie.add(filename[:-4], os.path.join(realpath, filename))
+
+            # Swap everything at once for concurrent lookups.
+            self.trie = trie
+            self.realpath = realpath
+            self.mtime = mtime
+            self.listed = listed
+
+        LOGGER.debug(u'Indexed %s siteconfigs in %s.', len(trie), realpath)
+
+        return True
+
+    def lookup(self, domain_names):
+        """ Find the siteconfig file for the first matching domain name.
+
+        For each domain name, ``name.txt`` is tried before ``.name.txt``,
+        like :func:`ftr.config.ftr_get_config` does. The index is not
+        refreshed here, see :func:`ftr_get_local_index`.
+
+        :param domain_names: see :meth:`SiteConfigTrie.lookup`.
+
+        :returns: a ``(filename, siteconfig_name)`` tuple, or ``None``.
+        """
+
+        return self.trie.lookup(domain_names)
+
+
+class SQLiteRepository(object):
+
+    """ A siteconfig repository stored in a single SQLite database.
+
+    Siteconfigs are rows of the ``siteconfigs`` table, by siteconfig
+    name (eg. ``example.com`` or ``.example.com``, the file name without
+    ``.txt``). The name is the primary key: looking all candidates of
+    a host up costs one indexed query.
+
+    Each thread gets its own connection. Connections are re-opened when
+    the database file is replaced (eg. by a new import, see
+    :func:`ftr_build_sqlite_repository`), or after a ``fork()``.
+
+    :param path: the database file.
+    :type path: str or unicode
+    """
+
+    def __init__(self, path):
+        """ Create a repository, without opening the database yet. """
+
+        self.path = path
+
+        self._local = threading.local()
+        self._trie = None
+
+    def _get_connection(self):
+        """ Return a connection to the current database file.
+
+        :raises: :class:`OSError` if the file does not exist, because
+            :func:`sqlite3.connect` would silently create an empty one.
+        """
+
+        stat = os.stat(self.path)
+        signature = (os.getpid(), stat.st_ino, stat.st_mtime)
+
+        if getattr(self._local, 'signature', None) != signature:
+            self._local.connection = sqlite3.connect(self.path)
+            self._local.signature = signature
+
+        return self._local.connection
+
+    def lookup(self, domain_names):
+        """ Find the siteconfig for the first matching domain name.
+
+        For each domain name, ``name`` is tried before ``.name``, like in
+        directory repositories (see :meth:`LocalRepositoryIndex.lookup`).
+
+        :param domain_names: domain names, most specific first.
+        :type domain_names: iterable of unicode strings
+
+        :returns: a ``(content, siteconfig_name, sha1)`` tuple, or ``None``.
+        :raises: :class:`OSError` if the database does not exist,
+            :class:`sqlite3.Error` if it cannot be read.
+        """
+
+        candidates = []
+
+        for domain_name in domain_names:
+            candidates.extend((domain_name, u'.' + domain_name))
+
+        rows = dict(
+            (name, (content, sha1))
+            for name, content, sha1 in self._get_connection().execute(
+                u'SELECT name, content, sha1 FROM siteconfigs '
+                u'WHERE name IN ({0})'.format(
+                    u', '.join(u'?' * len(candidates))),
+                candidates)
+        )
+
+        for siteconfig_name in candidates:
+            found = rows.get(siteconfig_name)
+
+            if found is not None:
+                return found[0], siteconfig_name, found[1]
+
+        return None
+
+    def siteconfigs(self):
+        """ Yield all ``(siteconfig_name, content, sha1)`` tuples.
+
+        :raises: see :meth:`lookup`.
+        """
+
+        return iter(self._get_connection().execute(
+            u'SELECT name, content, sha1 FROM siteconfigs').fetchall())
+
+    def get_trie(self):
+        """ Return a :class:`SiteConfigTrie` of all siteconfig names.
+
+        It is built at first call, and again when the database file is
+        replaced. Values are the siteconfig names.
+
+        :raises: see :meth:`lookup`.
+        """
+
+        connection = self._get_connection()
+        signature = self._local.signature[1:]
+        cached = self._trie
+
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        trie = SiteConfigTrie()
+
+        for (name, ) in connection.execute(u'SELECT name FROM siteconfigs'):
+            trie.add(name, name)
+
+        self._trie = signature, trie
+
+        return trie
+
+
+class RepositoryHealth(object):
+
+    """ Latency and error statistics of a repository, and its circuit breaker.
+
+    After ``PYTHON_FTR_BREAKER_THRESHOLD`` consecutive errors (default:
+    3), the breaker opens and the repository is skipped by lookups for
+    ``PYTHON_FTR_BREAKER_COOLDOWN`` seconds (default: 300). Then probes
+    are allowed again; the first error re-opens the breaker, the first
+    success closes it.
+
+    :param repository: the repository path or URL.
+    :type repository: str or unicode
+    """
+
+    def __init__(self, repository):
+        """ Create a healthy repository record. """
+
+        self.repository = repository
+
+        self.probes = 0
+        self.errors = 0
+        self.skipped = 0
+        self.consecutive_errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_error = None
+        self.opened_until = None
+        self.trips = 0
+
+        self._lock = threading.Lock()
+
+    def is_available(self):
+        """ Return ``False`` if the breaker is open, and count a skip. """
+
+        opened_until = self.opened_until
+
+        if opened_until is None or opened_until <= time.time():
+            return True
+
+        with self._lock:
+            self.skipped += 1
+
+        return False
+
+    def record(self, duration, error=None):
+        """ Record a probe duration, and its error if any.
+
+        :param duration: the probe duration, in seconds.
+        :type duration: float
+
+        :param error: a description of the error, or ``None`` if the
+            probe succeeded (a missing siteconfig is not an error).
+        :type error: unicode or None
+        """
+
+        with self._lock:
+            self.probes += 1
+            self.total_time += duration
+            self.max_time = max(self.max_time, duration)
+
+            if error is None:
+                self.consecutive_errors = 0
+                self.opened_until = None
+                return
+
+            self.errors += 1
+            self.consecutive_errors += 1
+            self.last_error = error
+
+            if self.consecutive_errors >= BREAKER_THRESHOLD:
+                self.opened_until = time.time() + BREAKER_COOLDOWN
+                self.trips += 1
+
+                LOGGER.error(u'Repository %s failed %s times in a row, '
+                             u'skipping it for %s seconds.',
+                             self.repository, self.consecutive_errors,
+                             BREAKER_COOLDOWN)
+
+    def as_dict(self):
+        """ Return the statistics as a ``dict``, for operators. """
+
+        with self._lock:
+            opened_until = self.opened_until
+
+            return {
+                'probes': self.probes,
+                'errors': self.errors,
+                'skipped': self.skipped,
+                'consecutive_errors': self.consecutive_errors,
+                'average_time': (self.total_time / self.probes
+                                 if self.probes else 0.0),
+                'max_time': self.max_time,
+                'last_error': self.last_error,
+                'breaker_trips': self.trips,
+                'breaker_open': (opened_until is not None
+                                 and opened_until > time.time()),
+            }
+
+
+def ftr_get_repository_health(repository):
+    """ Return the :class:`RepositoryHealth` of a repository. """
+
+    try:
+        return REPOSITORIES_HEALTH[repository]
+
+    except KeyError:
+        with REPOSITORIES_HEALTH_LOCK:
+            return REPOSITORIES_HEALTH.setdefault(
+                repository, RepositoryHealth(repository))
+
+
+def ftr_repositories_health():
+    """ Return the statistics of all repositories probed by this process.
+
+    :returns: a ``dict`` of repository → ``dict`` of statistics, see
+        :meth:`RepositoryHealth.as_dict`. Times are in seconds.
+    """
+
+    return dict(
+        (repository, health.as_dict())
+        for repository, health in REPOSITORIES_HEALTH.items()
+    )
+
+
+def ftr_get_local_index(repository):
+    """ Return the :class:`LocalRepositoryIndex` of a local repository.
+
+    Indexes are built once per process, and refreshed if needed at
+    each call.
+
+    :param repository: a local repository path.
+    :type repository: str or unicode
+
+    :returns: a :class:`LocalRepositoryIndex` instance, or ``None`` if
+        ``repository`` is not an accessible directory.
+    """
+
+    try:
+        index = LOCAL_INDEXES[repository]
+
+    except KeyError:
+        if not os.path.isdir(repository):
+            return None
+
+        with LOCAL_INDEXES_LOCK:
+            index = LOCAL_INDEXES.setdefault(
+                repository, LocalRepositoryIndex(repository))
+
+    try:
+        index.refresh()
+
+    except OSError, e:
+        LOGGER.warning(u'Could not index local repository %s: %s.',
+                       repository, e)
+        return None
+
+    return index
+
+
+def ftr_get_sqlite_repository(repository):
+    """ Return the :class:`SQLiteRepository` of a ``sqlite://`` repository.
+
+    :param repository: a repository entry, eg.
+        ``sqlite:///var/lib/ftr/siteconfigs.db``.
+    :type repository: str or unicode
+    """
+
+    try:
+        return SQLITE_REPOSITORIES[repository]
+
+    except KeyError:
+        with SQLITE_REPOSITORIES_LOCK:
+            return SQLITE_REPOSITORIES.setdefault(
+                repository,
+                SQLiteRepository(repository[len(SQLITE_PREFIX):]))
+
+
+def ftr_build_sqlite_repository(directory, database):
+    """ Build an SQLite repository from a directory of siteconfigs.
+
+    All ``.txt`` files of ``directory`` (eg. an ``ftr-site-config``
+    checkout) are imported. The database is built in a temporary file,
+    then renamed over ``database``: running lookups switch to the new
+    content atomically.
+
+    :param directory: the siteconfigs directory.
+    :type directory: str or unicode
+
+    :param database: the database file to create or replace.
+    :type database: str or unicode
+
+    :returns: int -- the number of imported siteconfigs.
+    """
+
+    descriptor, temporary = tempfile.mkstemp(
+        prefix=u'.', suffix=u'.db',
+        dir=os.path.dirname(os.path.abspath(database)))
+    os.close(descriptor)
+
+    count = 0
+
+    try:
+        connection = sqlite3.connect(temporary)
+
+        try:
+            connection.execute(SQLITE_SCHEMA)
+
+            for filename in sorted(os.listdir(directory)):
+                if not filename.endswith(u'.txt'):
+                    continue
+
+                with codecs.open(os.path.join(directory, filename),
+                                 'rb', encoding='utf8') as f:
+                    content = f.read()
+
+                connection.execute(
+                    u'INSERT INTO siteconfigs (name, content, sha1) '
+                    u'VALUES (?, ?, ?)',
+                    (filename[:-4], content,
+                     hashlib.sha1(content.encode('utf-8')).hexdigest()))
+
+                count += 1
+
+            connection.commit()
+
+        finally:
+            connection.close()
+
+        # mkstemp() creates a 0600 file.
+        os.chmod(temporary, 0644)
+        os.rename(temporary, database)
+
+    except:
+        os.unlink(temporary)
+        raise
+
+    LOGGER.info(u'Imported %s siteconfigs from %s into %s.',
+                count, directory, database)
+
+    return count
+
+
+def ftr_get_http_session():
+    """ Return the :class:`requests.Session` used for remote repositories.
+
+    The session is shared by all threads of a process. It keeps
+    connections alive, in a pool of ``PYTHON_FTR_HTTP_POOL_SIZE``
+    connections per host (default: 10), and asks for gzipped contents.
+    Consecutive probes of a repository thus reuse the same connection.
+
+    A new session is created in forked child processes.
+    """
+
+    global HTTP_SESSION, HTTP_SESSION_PID
+
+    pid = os.getpid()
+
+    if HTTP_SESSION is None or HTTP_SESSION_PID != pid:
+        with HTTP_SESSION_LOCK:
+            if HTTP_SESSION is None or HTTP_SESSION_PID != pid:
+                session = requests.Session()
+
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                                      pool_maxsize=HTTP_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+
+                session.headers.update({
+                    'Accept-Encoding': 'gzip, deflate',
+                    'User-Agent': 'python-ftr/{0}'.format(version),
+                })
+
+                HTTP_SESSION = session
+                HTTP_SESSION_PID = pid
+
+    return HTTP_SESSION
+
+
+def ftr_get_thread_pool(purpose='probes'):
+    """ Return a thread pool shared by all lookups of a process.
+
+    A new pool is created in forked child processes, threads do not
+    survive a fork.
+
+    :param purpose: ``probes`` for concurrent repository probes, with
+        ``PYTHON_FTR_LOOKUP_THREADS`` threads (default: 8), or ``async``
+        for asynchronous lookups (see :func:`ftr.config.ftr_get_config_async`),
+        with ``PYTHON_FTR_ASYNC_THREADS`` threads (default: 8).
+    :type purpose: str
+    """
+
+    pid = os.getpid()
+    pool_pid, pool = THREAD_POOLS.get(purpose, (None, None))
+
+    if pool_pid != pid:
+        with THREAD_POOLS_LOCK:
+            pool_pid, pool = THREAD_POOLS.get(purpose, (None, None))
+
+            if pool_pid != pid:
+                pool = ThreadPool({
+                    'probes': LOOKUP_THREADS,
+                    'async': ASYNC_THREADS,
+                }[purpose])
+                THREAD_POOLS[purpose] = pid, pool
+
+    return pool
+
+
+def ftr_http_get(url, **kwargs):
+    """ Run a ``GET`` request on the shared session.
+
+    Unless given in ``kwargs``, the timeout is made of
+    ``PYTHON_FTR_HTTP_CONNECT_TIMEOUT`` (default: 5 seconds) and
+    ``PYTHON_FTR_HTTP_READ_TIMEOUT`` (default: 15 seconds).
+
+    :returns: a :class:`requests.Response` instance.
+    :raises: any :class:`requests.RequestException`.
+    """
+
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+    return ftr_get_http_session().get(url, **kwargs)
+
+
+def ftr_http_get_conditional(url, validators=None):
+    """ Run a ``GET`` request, conditional if ``validators`` are given.
+
+    :param validators: the ``(ETag, Last-Modified)`` header values of a
+        previous response, either can be ``None``. See
+        :func:`ftr_get_validators`.
+    :type validators: tuple or None
+
+    :returns: the response, ``304 Not Modified`` if the content did not
+        change since the previous one.
+    :raises: any :class:`requests.RequestException`.
+    """
+
+    headers = {}
+
+    if validators is not None:
+        etag, last_modified = validators
+
+        if etag:
+            headers['If-None-Match'] = etag
+
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    return ftr_http_get(url, headers=headers)
+
+
+def ftr_get_validators(response):
+    """ Return the ``(ETag, Last-Modified)`` header values of ``response``.
+
+    :returns: a tuple, for :func:`ftr_http_get_conditional`, or ``None``
+        if the response has neither header.
+    """
+
+    etag = response.headers.get('etag')
+    last_modified = response.headers.get('last-modified')
+
+    if etag or last_modified:
+        return etag, last_modified
+
+    return None
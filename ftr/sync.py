@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+u""" Mirror a remote siteconfig repository into a local directory.
+
+Instead of having every worker probe GitHub for each new host, download
+the whole repository periodically (eg. from a cron job) in one archive::
+
+    ftr-sync /var/lib/ftr-site-config
+
+    # or, without installing the console script:
+    python -m ftr.sync /var/lib/ftr-site-config
+
+And point FTR to the mirror, without any remote repository::
+
+    export PYTHON_FTR_REPOSITORIES=/var/lib/ftr-site-config/current
+
+Each synchronization extracts the archive into a new version directory
+(``versions/<date>-<hash>``), then atomically switches the ``current``
+symlink to it. Running lookups never see a partially-extracted
+repository, and the last versions are kept for an eventual rollback.
+
+With ``--sqlite``, an SQLite repository is also built from the current
+version, and replaced atomically too::
+
+    ftr-sync --sqlite /var/lib/ftr-site-config.db /var/lib/ftr-site-config
+    export PYTHON_FTR_REPOSITORIES=sqlite:///var/lib/ftr-site-config.db
+
+An existing ``ftr-site-config`` checkout can be imported directly::
+
+    ftr-build-sqlite ~/sources/ftr-site-config /var/lib/ftr-site-config.db
+
+.. Copyright 2015 Olivier Cortès <oc@1flow.io>.
+
+    This file is part of the python-ftr project.
+
+    python-ftr is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of
+    the License, or (at your option) any later version.
+
+    python-ftr is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public
+    License along with python-ftr. If not, see http://www.gnu.org/licenses/
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import hashlib
+import logging
+import tarfile
+import argparse
+import tempfile
+
+try:
+    import requests
+
+except ImportError:
+    # Avoid a crash during setup.py
+    # In normal conditions where deps are installed, this should not happen.
+    pass
+
+from .repository import ftr_build_sqlite_repository, ftr_http_get
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_ARCHIVE_URL = (
+    u'https://github.com/fivefilters/ftr-site-config/archive/master.tar.gz'
+)
+
+# Name of the file holding synchronization metadata in each version.
+VERSION_FILENAME = u'VERSION.json'
+
+# Name of the file holding the state of the last download, in the mirror
+# directory: versions are never modified once published.
+SYNC_STATE_FILENAME = u'.sync-state.json'
+
+
+def ftr_get_synced_version(destination):
+    """ Return the metadata of the current version of a mirror.
+
+    :param destination: the mirror directory, as given to
+        :func:`ftr_sync_repository`.
+
+    :returns: a ``dict`` with ``archive_url``, ``etag``, ``sha1``,
+        ``date`` and ``siteconfigs`` keys, or ``None`` if the mirror was
+        never synchronized.
+    """
+
+    return _read_json(os.path.join(destination, u'current',
+                                   VERSION_FILENAME))
+
+
+def _read_json(filename):
+    """ Return the content of a JSON file, ``None`` if it is unreadable. """
+
+    try:
+        with open(filename, 'rb') as f:
+            return json.load(f)
+
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _download(archive_url, etag=None):
+    """ Download ``archive_url`` to a temporary file.
+
+    :returns: a ``(filename, etag, sha1)`` tuple, or ``None`` if the
+        archive was not modified since ``etag``.
+    """
+
+    headers = {} if etag is None else {'If-None-Match': etag}
+
+    response = ftr_http_get(archive_url, headers=headers, stream=True)
+
+    if response.status_code == requests.codes.not_modified:
+        return None
+
+    response.raise_for_status()
+
+    sha1 = hashlib.sha1()
+    descriptor, filename = tempfile.mkstemp(suffix=u'.tar.gz')
+
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=65536):
+                sha1.update(chunk)
+                f.write(chunk)
+
+    except:
+        os.unlink(filename)
+        raise
+
+    return filename, response.headers.get('etag'), sha1.hexdigest()
+
+
+def _extract_siteconfigs(archive_filename, directory):
+    """ Extract top-level ``.txt`` files of an archive into ``directory``.
+
+    Archives made by GitHub hold everything in a single top directory,
+    which is skipped. Anything else than plain ``.txt`` files of that
+    directory is ignored.
+
+    :returns: int -- the number of extracted siteconfigs.
+    """
+
+    count = 0
+
+    with tarfile.open(archive_filename, 'r:*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+
+            parts = member.name.split(u'/')
+
+            if len(parts) != 2 or not parts[1].endswith(u'.txt'):
+                continue
+
+            source = archive.extractfile(member)
+
+            with open(os.path.join(directory, parts[1]), 'wb') as f:
+                shutil.copyfileobj(source, f)
+
+            count += 1
+
+    return count
+
+
+def _write_json(filename, data):
+    """ Write ``data`` in a JSON file, atomically. """
+
+    descriptor, temporary = tempfile.mkstemp(
+        prefix=u'.', dir=os.path.dirname(filename))
+
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            json.dump(data, f)
+
+        # mkstemp() creates a 0600 file.
+        os.chmod(temporary, 0644)
+        os.rename(temporary, filename)
+
+    except:
+        os.unlink(temporary)
+        raise
+
+
+def _switch_current(destination, version_name):
+    """ Atomically point the ``current`` symlink to ``version_name``. """
+
+    current = os.path.join(destination, u'current')
+    temporary = u'{0}.{1}'.format(current, os.getpid())
+
+    os.symlink(os.path.join(u'versions', version_name), temporary)
+
+    # rename() replaces the old symlink atomically.
+    os.rename(temporary, current)
+
+
+def _cleanup_versions(destination, keep):
+    """ Remove all but the ``keep`` most recent versions. """
+
+    versions_directory = os.path.join(destination, u'versions')
+    current = os.path.basename(
+        os.path.realpath(os.path.join(destination, u'current')))
+
+    versions = sorted(
+        x for x in os.listdir(versions_directory) if not x.startswith(u'.'))
+
+    for version_name in versions[:-keep]:
+        if version_name != current:
+            shutil.rmtree(os.path.join(versions_directory, version_name))
+            LOGGER.info(u'Removed old siteconfigs version %s.', version_name)
+
+
+def ftr_sync_repository(destination, archive_url=DEFAULT_ARCHIVE_URL,
+                        keep=3):
+    """ Synchronize a local mirror of a siteconfig repository.
+
+    The archive is downloaded only if it changed since the last
+    synchronization (its ``ETag`` is sent back to the server), and a new
+    version is created only if its content changed. The ``ETag`` is kept
+    in the ``.sync-state.json`` file of the mirror directory.
+
+    :param destination: the mirror directory. It is created if needed.
+        Use its ``current`` sub-directory in ``PYTHON_FTR_REPOSITORIES``.
+    :type destination: str or unicode
+
+    :param archive_url: the URL of a ``.tar.gz`` archive of the
+        repository. Default: the official Five Filters repository.
+    :type archive_url: str or unicode
+
+    :param keep: the number of versions to keep, including the current
+        one. Default: 3.
+    :type keep: int
+
+    :returns: the path of the current version, or ``None`` if nothing
+        changed.
+    :raises: any :class:`requests.RequestException` if the download fails,
+        or :class:`tarfile.TarError` if the archive is invalid. In both
+        cases, the current version is left untouched.
+    """
+
+    versions_directory = os.path.join(destination, u'versions')
+
+    if not os.path.isdir(versions_directory):
+        os.makedirs(versions_directory)
+
+    synced = ftr_get_synced_version(destination)
+    state_filename = os.path.join(destination, SYNC_STATE_FILENAME)
+
+    # Mirrors synchronized before the state file existed have the ETag
+    # of their current version only.
+    state = _read_json(state_filename) or synced
+
+    etag = None
+    if state is not None and state.get('archive_url') == archive_url:
+        etag = state.get('etag')
+
+    downloaded = _download(archive_url, etag)
+
+    if downloaded is None:
+        LOGGER.info(u'Siteconfigs archive %s not modified.', archive_url)
+        return None
+
+    archive_filename, etag, sha1 = downloaded
+
+    try:
+        if synced is not None and synced.get('sha1') == sha1:
+            LOGGER.info(u'Siteconfigs archive %s content did not change.',
+                        archive_url)
+
+            # Else the stale ETag would be sent again, and the
+            # archive downloaded again at each synchronization.
+            _write_json(state_filename, {
+                'archive_url': archive_url,
+                'etag': etag,
+                'sha1': sha1,
+            })
+
+            return None
+
+        version_name = u'{0}-{1}'.format(
+            time.strftime('%Y%m%d%H%M%S'), sha1[:8])
+
+        # Extract in a hidden directory, ignored by the cleanup
+        # and by lookups, in case something goes wrong.
+        temporary = tempfile.mkdtemp(prefix=u'.', dir=versions_directory)
+
+        try:
+            count = _extract_siteconfigs(archive_filename, temporary)
+
+            _write_json(os.path.join(temporary, VERSION_FILENAME), {
+                'archive_url': archive_url,
+                'etag': etag,
+                'sha1': sha1,
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'siteconfigs': count,
+            })
+
+            # mkdtemp() creates a 0700 directory.
+            os.chmod(temporary, 0755)
+
+            version_directory = os.path.join(versions_directory, version_name)
+            os.rename(temporary, version_directory)
+
+        except:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+
+    finally:
+        os.unlink(archive_filename)
+
+    _switch_current(destination, version_name)
+
+    _write_json(state_filename, {
+        'archive_url': archive_url,
+        'etag': etag,
+        'sha1': sha1,
+    })
+
+    LOGGER.info(u'Synchronized %s siteconfigs from %s into %s.',
+                count, archive_url, version_directory)
+
+    _cleanup_versions(destination, keep)
+
+    return version_directory
+
+
+def main(argv=None):
+    """ Command line entry point, see the module documentation. """
+
+    parser = argparse.ArgumentParser(
+        description=u'Mirror a siteconfig repository into a local directory.')
+    parser.add_argument('destination',
+                        help=u'the mirror directory; use its “current” '
+                             u'sub-directory in PYTHON_FTR_REPOSITORIES.')
+    parser.add_argument('--url', default=DEFAULT_ARCHIVE_URL,
+                        help=u'URL of a .tar.gz archive of the repository '
+                             u'(default: %(default)s).')
+    parser.add_argument('--keep', type=int, default=3,
+                        help=u'number of versions to keep (default: '
+                             u'%(default)s).')
+    parser.add_argument('--sqlite', metavar='DATABASE',
+                        help=u'also build an SQLite repository from the '
+                             u'current version, if it changed or if '
+                             u'DATABASE does not exist.')
+
+    arguments = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        version_directory = ftr_sync_repository(arguments.destination,
+                                                archive_url=arguments.url,
+                                                keep=max(arguments.keep, 1))
+
+        if arguments.sqlite and (version_directory is not None
+                                 or not os.path.exists(arguments.sqlite)):
+            ftr_build_sqlite_repository(
+                os.path.join(arguments.destination, u'current'),
+                arguments.sqlite)
+
+    except Exception:
+        LOGGER.exception(u'Synchronization failed.')
+        return 1
+
+    return 0
+
+
+def build_sqlite_main(argv=None):
+    """ Command line entry point of ``ftr-build-sqlite``. """
+
+    parser = argparse.ArgumentParser(
+        description=u'Build an SQLite repository from a siteconfig '
+                    u'directory, eg. an ftr-site-config checkout.')
+    parser.add_argument('directory', help=u'the siteconfig directory.')
+    parser.add_argument('database',
+                        help=u'the database file to create or replace; use '
+                             u'it as sqlite://DATABASE in '
+                             u'PYTHON_FTR_REPOSITORIES.')
+
+    arguments = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        ftr_build_sqlite_repository(arguments.directory, arguments.database)
+
+    except Exception:
+        LOGGER.exception(u'Import failed.')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -34,12 +34,20 @@ setup(
         'pytidylib',
         'lxml',
         'ordered-set',
-        'readability-lxml',
+        # TreeDocument (see ftr.extractor) overrides private methods
+        # of readability's Document, checked with these versions.
+        'readability-lxml>=0.3,<0.9',
         'requests',
     ],
     extras_require={
         'cache':  ['cacheops'],
     },
+    entry_points={
+        'console_scripts': [
+            'ftr-sync = ftr.sync:main',
+            'ftr-build-sqlite = ftr.sync:build_sqlite_main',
+        ],
+    },
     keywords=(
         'parsing',
         'websites',
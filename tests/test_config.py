@@ -0,0 +1,1172 @@
+# -*- coding: utf-8 -*-
+u""" Tests of :mod:`ftr.config`, on a temporary local repository. """
+
+import os
+import time
+import codecs
+import pickle
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing.pool import ThreadPool
+
+from ordered_set import OrderedSet
+
+import ftr
+import ftr.cache
+import ftr.config
+
+from ftr.cache import DiskCache, MemoryCache
+from ftr.config import FrozenSiteConfig
+from ftr.repository import (
+    REPOSITORIES_HEALTH,
+    THREAD_POOLS,
+    ftr_get_repository_health,
+)
+
+
+class LocalRepositoryTestCase(unittest.TestCase):
+
+    """ Look siteconfigs up only in a temporary directory, without caches. """
+
+    def setUp(self):
+        self.repository = tempfile.mkdtemp()
+        self.environ = os.environ.get('PYTHON_FTR_REPOSITORIES')
+        self.disk_cache = ftr.config.SITECONFIG_DISK_CACHE
+
+        os.environ['PYTHON_FTR_REPOSITORIES'] = self.repository
+        ftr.config.SITECONFIG_DISK_CACHE = None
+        ftr.config.SITECONFIG_CACHE.clear()
+        ftr.config.NOT_FOUND_CACHE.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.repository)
+
+        if self.environ is None:
+            del os.environ['PYTHON_FTR_REPOSITORIES']
+
+        else:
+            os.environ['PYTHON_FTR_REPOSITORIES'] = self.environ
+
+        ftr.config.SITECONFIG_DISK_CACHE = self.disk_cache
+        ftr.config.SITECONFIG_CACHE.clear()
+        ftr.config.NOT_FOUND_CACHE.clear()
+
+    def write_siteconfig(self, name, content):
+        filename = os.path.join(self.repository, name + u'.txt')
+
+        with codecs.open(filename, 'wb', encoding='utf8') as f:
+            f.write(content)
+
+        return filename
+
+    def change(self, filename, content, delay=10):
+        """ Write ``content``, with a later modification time. """
+
+        mtime = os.stat(filename).st_mtime + delay
+
+        with codecs.open(filename, 'wb', encoding='utf8') as f:
+            f.write(content)
+
+        os.utime(filename, (mtime, mtime))
+
+
+class CachedLookups(object):
+
+    """ Stands for the :mod:`cacheops` cache of ``_ftr_lookup_config()``. """
+
+    def __init__(self, function):
+        self.function = function
+        self.results = {}
+        self.misses = []
+
+    def __call__(self, *args):
+        if args not in self.results:
+            self.misses.append(args)
+            self.results[args] = self.function(*args)
+
+        return self.results[args]
+
+    def invalidate(self, *args):
+        self.results.pop(args, None)
+
+
+class LookupCacheKeyTest(LocalRepositoryTestCase):
+
+    """ Lookups are cached by domain names, not by article URL. """
+
+    def setUp(self):
+        super(LookupCacheKeyTest, self).setUp()
+        self.lookup_config = ftr.config._ftr_lookup_config
+
+        ftr.config._ftr_lookup_config = self.lookups = CachedLookups(
+            self.lookup_config)
+        ftr.config.ftr_reset_config_cache_stats()
+
+        self.write_siteconfig(u'example.com', u'body: //div\n')
+
+    def tearDown(self):
+        ftr.config._ftr_lookup_config = self.lookup_config
+        super(LookupCacheKeyTest, self).tearDown()
+        ftr.config.RELOAD_WATCHES.clear()
+
+    @unittest.skipIf('split_url' not in vars(ftr.config),
+                     'sparks is needed to split URLs')
+    def test_article_urls(self):
+        for website_url in (u'http://www.example.com/2015/article.html',
+                            u'https://example.com/other?page=2'):
+            self.assertEqual(ftr.get_config(website_url)[1],
+                             u'example.com')
+
+        self.assertEqual(len(self.lookups.misses), 1)
+
+    def test_www(self):
+        for website_url in (u'www.example.com', u'example.com',
+                            u'WWW.Example.com'):
+            self.assertEqual(ftr.get_config(website_url)[1],
+                             u'example.com')
+
+        self.assertEqual(len(self.lookups.misses), 1)
+        self.assertEqual(self.lookups.misses[0][0], (u'example.com', ))
+
+        stats = ftr.config_cache_stats()
+
+        self.assertEqual((stats['lookups'], stats['hits'], stats['misses']),
+                         (3, 2, 1))
+
+
+class Clock(object):
+
+    """ Stands for :mod:`time` in :mod:`ftr.cache`. """
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+class NotFoundCacheTest(LocalRepositoryTestCase):
+
+    """ Failed lookups are cached, see ``ftr_invalidate_not_found()``. """
+
+    def setUp(self):
+        super(NotFoundCacheTest, self).setUp()
+        self.time = ftr.cache.time
+        ftr.cache.time = self.clock = Clock()
+
+    def tearDown(self):
+        super(NotFoundCacheTest, self).tearDown()
+        ftr.cache.time = self.time
+
+    def assertNotFound(self, website_url=u'example.com'):
+        self.assertRaises(ftr.SiteConfigNotFound,
+                          ftr.get_config, website_url)
+
+    def test_timeout(self):
+        self.assertNotFound()
+        self.write_siteconfig(u'example.com', u'body: //div\n')
+
+        self.clock.now += ftr.config.NOT_FOUND_CACHE_TIMEOUT - 1
+        self.assertNotFound()
+
+        self.clock.now += 2
+        self.assertEqual(ftr.get_config(u'example.com')[1], u'example.com')
+
+    def test_invalidate(self):
+        self.assertNotFound()
+        self.assertNotFound(u'example.org')
+        self.write_siteconfig(u'example.com', u'body: //div\n')
+
+        self.assertEqual(ftr.invalidate_not_found(u'example.net'), 0)
+        self.assertNotFound()
+
+        self.assertEqual(ftr.invalidate_not_found(u'example.com'), 1)
+        self.assertEqual(ftr.get_config(u'example.com')[1], u'example.com')
+
+        self.assertEqual(ftr.invalidate_not_found(
+            repository=self.repository), 1)
+        self.assertEqual(len(ftr.config.NOT_FOUND_CACHE), 0)
+
+    def test_unreachable(self):
+        # Nothing listens on the discard port.
+        unreachable = u'http://127.0.0.1:9/'
+        os.environ['PYTHON_FTR_REPOSITORIES'] = u'{0} {1}'.format(
+            self.repository, unreachable)
+        self.addCleanup(REPOSITORIES_HEALTH.pop, unreachable, None)
+
+        with self.assertRaises(ftr.SiteConfigNotFound) as context:
+            ftr.get_config(u'example.com')
+
+        self.assertEqual(context.exception.unreachable_repositories,
+                         [unreachable])
+        self.assertEqual(len(ftr.config.NOT_FOUND_CACHE), 0)
+
+
+class SiteConfigCacheTest(LocalRepositoryTestCase):
+
+    """ Parsed siteconfigs are shared, in a bounded LRU cache. """
+
+    def setUp(self):
+        super(SiteConfigCacheTest, self).setUp()
+        self.cache = ftr.config.SITECONFIG_CACHE
+
+    def tearDown(self):
+        ftr.config.SITECONFIG_CACHE = self.cache
+        super(SiteConfigCacheTest, self).tearDown()
+        ftr.config.RELOAD_WATCHES.clear()
+
+    def test_shared(self):
+        self.write_siteconfig(u'.example.com', u'body: //div\n')
+
+        config = ftr.get_site_config(u'a.example.com')
+
+        self.assertIsInstance(config, FrozenSiteConfig)
+        self.assertIs(ftr.get_site_config(u'b.example.com'), config)
+        self.assertIs(ftr.get_site_config(u'a.example.com'), config)
+
+    def test_eviction(self):
+        ftr.config.SITECONFIG_CACHE = MemoryCache(maxsize=2)
+
+        for name in (u'a.com', u'b.com', u'c.com'):
+            self.write_siteconfig(name, u'body: //div\n')
+
+        a = ftr.get_site_config(u'a.com')
+        b = ftr.get_site_config(u'b.com')
+
+        # a.com is now the most recently used.
+        self.assertIs(ftr.get_site_config(u'a.com'), a)
+
+        ftr.get_site_config(u'c.com')
+
+        self.assertEqual(len(ftr.config.SITECONFIG_CACHE), 2)
+        self.assertIs(ftr.get_site_config(u'a.com'), a)
+        self.assertIsNot(ftr.get_site_config(u'b.com'), b)
+
+
+class CascadeTest(LocalRepositoryTestCase):
+
+    """ ``ftr_get_site_config(cascade=True)``. """
+
+    def test_single_label_host_not_found(self):
+        for website_url in (u'localhost', u'http://localhost/x'):
+            self.assertRaises(ftr.SiteConfigNotFound,
+                              ftr.get_site_config, website_url,
+                              cascade=True)
+
+    def test_single_label_host_global(self):
+        self.write_siteconfig(ftr.config.GLOBAL_SITECONFIG,
+                              u'body: //article\n')
+
+        config = ftr.get_site_config(u'localhost', cascade=True)
+
+        self.assertEqual(tuple(config.body), (u'//article', ))
+
+    def test_cascade_order(self):
+        self.write_siteconfig(u'news.example.com', u'body: //div\n')
+        self.write_siteconfig(u'example.com', u'body: //main\n')
+        self.write_siteconfig(ftr.config.GLOBAL_SITECONFIG,
+                              u'body: //article\n')
+
+        config = ftr.get_site_config(u'http://news.example.com/a',
+                                     cascade=True)
+
+        self.assertEqual(tuple(config.body),
+                         (u'//div', u'//main', u'//article'))
+
+
+class ReloadTest(LocalRepositoryTestCase):
+
+    """ ``ftr_reload_siteconfigs()``. """
+
+    def setUp(self):
+        super(ReloadTest, self).setUp()
+        self.lookups_cached = ftr.config.LOOKUPS_CACHED
+
+    def tearDown(self):
+        super(ReloadTest, self).tearDown()
+        ftr.config.LOOKUPS_CACHED = self.lookups_cached
+        ftr.config.RELOAD_WATCHES.clear()
+
+    def test_reload(self):
+        filename = self.write_siteconfig(u'example.com', u'body: //div\n')
+        ftr.get_site_config(u'example.com')
+
+        self.change(filename, u'body: //main\n')
+
+        self.assertEqual(ftr.reload_siteconfigs(), [filename])
+        self.assertEqual(tuple(ftr.get_site_config(u'example.com').body),
+                         (u'//main', ))
+
+    def test_touched(self):
+        filename = self.write_siteconfig(u'example.com', u'body: //div\n')
+        config = ftr.get_site_config(u'example.com')
+
+        self.change(filename, u'body: //div\n')
+        ftr.reload_siteconfigs()
+
+        # Not parsed again.
+        self.assertIs(ftr.get_site_config(u'example.com'), config)
+
+    def test_invalid(self):
+        filename = self.write_siteconfig(u'example.com', u'body: //div\n')
+        config = ftr.get_site_config(u'example.com')
+
+        self.change(filename, u'body: //div[\n')
+
+        # Before and after the reload notices it.
+        self.assertIs(ftr.get_site_config(u'example.com'), config)
+        ftr.reload_siteconfigs()
+        self.assertIs(ftr.get_site_config(u'example.com'), config)
+
+        self.change(filename, u'body: //main\n')
+        ftr.reload_siteconfigs()
+
+        self.assertEqual(tuple(ftr.get_site_config(u'example.com').body),
+                         (u'//main', ))
+
+    def test_invalid_new(self):
+        self.write_siteconfig(u'example.com', u'body: //div[\n')
+
+        self.assertRaises(ftr.InvalidSiteConfig,
+                          ftr.get_site_config, u'example.com')
+
+    def test_lookup_keys_bounded(self):
+        ftr.config.LOOKUPS_CACHED = True
+        filename = self.write_siteconfig(u'.example.com', u'body: //div\n')
+
+        for x in range(ftr.config.RELOAD_MAX_LOOKUP_KEYS + 10):
+            ftr.get_config(u'host{0}.example.com'.format(x))
+
+        self.assertIsNone(ftr.config.RELOAD_WATCHES[filename].lookup_keys)
+
+        generation = ftr.config.RELOAD_GENERATION
+        self.change(filename, u'body: //main\n')
+        ftr.reload_siteconfigs()
+
+        self.assertEqual(ftr.config.RELOAD_GENERATION, generation + 1)
+
+
+class PreloadTest(LocalRepositoryTestCase):
+
+    """ ``ftr_preload_siteconfigs()``, before forking. """
+
+    def setUp(self):
+        super(PreloadTest, self).setUp()
+        self.maxsize = ftr.config.SITECONFIG_CACHE.maxsize
+        self.probe_local = ftr.config._ftr_probe_local
+
+    def tearDown(self):
+        ftr.config._ftr_probe_local = self.probe_local
+        ftr.config.SITECONFIG_CACHE.maxsize = self.maxsize
+        ftr.config.PRELOADED_REPOSITORIES.clear()
+        ftr.config.RELOAD_REPOSITORIES.clear()
+        ftr.config.RELOAD_WATCHES.clear()
+        super(PreloadTest, self).tearDown()
+
+    def fail_probe(self, repository, domain_names):
+        self.fail(u'{0} was probed for {1}.'.format(repository,
+                                                    domain_names))
+
+    def cached(self, siteconfig_name, config_string):
+        return ftr.config.SITECONFIG_CACHE.get((
+            siteconfig_name,
+            hashlib.sha1(config_string.encode('utf-8')).hexdigest()))
+
+    def test_preload(self):
+        self.write_siteconfig(u'.example.com', u'body: //div\n')
+        self.write_siteconfig(u'example.org', u'body: //main\n')
+        self.write_siteconfig(u'example.net', u'body: //div[\n')
+
+        # The invalid one is skipped.
+        self.assertEqual(ftr.preload_siteconfigs(), 2)
+        self.assertEqual(len(ftr.config.SITECONFIG_CACHE), 2)
+
+        config = self.cached(u'.example.com', u'body: //div\n')
+
+        self.assertIsInstance(config, FrozenSiteConfig)
+        self.assertIsNotNone(self.cached(u'example.org', u'body: //main\n'))
+
+        # Forked children look siteconfigs up without reading them again.
+        ftr.config._ftr_probe_local = self.fail_probe
+
+        self.assertIs(ftr.get_site_config(u'news.example.com'), config)
+        self.assertIs(ftr.get_site_config(u'www.example.com'), config)
+        self.assertRaises(ftr.SiteConfigNotFound,
+                          ftr.get_site_config, u'example.info')
+
+    def test_changed(self):
+        filename = self.write_siteconfig(u'example.com', u'body: //div\n')
+        ftr.preload_siteconfigs()
+
+        self.change(filename, u'body: //main\n')
+        ftr.reload_siteconfigs()
+
+        self.assertEqual(tuple(ftr.get_site_config(u'example.com').body),
+                         (u'//main', ))
+
+    def test_added(self):
+        ftr.preload_siteconfigs()
+
+        self.write_siteconfig(u'example.com', u'body: //div\n')
+        mtime = os.stat(self.repository).st_mtime + 10
+        os.utime(self.repository, (mtime, mtime))
+
+        ftr.reload_siteconfigs()
+
+        self.assertEqual(tuple(ftr.get_site_config(u'example.com').body),
+                         (u'//div', ))
+
+
+class InvalidSiteConfigTest(unittest.TestCase):
+
+    """ Invalid siteconfigs raise printable :class:`InvalidSiteConfig`. """
+
+    def assertInvalid(self, config_string):
+        config = ftr.config.ftr_string_to_instance(config_string)
+
+        with self.assertRaises(ftr.config.InvalidSiteConfig) as context:
+            config.compile()
+
+        # Python 2 str() fails on non-ASCII unicode messages.
+        return str(context.exception)
+
+    def test_invalid_xpath(self):
+        message = self.assertInvalid(u'body: //div[\n')
+
+        self.assertIn('"//div["', message)
+
+    def test_evaluation_error(self):
+        for config_string, expression in (
+            (u'body: //foo:div\n', '"//foo:div"'),
+            (u'date: //*[unknown()]\n', '"//*[unknown()]"'),
+        ):
+            message = self.assertInvalid(config_string)
+
+            self.assertIn(expression, message)
+
+
+def parse_line_by_line(config_string):
+    """ The reference: each line examined and applied in turn. """
+
+    config = ftr.SiteConfig()
+
+    for line_content in config_string.strip().split(u'\n'):
+        line_content = line_content.strip()
+
+        if not line_content or line_content.startswith(u'#'):
+            continue
+
+        try:
+            key, value = [
+                x.strip() for x in line_content.strip().split(u':', 1)
+            ]
+
+        except ValueError:
+            continue
+
+        key = key.lower()
+
+        if not key or (not value and key != 'replace_string'):
+            continue
+
+        elif key in (
+            'title', 'body', 'author', 'date',
+            'strip', 'strip_id_or_class', 'strip_image_src',
+            'single_page_link', 'single_page_link_in_feed',
+            'next_page_link',
+            'http_header',
+
+            'find_string',
+            'replace_string',
+
+            'test_url',
+            'test_contains',
+        ):
+
+            if key.endswith(u'_string'):
+                getattr(config, key).append(value)
+
+            else:
+                getattr(config, key).add(value)
+
+        elif key in ('tidy', 'prune', 'autodetect_on_failure', ):
+
+            if value.lower() in ('no', 'false', '0', ):
+                setattr(config, key, False)
+
+            else:
+                setattr(config, key, bool(value))
+
+        elif key in ('parser', ):
+            setattr(config, key, value)
+
+        elif key.startswith('replace_string(') and key.endswith(')'):
+            config.find_string.append(key[15:-1])
+            config.replace_string.append(value)
+
+    return config
+
+
+class ParserTest(unittest.TestCase):
+
+    """ The table-driven parser gives what parsing lines in turn gives. """
+
+    config_string = u'''
+# A comment.
+title: //h1
+Title: //h2
+title: //h1
+body: //div[@id="content"]
+body://article
+author: //span[@class="author"]
+date: //time/@datetime
+strip: //div[@class="ad"]
+strip: //aside
+strip_id_or_class: related
+STRIP_ID_OR_CLASS: comments
+strip_image_src: /pixel.gif
+single_page_link: //a[@class="print"]
+single_page_link_in_feed: //a[@rel="print"]
+next_page_link: //a[@rel="next"]
+http_header(user-agent): ftr
+http_header: Cookie: a=b
+find_string: <br /><br />
+replace_string: </p><p>
+find_string: a
+replace_string:
+replace_string(<b>): <strong>
+find_string: a
+replace_string: b
+Replace_String(<I>): <em>
+tidy: no
+tidy: yes
+prune: False
+autodetect_on_failure: 0
+autodetect_on_failure: maybe
+parser: html5lib
+parser: libxml
+test_url: http://example.com/a.html
+test_url: http://example.com/b.html
+test_contains: Some text
+unknown_directive: value
+no colon here
+title:
+:value
+    body:    //main
+'''
+
+    def attributes(self, config):
+        return dict(
+            (key, list(value) if isinstance(value, OrderedSet) else value)
+            for key, value in vars(config).items()
+            if not key.startswith(u'_'))
+
+    def test_same_as_line_by_line(self):
+        expected = parse_line_by_line(self.config_string)
+        config = ftr.config.ftr_string_to_instance(self.config_string)
+
+        attributes = self.attributes(config)
+
+        self.assertEqual(attributes, self.attributes(expected))
+
+        for key, value in (
+            ('title', [u'//h1', u'//h2']),
+            ('find_string', [u'<br /><br />', u'a', u'<b>', u'a', u'<i>']),
+            ('replace_string', [u'</p><p>', u'', u'<strong>', u'b',
+                                u'<em>']),
+            ('tidy', True),
+            ('prune', False),
+            ('autodetect_on_failure', True),
+            ('parser', u'libxml'),
+        ):
+            self.assertEqual(attributes[key], value, key)
+
+    def test_ignored_directives(self):
+        # Test expectations of the original implementation, which
+        # did not parse them, but crashed.
+        ignored = u'''
+test_title: Title
+test_date: 2015-03-10
+test_author: Author
+test_language: en
+'''
+
+        self.assertEqual(
+            self.attributes(ftr.config.ftr_string_to_instance(
+                self.config_string + ignored)),
+            self.attributes(parse_line_by_line(self.config_string)))
+
+
+class CompiledXPathsTest(unittest.TestCase):
+
+    """ Compiled expressions follow changes of the directives. """
+
+    def setUp(self):
+        self.config = ftr.SiteConfig(site_config_text=u'body: //div\n'
+                                     u'find_string: a\nreplace_string: b\n')
+
+    def test_expression_changed(self):
+        self.assertEqual([x.path for x in self.config.xpaths('body')],
+                         [u'//div'])
+
+        # Same number of expressions.
+        self.config.body.discard(u'//div')
+        self.config.body.add(u'//pre')
+
+        self.assertEqual([x.path for x in self.config.xpaths('body')],
+                         [u'//pre'])
+
+    def test_replacement_changed(self):
+        self.assertEqual(self.config.replace(u'abc'), u'bbc')
+
+        self.config.replace_patterns[0] = (u'a', u'c')
+
+        self.assertEqual(self.config.replace(u'abc'), u'cbc')
+
+    def test_frozen_reused(self):
+        xpaths = self.config.xpaths('body')
+        frozen = self.config.freeze()
+
+        self.assertIs(frozen.xpaths('body'), xpaths)
+
+
+class FrozenSiteConfigTest(unittest.TestCase):
+
+    """ Frozen configs cannot be changed. """
+
+    def setUp(self):
+        self.config = ftr.SiteConfig(site_config_text=u'body: //div\n',
+                                     host=u'example.com').freeze()
+
+    def test_read_only(self):
+        for attr_name, value in (
+            ('body', (u'//main', )),
+            ('host', u'example.org'),
+            ('tidy', False),
+            ('unknown', None),
+        ):
+            self.assertRaises(AttributeError, setattr,
+                              self.config, attr_name, value)
+
+        self.assertEqual(self.config.body, (u'//div', ))
+        self.assertEqual(self.config.host, u'example.com')
+        self.assertTrue(self.config.tidy)
+
+    def test_no_dict(self):
+        self.assertFalse(hasattr(self.config, '__dict__'))
+        self.assertFalse(hasattr(self.config, 'append'))
+
+
+class FrozenSiteConfigPickleTest(unittest.TestCase):
+
+    """ Pickles of frozen configs, eg. in the disk cache. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = ftr.SiteConfig(site_config_text=u'body: //div\n'
+                                     u'find_string: a\nreplace_string: b\n',
+                                     host=u'example.com').freeze()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pickle(self):
+        config = pickle.loads(pickle.dumps(self.config))
+
+        for attr_name in (FrozenSiteConfig.multiple_directives
+                          + FrozenSiteConfig.single_attributes):
+            self.assertEqual(getattr(config, attr_name),
+                             getattr(self.config, attr_name))
+
+        self.assertEqual(len(config.xpaths('body')), 1)
+
+    def other_version_pickle(self, attr_name, value):
+        """ Pickle the config as a version with another ``attr_name``. """
+
+        original = getattr(FrozenSiteConfig, attr_name)
+        setattr(FrozenSiteConfig, attr_name, value)
+
+        try:
+            return pickle.dumps(self.config)
+
+        finally:
+            setattr(FrozenSiteConfig, attr_name, original)
+
+    def test_other_versions(self):
+        for pickled in (
+            self.other_version_pickle('state_version', 0),
+            self.other_version_pickle(
+                'single_attributes',
+                FrozenSiteConfig.single_attributes + ('host', )),
+        ):
+            self.assertRaises(ValueError, pickle.loads, pickled)
+
+    def test_disk_cache(self):
+        cache = DiskCache(self.directory)
+        cache.set(u'key', self.config)
+
+        self.assertEqual(tuple(cache.get(u'key').body), (u'//div', ))
+
+        # Written by a version with more attributes.
+        FrozenSiteConfig.single_attributes += ('host', )
+
+        try:
+            cache.set(u'key', self.config)
+
+        finally:
+            FrozenSiteConfig.single_attributes = \
+                FrozenSiteConfig.single_attributes[:-1]
+
+        self.assertIsNone(cache.get(u'key'))
+
+
+class RecordingDiskCache(DiskCache):
+
+    """ A :class:`DiskCache` recording the keys it is asked for. """
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingDiskCache, self).__init__(*args, **kwargs)
+        self.keys = []
+
+    def get(self, key, default=None):
+        self.keys.append(key)
+        return super(RecordingDiskCache, self).get(key, default)
+
+
+class SiteConfigDiskCacheTest(LocalRepositoryTestCase):
+
+    """ Parsed siteconfigs in the disk cache. """
+
+    def setUp(self):
+        super(SiteConfigDiskCacheTest, self).setUp()
+        self.directory = os.path.join(self.repository, u'.cache')
+        self.ftr_version = ftr.config.ftr_version
+
+        ftr.config.SITECONFIG_DISK_CACHE = RecordingDiskCache(self.directory)
+
+    def tearDown(self):
+        super(SiteConfigDiskCacheTest, self).tearDown()
+        ftr.config.ftr_version = self.ftr_version
+        ftr.config.RELOAD_WATCHES.clear()
+
+    @unittest.skipIf('PYTHON_FTR_DISK_CACHE_DIR' in os.environ,
+                     'disk cache enabled in the environment')
+    def test_disabled_by_default(self):
+        self.assertEqual(ftr.config.DISK_CACHE_DIR, u'')
+        self.assertIsNone(self.disk_cache)
+
+    def test_lazy(self):
+        disk_cache = ftr.config.SITECONFIG_DISK_CACHE
+        self.write_siteconfig(u'example.com', u'body: //div\n')
+
+        # Not even created before the first parsed siteconfig.
+        self.assertFalse(os.path.exists(self.directory))
+
+        config = ftr.get_site_config(u'example.com')
+
+        self.assertEqual((disk_cache.hits, disk_cache.misses), (0, 1))
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        # Found in memory, the disk is not read.
+        self.assertIs(ftr.get_site_config(u'example.com'), config)
+        self.assertEqual(len(disk_cache.keys), 1)
+
+        # A new process, with an empty memory cache.
+        ftr.config.SITECONFIG_CACHE.clear()
+        loaded = ftr.get_site_config(u'example.com')
+
+        self.assertEqual((disk_cache.hits, disk_cache.misses), (1, 1))
+        self.assertIsNot(loaded, config)
+        self.assertEqual(tuple(loaded.body), (u'//div', ))
+
+    def test_keys(self):
+        disk_cache = ftr.config.SITECONFIG_DISK_CACHE
+        filename = self.write_siteconfig(u'example.com', u'body: //div\n')
+
+        ftr.get_site_config(u'example.com')
+
+        # Same size, later modification time.
+        self.change(filename, u'body: //pre\n')
+        config = ftr.get_site_config(u'example.com')
+
+        self.assertEqual(tuple(config.body), (u'//pre', ))
+        self.assertEqual(disk_cache.misses, 2)
+        self.assertNotEqual(disk_cache.keys[0], disk_cache.keys[1])
+
+        # Written by another ftr version.
+        ftr.config.SITECONFIG_CACHE.clear()
+        ftr.config.ftr_version = u'0.0.0'
+        ftr.get_site_config(u'example.com')
+
+        self.assertEqual(disk_cache.misses, 3)
+        self.assertNotEqual(disk_cache.keys[1], disk_cache.keys[2])
+
+        # Back to this version: still there.
+        ftr.config.SITECONFIG_CACHE.clear()
+        ftr.config.ftr_version = self.ftr_version
+        ftr.get_site_config(u'example.com')
+
+        self.assertEqual(disk_cache.hits, 1)
+        self.assertEqual(disk_cache.keys[3], disk_cache.keys[1])
+
+
+class UnreachableRepositoryTest(unittest.TestCase):
+
+    """ A failed lookup counts one error per unreachable repository. """
+
+    # Nothing listens on the discard port.
+    repository = u'http://127.0.0.1:9/'
+
+    def setUp(self):
+        self.concurrent_lookups = ftr.config.CONCURRENT_LOOKUPS
+        REPOSITORIES_HEALTH.pop(self.repository, None)
+
+    def tearDown(self):
+        ftr.config.CONCURRENT_LOOKUPS = self.concurrent_lookups
+        REPOSITORIES_HEALTH.pop(self.repository, None)
+
+    def lookup(self, concurrent):
+        ftr.config.CONCURRENT_LOOKUPS = concurrent
+
+        self.assertRaises(ftr.SiteConfigNotFound,
+                          ftr.config._ftr_lookup_config,
+                          ftr.config.ftr_get_domain_names(
+                              u'http://a.b.example.org/'),
+                          [self.repository])
+
+        return ftr_get_repository_health(self.repository).as_dict()
+
+    def test_sequential(self):
+        health = self.lookup(concurrent=False)
+
+        self.assertEqual(health['errors'], 1)
+        self.assertFalse(health['breaker_open'])
+
+    def test_concurrent(self):
+        health = self.lookup(concurrent=True)
+
+        self.assertEqual(health['errors'], 1)
+        self.assertFalse(health['breaker_open'])
+
+
+class RemoteRepositoryHandler(BaseHTTPRequestHandler):
+
+    """ Serve ``example.com.txt`` with an ``ETag``, see ``server.etag``. """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('If-None-Match'))
+
+        if getattr(server, 'gate', None) is not None:
+            # Hold the answer until the test opens the gate.
+            server.gate.wait(10)
+
+        if self.path != '/example.com.txt':
+            self.send_response(404)
+            self.end_headers()
+
+        elif self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+
+        else:
+            content = 'body: //div[@id="{0}"]\n'.format(server.etag.strip('"'))
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('ETag', server.etag)
+            self.end_headers()
+            self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class RevalidationTest(unittest.TestCase):
+
+    """ Expired remote lookups are revalidated from their validators. """
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RemoteRepositoryHandler)
+        self.server.etag = '"v1"'
+        self.server.requests = []
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.repository = u'http://127.0.0.1:{0}/'.format(
+            self.server.server_address[1])
+        self.lookup_key = ((u'example.com', ), (self.repository, ), 0)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        REPOSITORIES_HEALTH.pop(self.repository, None)
+
+    def test_validators(self):
+        found = ftr.config._ftr_lookup_config(*self.lookup_key)
+
+        self.assertEqual(found[0], u'body: //div[@id="v1"]\n')
+        self.assertEqual(found[3], ('"v1"', None))
+        self.assertEqual(self.server.requests, [None])
+
+    def test_not_modified(self):
+        found = ftr.config._ftr_lookup_config(*self.lookup_key)
+        expired = found[:4] + (0, )
+
+        revalidated = ftr.config._ftr_revalidate_lookup(self.lookup_key,
+                                                        expired)
+
+        self.assertEqual(revalidated[:4], found[:4])
+        self.assertTrue(revalidated[4] > 0)
+        self.assertEqual(self.server.requests, [None, '"v1"'])
+        self.assertFalse(ftr.config.REVALIDATED_LOOKUPS)
+
+    def test_modified(self):
+        found = ftr.config._ftr_lookup_config(*self.lookup_key)
+        self.server.etag = '"v2"'
+
+        revalidated = ftr.config._ftr_revalidate_lookup(self.lookup_key,
+                                                        found[:4] + (0, ))
+
+        self.assertEqual(revalidated[0], u'body: //div[@id="v2"]\n')
+        self.assertEqual(revalidated[3], ('"v2"', None))
+
+        # Downloaded once, by the conditional request.
+        self.assertEqual(self.server.requests, [None, '"v1"'])
+        self.assertFalse(ftr.config.REVALIDATED_LOOKUPS)
+
+    def test_modified_shadowed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        lookup_key = ((u'example.com', ), (directory, self.repository), 0)
+
+        found = ftr.config._ftr_lookup_config(*lookup_key)
+        self.server.etag = '"v2"'
+
+        # A local siteconfig now takes precedence.
+        with codecs.open(os.path.join(directory, u'example.com.txt'), 'wb',
+                         encoding='utf8') as f:
+            f.write(u'body: //main\n')
+
+        revalidated = ftr.config._ftr_revalidate_lookup(lookup_key,
+                                                        found[:4] + (0, ))
+
+        self.assertEqual(revalidated[0], u'body: //main\n')
+        self.assertEqual(self.server.requests, [None, '"v1"'])
+
+    def test_unreachable(self):
+        # Nothing listens on the discard port.
+        repository = u'http://127.0.0.1:9/'
+        self.addCleanup(REPOSITORIES_HEALTH.pop, repository, None)
+
+        lookup_key = ((u'example.com', ), (repository, ), 0)
+        expired = (u'body: //div\n', u'example.com',
+                   repository + u'example.com.txt', ('"v1"', None), 0)
+
+        # Kept, instead of looking it up again.
+        revalidated = ftr.config._ftr_revalidate_lookup(lookup_key, expired)
+
+        self.assertEqual(revalidated[:4], expired[:4])
+        self.assertTrue(revalidated[4] > 0)
+        self.assertFalse(ftr.config.REVALIDATED_LOOKUPS)
+
+
+class AsyncLookupTest(unittest.TestCase):
+
+    """ Concurrent asynchronous lookups of a website share one run. """
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RemoteRepositoryHandler)
+        self.server.etag = '"v1"'
+        self.server.requests = []
+        self.server.gate = threading.Event()
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.repository = u'http://127.0.0.1:{0}/'.format(
+            self.server.server_address[1])
+        self.environ = os.environ.get('PYTHON_FTR_REPOSITORIES')
+
+        os.environ['PYTHON_FTR_REPOSITORIES'] = self.repository
+        ftr.config.NOT_FOUND_CACHE.clear()
+        ftr.config.ftr_reset_config_cache_stats()
+
+    def tearDown(self):
+        self.server.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+        REPOSITORIES_HEALTH.pop(self.repository, None)
+
+        if self.environ is None:
+            del os.environ['PYTHON_FTR_REPOSITORIES']
+
+        else:
+            os.environ['PYTHON_FTR_REPOSITORIES'] = self.environ
+
+    def test_joined(self):
+        results = [ftr.get_config_async(u'example.com') for x in range(5)]
+
+        self.assertTrue(all(x is results[0] for x in results))
+        self.assertEqual(ftr.config_cache_stats()['joined'], 4)
+
+        self.server.gate.set()
+
+        self.assertEqual(results[0].get(10),
+                         (u'body: //div[@id="v1"]\n', u'example.com'))
+        self.assertEqual(self.server.requests, [None])
+        self.assertFalse(ftr.config.IN_FLIGHT_LOOKUPS)
+
+        # Finished: the next lookup runs on its own.
+        result = ftr.get_config_async(u'example.com')
+
+        self.assertIsNot(result, results[0])
+        self.assertEqual(result.get(10), results[0].get())
+        self.assertEqual(ftr.config_cache_stats()['joined'], 4)
+
+
+class FilesRepositoryHandler(BaseHTTPRequestHandler):
+
+    """ Serve ``server.files``, after ``server.delay`` seconds.
+
+    Answers are held until ``server.gate`` is set, if there is one.
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+
+        if server.gate is not None:
+            server.gate.wait(10)
+
+        time.sleep(server.delay)
+
+        content = server.files.get(self.path.lstrip('/'))
+
+        if content is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class ConcurrentLookupTest(unittest.TestCase):
+
+    """ Concurrent probes keep repositories precedence. """
+
+    domain_names = (u'news.example.com', u'example.com')
+
+    def setUp(self):
+        self.concurrent_lookups = ftr.config.CONCURRENT_LOOKUPS
+        self.thread_pools = dict(THREAD_POOLS)
+        self.servers = []
+
+        ftr.config.CONCURRENT_LOOKUPS = True
+
+        # Higher precedence first.
+        self.slow = self.start_server(u'body: //div[@id="slow"]\n')
+        self.fast = self.start_server(u'body: //div[@id="fast"]\n')
+        self.repositories = tuple(
+            u'http://127.0.0.1:{0}/'.format(x.server_address[1])
+            for x in (self.slow, self.fast))
+
+    def tearDown(self):
+        ftr.config.CONCURRENT_LOOKUPS = self.concurrent_lookups
+
+        for server in self.servers:
+            if server.gate is not None:
+                server.gate.set()
+
+            server.shutdown()
+            server.server_close()
+
+        for repository in self.repositories:
+            REPOSITORIES_HEALTH.pop(repository, None)
+
+        for purpose, (pid, pool) in THREAD_POOLS.items():
+            if self.thread_pools.get(purpose) != (pid, pool):
+                pool.terminate()
+
+        THREAD_POOLS.clear()
+        THREAD_POOLS.update(self.thread_pools)
+
+    def start_server(self, content):
+        server = HTTPServer(('127.0.0.1', 0), FilesRepositoryHandler)
+        server.files = {'example.com.txt': content}
+        server.requests = []
+        server.gate = None
+        server.delay = 0
+
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.servers.append(server)
+
+        return server
+
+    def lookup(self):
+        return ftr.config._ftr_lookup_config(self.domain_names,
+                                             self.repositories)
+
+    def test_precedence(self):
+        self.slow.gate = threading.Event()
+
+        def open_gate():
+            # The lower precedence repository answered first.
+            for x in range(100):
+                if self.fast.requests:
+                    break
+
+                time.sleep(0.05)
+
+            time.sleep(0.1)
+            self.slow.gate.set()
+
+        thread = threading.Thread(target=open_gate)
+        thread.start()
+
+        found = self.lookup()
+        thread.join()
+
+        self.assertTrue(self.fast.requests)
+        self.assertEqual(found[0], u'body: //div[@id="slow"]\n')
+        self.assertEqual(found[2], self.repositories[0] + u'example.com.txt')
+
+    def test_cancel(self):
+        # One thread: probes run in order, without waiting for each
+        # result to be examined. Those queued after the result are not.
+        pool = ThreadPool(1)
+        THREAD_POOLS['probes'] = os.getpid(), pool
+        self.slow.delay = 0.1
+
+        found = self.lookup()
+
+        # Wait for queued probes to run, or to be cancelled.
+        pool.apply(lambda: None)
+
+        self.assertEqual(found[0], u'body: //div[@id="slow"]\n')
+        self.assertEqual(self.fast.requests, [])
+
+        # The probe right after the result can start before it is examined.
+        self.assertIn(len(self.slow.requests), (3, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
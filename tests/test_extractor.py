@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+u""" Tests of :mod:`ftr.extractor`, without network access. """
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lxml.html
+
+from lxml import etree
+from readability.readability import Document
+
+import ftr
+import ftr.extractor
+
+from ftr.cache import DiskCache, MemoryCache
+from ftr.extractor import TreeDocument
+
+PARAGRAPH = (u'<p>This is the main article text, with commas, and enough '
+             u'words to be scored by readability here.</p>')
+
+COMMENT = (u'<p>A comment from a reader, with commas, saying many things '
+           u'about the article, again and again.</p>')
+
+# Body items. “community” is removed by readability when it is ruthless,
+# but has no negative weight: it wins when it is not removed.
+ITEMS = (
+    u'<div class="item"><div class="article">{0}</div></div>'.format(
+        PARAGRAPH * 3),
+    u'<div class="item"><div class="community">{1}</div>'
+    u'<div class="article">{0}</div></div>'.format(PARAGRAPH * 3,
+                                                  COMMENT * 8),
+    u'<div class="item"><div>{0}</div><div class="sidebar">{1}</div>'
+    u'</div>'.format(PARAGRAPH * 2, COMMENT * 8),
+    u'<div class="item"><p>Too short.</p></div>',
+)
+
+
+def make_tree(body):
+    """ Return ``body`` in a page, parsed like the extractor does. """
+
+    return lxml.html.document_fromstring(
+        u'<html><body>{0}</body></html>'.format(body),
+        parser=lxml.html.HTMLParser())
+
+
+class TreeDocumentTest(unittest.TestCase):
+
+    """ :class:`TreeDocument` gives what readability gives from strings. """
+
+    def test_summary(self):
+        for body in ITEMS:
+            item = make_tree(body).xpath('//div[@class="item"]')[0]
+
+            self.assertEqual(TreeDocument(item).summary(),
+                             Document(etree.tostring(item)).summary())
+
+    def test_summary_tree(self):
+        for body in ITEMS:
+            item = make_tree(body).xpath('//div[@class="item"]')[0]
+
+            summary = Document(etree.tostring(item)).summary()
+
+            self.assertEqual(
+                TreeDocument(item).summary_tree().text_content(),
+                lxml.html.document_fromstring(summary).text_content())
+
+
+class ExtractBodyTest(unittest.TestCase):
+
+    """ Body extraction from several items. """
+
+    def extract(self, body, prune):
+        config = ftr.SiteConfig(site_config_text=(
+            u'body: //div[@class="item"]\nprune: {0}\ntidy: no\n'
+            u'autodetect_on_failure: no\n'.format(prune))).freeze()
+
+        extractor = ftr.ContentExtractor(config)
+        extractor.process(u'<html><body>{0}</body></html>'.format(body))
+
+        return extractor.body
+
+    def test_prune_same_as_strings(self):
+        # What was extracted when readability got strings.
+        for first in ITEMS[:3]:
+            for second in ITEMS[:3]:
+                expected = []
+
+                for item in make_tree(first + second).xpath(
+                        '//div[@class="item"]'):
+                    summary = lxml.html.document_fromstring(
+                        Document(etree.tostring(item)).summary())
+                    expected.append(summary.xpath(
+                        '//html/body/div/div')[0].text_content())
+
+                body = etree.fromstring(self.extract(first + second,
+                                                     prune=u'yes'))
+
+                self.assertEqual([x.xpath('string()') for x in body],
+                                 expected)
+
+    def test_prune_unlikely_candidates(self):
+        body = self.extract(ITEMS[1] + ITEMS[0], prune=u'yes')
+
+        self.assertIn(u'main article text', body)
+        self.assertNotIn(u'comment from a reader', body)
+
+
+class NestedBodiesTest(unittest.TestCase):
+
+    """ Nested body items are extracted once, with their ancestor. """
+
+    page = (u'<div class="c">{0}<div class="c">{0}<div class="c">{0}</div>'
+            u'</div><div class="c">{0}</div></div><div class="c">{0}</div>'
+            u'<div><div class="c">{0}<div class="c">{0}</div></div>'
+            u'</div>').format(u'<div>{0}</div>'.format(PARAGRAPH * 3))
+
+    def extract(self, prune):
+        config = ftr.SiteConfig(site_config_text=(
+            u'body: //div[@class="c"]\nprune: {0}\ntidy: no\n'
+            u'autodetect_on_failure: no\n'.format(prune))).freeze()
+
+        extractor = ftr.ContentExtractor(config)
+        extractor.process(u'<html><body>{0}</body></html>'.format(self.page))
+
+        return etree.fromstring(extractor.body)
+
+    def test_same_as_ancestors_walk(self):
+        # What was extracted when checking ancestors of each item.
+        def is_descendant(parent, node):
+            node = node.getparent()
+
+            while node is not None:
+                if node == parent:
+                    return True
+
+                node = node.getparent()
+
+            return False
+
+        expected = etree.Element('root')
+
+        for item in make_tree(self.page).xpath('//div[@class="c"]'):
+            if not any(is_descendant(parent, item) for parent in expected):
+                expected.append(item)
+
+        self.assertEqual(etree.tostring(self.extract(prune=u'no')),
+                         etree.tostring(expected))
+        self.assertEqual(len(expected), 3)
+
+    def test_prune(self):
+        self.assertEqual(len(self.extract(prune=u'yes')), 3)
+
+
+def strip_in_turn(config, tree):
+    """ The reference: removal rules evaluated and applied in turn. """
+
+    def remove(expression):
+        for item in tree.xpath(expression):
+            item.getparent().remove(item)
+
+    for pattern in config.strip:
+        remove(pattern)
+
+    for pattern in config.strip_id_or_class:
+        remove(
+            "//*[contains(@class, '{0}') or contains(@id, '{0}')]".format(
+                pattern.replace('"', '').replace("'", '')))
+
+    for pattern in config.strip_image_src:
+        remove("//img[contains(@src, '{0}')]".format(
+            pattern.replace('"', '').replace("'", '')))
+
+    remove("//*[contains(concat(' ',normalize-space(@class),' ')"
+           ",' entry-unrelated ') or contains(concat(' ',"
+           "normalize-space(@class),' '),' instapaper_ignore ')]")
+
+    remove("//*[contains(@style,'display:none')]")
+
+
+class StripTest(unittest.TestCase):
+
+    """ Unwanted elements are removed like when rules ran in turn. """
+
+    page = (u'<div id="header" class="nav">Menu</div>'
+            u'<div class="article"><p>First</p>'
+            u'<p class="ad">Ad <img src="/ads/1.png"/></p>'
+            u'<div class="related"><div class="related-links">Links</div>'
+            u'</div><p style="display:none">Hidden</p>'
+            u'<div class="entry-unrelated">Unrelated</div>'
+            u'<img src="/photos/1.jpg"/><img src="/pixel.gif"/>'
+            u'<div><div>Nested 1</div><div>Nested 2</div></div>'
+            u'<div class="x instapaper_ignore"><p>Ignored</p></div>'
+            u'<p>Last</p></div><div>Footer 1</div><div>Footer 2</div>')
+
+    def strip(self, config):
+        extractor = ftr.ContentExtractor(config.freeze())
+        extractor.parsed_tree = make_tree(self.page)
+        extractor._strip_unwanted_elements()
+
+        return etree.tostring(extractor.parsed_tree)
+
+    def test_same_as_in_turn(self):
+        for config_string in (
+            u'',
+            u'strip: //div[@id="header"]\n',
+            u'strip: //p[@class="ad"]\nstrip_image_src: /ads/\n',
+            u'strip_id_or_class: related\nstrip_id_or_class: nav\n',
+            u'strip_id_or_class: "x\'\nstrip_image_src: pixel\n',
+            u'strip: //div[2]\n',
+            u'strip: //div[@class="related"]\n'
+            u'strip: //div[@class="article"]/div[2]\n',
+            u'strip: //p[1]\nstrip: //div/p[1]\nstrip: //body//p[1]\n',
+            u'strip: //div[@class="article"]/*[3]\n'
+            u'strip: //div[@class="article"]/*[3]\n'
+            u'strip_id_or_class: related\n',
+            u'strip: //p[last()]\nstrip: //div[not(div)]\n'
+            u'strip_image_src: /\n',
+            u'strip: //body/div\nstrip: //div[@class="related"]\n'
+            u'strip_id_or_class: article\n',
+        ):
+            config = ftr.SiteConfig(site_config_text=config_string)
+            expected = make_tree(self.page)
+            strip_in_turn(config, expected)
+
+            self.assertEqual(self.strip(config), etree.tostring(expected),
+                             config_string)
+
+    def test_ignored_expressions(self):
+        expected = self.strip(ftr.SiteConfig(
+            site_config_text=u'strip: //div[2]\nstrip_id_or_class: nav\n'))
+
+        # They do not return elements, or cannot be evaluated here.
+        for ignored in (u'count(//p)', u'//p[unknown()]'):
+            for config_string in (
+                u'strip: {0}\nstrip: //div[2]\nstrip_id_or_class: nav\n',
+                u'strip: //div[2]\nstrip: {0}\nstrip_id_or_class: nav\n',
+            ):
+                config = ftr.SiteConfig(
+                    site_config_text=config_string.format(ignored))
+
+                self.assertEqual(self.strip(config), expected,
+                                 (ignored, config_string))
+
+
+class FakeTidy(object):
+
+    """ Stands for :mod:`tidylib`, returns ``document`` whatever the HTML. """
+
+    def __init__(self, document):
+        self.document = document
+        self.calls = []
+
+    def tidy_document(self, html, options):
+        self.calls.append(html)
+        return self.document, u''
+
+
+class TidyFallbackTest(unittest.TestCase):
+
+    """ Extraction again without tidy, when nothing came out of tidy. """
+
+    def setUp(self):
+        self.tidylib = ftr.extractor.tidylib
+
+        # Nothing to extract, but a next page link.
+        ftr.extractor.tidylib = self.tidy = FakeTidy(
+            u'<html><body><a class="next" href="/2">Next</a></body></html>')
+        ftr.extractor.ftr_reset_extraction_stats()
+
+    def tearDown(self):
+        ftr.extractor.tidylib = self.tidylib
+
+    def test_fallback(self):
+        config = ftr.SiteConfig(site_config_text=(
+            u'body: //div[@id="content"]\nnext_page_link: //a[@class="next"]'
+            u'\nfind_string: X\nreplace_string: XX\ntidy: yes\n'
+            u'prune: no\nautodetect_on_failure: no\n')).freeze()
+
+        extractor = ftr.ContentExtractor(config)
+
+        self.assertTrue(extractor.process(
+            u'<html><body><div id="content">X</div></body></html>'))
+
+        self.assertEqual(len(self.tidy.calls), 1)
+        self.assertIs(extractor.config, config)
+
+        # Replaced once, and nothing left from the tidied attempt.
+        self.assertEqual(extractor.body, u'<div id="content">XX</div>')
+        self.assertFalse(extractor.tidied)
+        self.assertIsNone(extractor.next_page_link)
+
+        self.assertEqual(ftr.extraction_stats(), {
+            'extractions': 1,
+            'tidied': 1,
+            'tidy_empty': 0,
+            'fallbacks': 1,
+            'fallback_successes': 1,
+        })
+
+    def test_tidy_empty(self):
+        self.tidy.document = u'  \n'
+
+        config = ftr.SiteConfig(site_config_text=(
+            u'body: //div[@id="content"]\ntidy: yes\nprune: no\n'
+            u'autodetect_on_failure: no\n')).freeze()
+
+        extractor = ftr.ContentExtractor(config)
+
+        self.assertTrue(extractor.process(
+            u'<html><body><div id="content">X</div></body></html>'))
+        self.assertEqual(ftr.extraction_stats()['tidy_empty'], 1)
+        self.assertEqual(ftr.extraction_stats()['fallbacks'], 0)
+
+
+class TidyCacheTest(unittest.TestCase):
+
+    """ Tidied documents caches, by HTML and tidy options. """
+
+    def setUp(self):
+        self.tidylib = ftr.extractor.tidylib
+        self.caches = ftr.extractor.TIDY_CACHE, ftr.extractor.TIDY_DISK_CACHE
+        self.directory = tempfile.mkdtemp()
+
+        ftr.extractor.tidylib = self.tidy = FakeTidy(u'<html></html>')
+        self.config = ftr.SiteConfig(site_config_text=u'tidy: yes\n')
+
+    def tearDown(self):
+        ftr.extractor.tidylib = self.tidylib
+        ftr.extractor.TIDY_CACHE, ftr.extractor.TIDY_DISK_CACHE = self.caches
+        shutil.rmtree(self.directory)
+
+    def tidy_document(self, html, **options):
+        extractor = ftr.ContentExtractor(self.config)
+
+        if options:
+            extractor.tidy_config = dict(extractor.tidy_config, **options)
+
+        return extractor._tidy_document(html)
+
+    @unittest.skipIf('PYTHON_FTR_TIDY_CACHE_SIZE' in os.environ
+                     or 'PYTHON_FTR_TIDY_DISK_CACHE_SIZE' in os.environ,
+                     'tidy cache enabled in the environment')
+    def test_disabled_by_default(self):
+        self.assertEqual(self.caches, (None, None))
+
+        self.tidy_document(u'<p>a</p>')
+        self.tidy_document(u'<p>a</p>')
+
+        self.assertEqual(len(self.tidy.calls), 2)
+
+    def test_memory(self):
+        ftr.extractor.TIDY_CACHE = MemoryCache(maxsize=10)
+        ftr.extractor.TIDY_DISK_CACHE = None
+
+        self.tidy_document(u'<p>a</p>')
+        self.tidy_document(u'<p>a</p>')
+        self.assertEqual(self.tidy.calls, [u'<p>a</p>'])
+
+        self.tidy_document(u'<p>b</p>')
+        self.tidy_document(u'<p>a</p>', wrap=80)
+        self.tidy_document(u'<p>a</p>', wrap=80)
+
+        self.assertEqual(self.tidy.calls,
+                         [u'<p>a</p>', u'<p>b</p>', u'<p>a</p>'])
+
+    def test_disk(self):
+        ftr.extractor.TIDY_CACHE = None
+        ftr.extractor.TIDY_DISK_CACHE = DiskCache(self.directory)
+
+        self.assertEqual(self.tidy_document(u'<p>a</p>'), u'<html></html>')
+        self.tidy.document = u'<html><body></body></html>'
+
+        self.assertEqual(self.tidy_document(u'<p>a</p>'), u'<html></html>')
+        self.assertEqual(self.tidy_document(u'<p>a</p>', wrap=80),
+                         u'<html><body></body></html>')
+        self.assertEqual(len(self.tidy.calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
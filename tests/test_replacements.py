@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+u""" Tests of ``find_string`` / ``replace_string`` replacements. """
+
+import random
+import unittest
+
+import ftr.config
+
+from ftr.config import _ftr_compile_replacements
+
+
+def replace_in_turn(replace_patterns, html):
+    """ The reference: one :meth:`str.replace` per pair, in order. """
+
+    for find_string, replace_string in replace_patterns:
+        html = html.replace(find_string, replace_string)
+
+    return html
+
+
+class ReplacementsTest(unittest.TestCase):
+
+    """ Compiled replacements give the same result as replacing in turn. """
+
+    def setUp(self):
+        self.single_pass = ftr.config.REPLACEMENTS_SINGLE_PASS
+
+    def tearDown(self):
+        ftr.config.REPLACEMENTS_SINGLE_PASS = self.single_pass
+
+    def random_string(self, generator, minimum, maximum):
+        # Few characters, for patterns to overlap often.
+        return u''.join(generator.choice(u'ab<>/')
+                        for x in range(generator.randint(minimum, maximum)))
+
+    def test_random(self):
+        generator = random.Random(0)
+
+        # Single pass for runs of 1 pair and more, and never.
+        for single_pass in (1, 2, 3, 1000):
+            ftr.config.REPLACEMENTS_SINGLE_PASS = single_pass
+
+            for iteration in range(2000):
+                replace_patterns = [
+                    (self.random_string(generator, 0, 4),
+                     self.random_string(generator, 0, 3))
+                    for x in range(generator.randint(1, 6))
+                ]
+                replace = _ftr_compile_replacements(replace_patterns)
+
+                for document in range(5):
+                    html = self.random_string(generator, 0, 30)
+
+                    self.assertEqual(
+                        replace(html),
+                        replace_in_turn(replace_patterns, html),
+                        (replace_patterns, html))
+
+    def test_single_pass(self):
+        replace_patterns = [(u'<p class="x{0}">'.format(x), u'<p>')
+                            for x in range(50)]
+        html = u'<p class="x1">a</p><p class="x42">b</p><p class="x">c</p>'
+
+        config = ftr.SiteConfig(site_config_text=u''.join(
+            u'find_string: {0}\nreplace_string: {1}\n'.format(*pair)
+            for pair in replace_patterns))
+
+        self.assertEqual(config.replace(html),
+                         replace_in_turn(replace_patterns, html))
+        self.assertEqual(config.replace(html),
+                         u'<p>a</p><p>b</p><p class="x">c</p>')
+
+    def test_order_dependent(self):
+        ftr.config.REPLACEMENTS_SINGLE_PASS = 1
+
+        # The first replacement creates the second pattern.
+        replace_patterns = [(u'a', u'b'), (u'bc', u'X')]
+        replace = _ftr_compile_replacements(replace_patterns)
+
+        self.assertEqual(replace(u'ac abc'), u'X bX')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+u""" Tests of :mod:`ftr.repository`, on temporary local repositories. """
+
+import os
+import time
+import codecs
+import random
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import requests
+
+import ftr
+import ftr.config
+import ftr.repository
+
+from ftr.repository import (
+    REPOSITORIES_HEALTH,
+    SQLITE_PREFIX,
+    SiteConfigTrie,
+    ftr_build_sqlite_repository,
+    ftr_get_http_session,
+    ftr_get_local_index,
+    ftr_get_repository_health,
+)
+
+
+class RepositoryTestCase(unittest.TestCase):
+
+    """ Siteconfigs in a temporary directory, lookups without caches. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.repository = os.path.join(self.directory, u'siteconfigs')
+        os.mkdir(self.repository)
+
+        self.environ = os.environ.get('PYTHON_FTR_REPOSITORIES')
+        self.disk_cache = ftr.config.SITECONFIG_DISK_CACHE
+
+        ftr.config.SITECONFIG_DISK_CACHE = None
+        ftr.config.NOT_FOUND_CACHE.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+        if self.environ is None:
+            os.environ.pop('PYTHON_FTR_REPOSITORIES', None)
+
+        else:
+            os.environ['PYTHON_FTR_REPOSITORIES'] = self.environ
+
+        ftr.config.SITECONFIG_DISK_CACHE = self.disk_cache
+        ftr.config.NOT_FOUND_CACHE.clear()
+
+    def set_repositories(self, *repositories):
+        os.environ['PYTHON_FTR_REPOSITORIES'] = u' '.join(repositories)
+
+    def write_siteconfig(self, name, content):
+        filename = os.path.join(self.repository, name + u'.txt')
+
+        with codecs.open(filename, 'wb', encoding='utf8') as f:
+            f.write(content)
+
+        return filename
+
+
+def probe_in_turn(names, domain_names):
+    """ The reference: ``name`` then ``.name``, for each domain name. """
+
+    for domain_name in domain_names:
+        for siteconfig_name in (domain_name, u'.' + domain_name):
+            if siteconfig_name in names:
+                return siteconfig_name
+
+    return None
+
+
+class SiteConfigTrieTest(RepositoryTestCase):
+
+    """ Trie lookups give what probing domain names in turn gives. """
+
+    def random_host(self, generator):
+        # Few labels, for names to share suffixes often.
+        return u'.'.join(generator.choice((u'a', u'b', u'www', u'com'))
+                         for x in range(generator.randint(1, 5)))
+
+    def random_names(self, generator):
+        return set(
+            generator.choice((u'', u'.')) + self.random_host(generator)
+            for x in range(generator.randint(0, 30))
+        )
+
+    def test_random(self):
+        generator = random.Random(0)
+
+        for iteration in range(500):
+            names = self.random_names(generator)
+            trie = SiteConfigTrie()
+
+            for name in names:
+                trie.add(name, name + u'.txt')
+
+            self.assertEqual(len(trie), len(names))
+            self.assertEqual(dict(trie),
+                             dict((x, x + u'.txt') for x in names))
+
+            for x in range(20):
+                host = self.random_host(generator)
+
+                for exact_host_match in (False, True):
+                    domain_names = ftr.config.ftr_get_domain_names(
+                        host, exact_host_match)
+                    expected = probe_in_turn(names, domain_names)
+                    found = trie.lookup(domain_names)
+
+                    self.assertEqual(
+                        found, None if expected is None
+                        else (expected + u'.txt', expected),
+                        (names, host, exact_host_match))
+
+    def test_resolve_hosts(self):
+        generator = random.Random(1)
+        names = self.random_names(generator) | set(
+            [u'example.com', u'.example.org'])
+
+        for name in names:
+            self.write_siteconfig(name, u'body: //div\n')
+
+        self.set_repositories(self.repository)
+
+        hosts = [self.random_host(generator) for x in range(200)] + [
+            u'www.example.com', u'news.example.com', u'news.example.org',
+            u'example.net']
+
+        for exact_host_match in (False, True):
+            resolved = ftr.resolve_hosts(hosts, exact_host_match)
+
+            for host in hosts:
+                expected = probe_in_turn(
+                    names, ftr.config.ftr_get_domain_names(host,
+                                                           exact_host_match))
+
+                self.assertEqual(
+                    resolved[host], None if expected is None
+                    else (self.repository, expected),
+                    (host, exact_host_match))
+
+
+class LocalRepositoryIndexTest(RepositoryTestCase):
+
+    """ Directory repositories indexes follow their changes. """
+
+    def lookup(self, repository, domain_name):
+        found = ftr_get_local_index(repository).lookup([domain_name])
+
+        return None if found is None else found[1]
+
+    def test_added_file(self):
+        self.assertIsNone(self.lookup(self.repository, u'example.com'))
+
+        # Right after the listing, possibly in the same mtime tick.
+        self.write_siteconfig(u'.example.com', u'body: //div\n')
+
+        self.assertEqual(self.lookup(self.repository, u'example.com'),
+                         u'.example.com')
+
+    def test_unchanged(self):
+        # Changed long before being listed.
+        mtime = time.time() - 10
+        os.utime(self.repository, (mtime, mtime))
+
+        index = ftr_get_local_index(self.repository)
+
+        self.assertFalse(index.refresh())
+
+        filename = self.write_siteconfig(u'example.com', u'body: //div\n')
+        os.utime(self.repository, (mtime + 1, mtime + 1))
+
+        self.assertTrue(index.refresh())
+        self.assertEqual(index.lookup([u'example.com']),
+                         (filename, u'example.com'))
+
+    def test_symlink(self):
+        current = os.path.join(self.directory, u'current')
+        other = os.path.join(self.directory, u'other')
+        os.mkdir(other)
+
+        self.write_siteconfig(u'example.com', u'body: //div\n')
+        os.symlink(self.repository, current)
+
+        self.assertEqual(self.lookup(current, u'example.com'),
+                         u'example.com')
+
+        # Switched like ftr-sync does.
+        os.symlink(other, current + u'.new')
+        os.rename(current + u'.new', current)
+
+        self.assertIsNone(self.lookup(current, u'example.com'))
+
+
+class SQLiteRepositoryTest(RepositoryTestCase):
+
+    """ ``sqlite://`` repositories. """
+
+    def setUp(self):
+        super(SQLiteRepositoryTest, self).setUp()
+        self.database = os.path.join(self.directory, u'siteconfigs.db')
+
+    def test_import(self):
+        self.write_siteconfig(u'example.com', u'body: //div\n')
+        self.write_siteconfig(u'.example.org', u'body: //main\n')
+
+        with open(os.path.join(self.repository, u'README.md'), 'wb') as f:
+            f.write('Not a siteconfig.\n')
+
+        self.assertEqual(
+            ftr_build_sqlite_repository(self.repository, self.database), 2)
+
+        connection = sqlite3.connect(self.database)
+        self.addCleanup(connection.close)
+
+        self.assertEqual(
+            connection.execute(u'SELECT name, content FROM siteconfigs '
+                               u'ORDER BY name').fetchall(),
+            [(u'.example.org', u'body: //main\n'),
+             (u'example.com', u'body: //div\n')])
+
+        # Temporary files were renamed or removed.
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [u'siteconfigs', u'siteconfigs.db'])
+
+    def test_wildcard_lookup(self):
+        self.write_siteconfig(u'.example.com', u'body: //div\n')
+        self.write_siteconfig(u'example.org', u'body: //main\n')
+        ftr_build_sqlite_repository(self.repository, self.database)
+
+        self.set_repositories(SQLITE_PREFIX + self.database)
+
+        self.assertEqual(ftr.get_config(u'news.example.com'),
+                         (u'body: //div\n', u'.example.com'))
+        self.assertEqual(ftr.get_config(u'example.org'),
+                         (u'body: //main\n', u'example.org'))
+        self.assertRaises(ftr.SiteConfigNotFound,
+                          ftr.get_config, u'news.example.net')
+
+    def test_missing_database(self):
+        repository = SQLITE_PREFIX + self.database
+        self.set_repositories(repository)
+        self.addCleanup(REPOSITORIES_HEALTH.pop, repository, None)
+
+        with self.assertRaises(ftr.SiteConfigNotFound) as context:
+            ftr.get_config(u'example.com')
+
+        self.assertEqual(context.exception.unreachable_repositories,
+                         [repository])
+        self.assertFalse(os.path.exists(self.database))
+
+
+class Clock(object):
+
+    """ Stands for :mod:`time` in :mod:`ftr.repository`. """
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    """ Repositories that failed repeatedly are skipped for a while. """
+
+    repository = u'http://siteconfigs.example.net/'
+
+    def setUp(self):
+        self.breaker = (ftr.repository.BREAKER_THRESHOLD,
+                        ftr.repository.BREAKER_COOLDOWN)
+        self.time = ftr.repository.time
+
+        ftr.repository.BREAKER_THRESHOLD = 2
+        ftr.repository.BREAKER_COOLDOWN = 60
+        ftr.repository.time = self.clock = Clock()
+        REPOSITORIES_HEALTH.pop(self.repository, None)
+
+        self.outcome = ftr.config.PROBE_UNREACHABLE
+        self.probes = 0
+
+    def tearDown(self):
+        (ftr.repository.BREAKER_THRESHOLD,
+         ftr.repository.BREAKER_COOLDOWN) = self.breaker
+        ftr.repository.time = self.time
+        REPOSITORIES_HEALTH.pop(self.repository, None)
+
+    def probe(self, txt_siteconfig_name):
+        """ Stands for a remote probe, the network I/O. """
+
+        self.probes += 1
+
+        if self.outcome == ftr.config.PROBE_FOUND:
+            return self.outcome, (u'body: //div\n', u'example.com',
+                                  self.repository + txt_siteconfig_name,
+                                  None)
+
+        return self.outcome, None
+
+    def lookup(self):
+        """ Return the siteconfig found, or the unreachable repositories. """
+
+        try:
+            return ftr.config._ftr_run_probes(
+                (u'example.com', ), (self.repository, ),
+                [(self.repository, self.probe, (u'example.com.txt', ))])
+
+        except ftr.SiteConfigNotFound, e:
+            return e.unreachable_repositories
+
+    def health(self):
+        return ftr_get_repository_health(self.repository).as_dict()
+
+    def open_breaker(self):
+        for x in range(2):
+            self.assertFalse(self.health()['breaker_open'])
+            self.assertEqual(self.lookup(), [self.repository])
+
+        self.assertEqual(self.probes, 2)
+        self.assertTrue(self.health()['breaker_open'])
+
+    def test_open(self):
+        self.open_breaker()
+
+        # Skipped, without probing.
+        for x in range(3):
+            self.assertEqual(self.lookup(), [self.repository])
+
+        self.clock.now += 59
+        self.assertEqual(self.lookup(), [self.repository])
+
+        health = self.health()
+
+        self.assertEqual(self.probes, 2)
+        self.assertEqual((health['errors'], health['skipped']), (2, 4))
+        self.assertEqual(health['breaker_trips'], 1)
+
+    def test_close(self):
+        self.open_breaker()
+        self.outcome = ftr.config.PROBE_FOUND
+
+        self.clock.now += 60
+        self.assertEqual(self.lookup()[0], u'body: //div\n')
+        self.assertEqual(self.probes, 3)
+
+        health = self.health()
+
+        self.assertFalse(health['breaker_open'])
+        self.assertEqual(health['consecutive_errors'], 0)
+
+        # Errors are counted from zero again.
+        self.outcome = ftr.config.PROBE_UNREACHABLE
+        self.lookup()
+
+        self.assertFalse(self.health()['breaker_open'])
+
+    def test_reopen(self):
+        self.open_breaker()
+
+        # The first probe after the cooldown fails.
+        self.clock.now += 60
+        self.assertEqual(self.lookup(), [self.repository])
+        self.assertEqual(self.probes, 3)
+
+        self.assertTrue(self.health()['breaker_open'])
+        self.assertEqual(self.lookup(), [self.repository])
+        self.assertEqual(self.probes, 3)
+        self.assertEqual(self.health()['breaker_trips'], 2)
+
+
+class FakeResponse(object):
+
+    """ A :class:`requests.Response` for missing siteconfigs. """
+
+    status_code = 404
+    headers = {}
+    text = u''
+
+
+class FakeSession(object):
+
+    """ Stands for the shared :class:`requests.Session`. """
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        self.requests.append((url, kwargs))
+        return FakeResponse()
+
+
+class HTTPSessionTest(unittest.TestCase):
+
+    """ Remote repositories are probed through one pooled session. """
+
+    repository = u'http://siteconfigs.example.net/'
+
+    def setUp(self):
+        self.session = (ftr.repository.HTTP_SESSION,
+                        ftr.repository.HTTP_SESSION_PID)
+        self.concurrent_lookups = ftr.config.CONCURRENT_LOOKUPS
+
+        ftr.repository.HTTP_SESSION = FakeSession()
+        ftr.repository.HTTP_SESSION_PID = os.getpid()
+        ftr.config.CONCURRENT_LOOKUPS = False
+
+    def tearDown(self):
+        (ftr.repository.HTTP_SESSION,
+         ftr.repository.HTTP_SESSION_PID) = self.session
+        ftr.config.CONCURRENT_LOOKUPS = self.concurrent_lookups
+        REPOSITORIES_HEALTH.pop(self.repository, None)
+
+    def test_probes(self):
+        session = ftr.repository.HTTP_SESSION
+
+        for x in range(2):
+            self.assertRaises(ftr.SiteConfigNotFound,
+                              ftr.config._ftr_lookup_config,
+                              (u'news.example.com', u'example.com'),
+                              (self.repository, ))
+
+        self.assertIs(ftr_get_http_session(), session)
+        self.assertEqual(
+            [url for url, kwargs in session.requests],
+            [self.repository + x for x in (
+                u'news.example.com.txt', u'.news.example.com.txt',
+                u'example.com.txt', u'.example.com.txt')] * 2)
+
+        for url, kwargs in session.requests:
+            self.assertEqual(kwargs['timeout'],
+                             (ftr.repository.HTTP_CONNECT_TIMEOUT,
+                              ftr.repository.HTTP_READ_TIMEOUT))
+
+    def test_forked(self):
+        # Created by a parent process.
+        ftr.repository.HTTP_SESSION_PID = -1
+
+        session = ftr_get_http_session()
+
+        self.assertIsInstance(session, requests.Session)
+        self.assertIs(ftr_get_http_session(), session)
+        self.assertEqual(session.headers['Accept-Encoding'],
+                         'gzip, deflate')
+
+
+if __name__ == '__main__':
+    unittest.main()
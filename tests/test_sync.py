@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+u""" Tests of :mod:`ftr.sync`, with local archives instead of downloads. """
+
+import os
+import time
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import unittest
+
+from StringIO import StringIO
+
+import ftr.sync
+
+from ftr.sync import (
+    SYNC_STATE_FILENAME,
+    ftr_get_synced_version,
+    ftr_sync_repository,
+)
+
+ARCHIVE_URL = u'https://example.com/ftr-site-config/master.tar.gz'
+
+
+class Clock(object):
+
+    """ Stands for :mod:`time` in :mod:`ftr.sync`, one second per sync. """
+
+    def __init__(self):
+        self.now = 1400000000
+
+    def strftime(self, format):
+        return time.strftime(format, time.gmtime(self.now))
+
+
+class SyncTest(unittest.TestCase):
+
+    """ ``ftr_sync_repository()``, with a fake ``_download()``. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.destination = os.path.join(self.directory, u'mirror')
+
+        # ETag → archive filename, and ETags sent by syncs.
+        self.archives = {}
+        self.sent_etags = []
+
+        self.download = ftr.sync._download
+        self.time = ftr.sync.time
+        ftr.sync._download = self.fake_download
+        ftr.sync.time = self.clock = Clock()
+
+    def tearDown(self):
+        ftr.sync._download = self.download
+        ftr.sync.time = self.time
+        shutil.rmtree(self.directory)
+
+    def make_archive(self, etag, files):
+        """ Make a GitHub-like archive of ``files``, served with ``etag``.
+
+        :param files: a ``dict`` of name → content, in the top directory.
+        """
+
+        filename = os.path.join(self.directory, etag.strip('"') + '.tar.gz')
+
+        with tarfile.open(filename, 'w:gz') as archive:
+            top = tarfile.TarInfo('ftr-site-config-master')
+            top.type = tarfile.DIRTYPE
+            archive.addfile(top)
+
+            for name, content in sorted(files.items()):
+                member = tarfile.TarInfo('ftr-site-config-master/' + name)
+                member.size = len(content)
+                archive.addfile(member, StringIO(content))
+
+        self.archives[etag] = filename
+
+    def fake_download(self, archive_url, etag=None):
+        """ Serve the last made archive, like ``_download()``. """
+
+        self.sent_etags.append(etag)
+        current = sorted(self.archives)[-1]
+
+        if etag == current:
+            return None
+
+        # ftr_sync_repository() removes it.
+        descriptor, filename = tempfile.mkstemp(dir=self.directory)
+        os.close(descriptor)
+        shutil.copy(self.archives[current], filename)
+
+        with open(filename, 'rb') as f:
+            sha1 = hashlib.sha1(f.read()).hexdigest()
+
+        return filename, current, sha1
+
+    def sync(self, **kwargs):
+        self.clock.now += 1
+
+        return ftr_sync_repository(self.destination, ARCHIVE_URL, **kwargs)
+
+    def versions(self):
+        return sorted(os.listdir(os.path.join(self.destination, u'versions')))
+
+    def test_extract(self):
+        self.make_archive('"1"', {
+            'example.com.txt': 'body: //div\n',
+            '.example.org.txt': 'body: //main\n',
+            'README.md': 'Siteconfigs.\n',
+            'tests/example.net.txt': 'body: //pre\n',
+        })
+
+        version_directory = self.sync()
+
+        self.assertEqual(sorted(os.listdir(version_directory)),
+                         ['.example.org.txt', 'VERSION.json',
+                          'example.com.txt'])
+
+        with open(os.path.join(version_directory, 'example.com.txt')) as f:
+            self.assertEqual(f.read(), 'body: //div\n')
+
+        synced = ftr_get_synced_version(self.destination)
+
+        self.assertEqual(synced['etag'], '"1"')
+        self.assertEqual(synced['archive_url'], ARCHIVE_URL)
+        self.assertEqual(synced['siteconfigs'], 2)
+
+    def test_switch_and_cleanup(self):
+        version_directories = []
+
+        for index in range(4):
+            self.make_archive('"{0}"'.format(index), {
+                'example.com.txt': 'body: //div[{0}]\n'.format(index),
+            })
+            version_directories.append(self.sync(keep=2))
+
+            self.assertEqual(
+                os.path.realpath(os.path.join(self.destination, u'current')),
+                os.path.realpath(version_directories[-1]))
+
+        # The oldest ones were removed.
+        self.assertEqual(self.versions(),
+                         [os.path.basename(x)
+                          for x in version_directories[-2:]])
+
+        with open(os.path.join(self.destination, u'current',
+                               u'example.com.txt')) as f:
+            self.assertEqual(f.read(), 'body: //div[3]\n')
+
+    def test_not_modified(self):
+        self.make_archive('"1"', {'example.com.txt': 'body: //div\n'})
+        self.sync()
+
+        self.assertIsNone(self.sync())
+        self.assertEqual(self.sent_etags, [None, '"1"'])
+        self.assertEqual(len(self.versions()), 1)
+
+    def test_unchanged_content(self):
+        self.make_archive('"1"', {'example.com.txt': 'body: //div\n'})
+        version_directory = self.sync()
+
+        # Published versions are left alone: changing them would
+        # look like a change of the siteconfigs to lookups.
+        mtime = int(time.time()) - 10
+        os.utime(version_directory, (mtime, mtime))
+        synced = ftr_get_synced_version(self.destination)
+
+        # Another ETag, for the same content.
+        self.archives['"2"'] = self.archives['"1"']
+
+        self.assertIsNone(self.sync())
+        self.assertEqual(self.versions(),
+                         [os.path.basename(version_directory)])
+        self.assertEqual(ftr_get_synced_version(self.destination), synced)
+        self.assertEqual(os.stat(version_directory).st_mtime, mtime)
+
+        # The new ETag is sent, and the archive not downloaded again.
+        self.assertIsNone(self.sync())
+        self.assertEqual(self.sent_etags, [None, '"1"', '"2"'])
+
+    def test_without_state(self):
+        self.make_archive('"1"', {'example.com.txt': 'body: //div\n'})
+        self.sync()
+
+        # Synchronized by a version without the state file.
+        os.unlink(os.path.join(self.destination, SYNC_STATE_FILENAME))
+
+        self.assertIsNone(self.sync())
+        self.assertEqual(self.sent_etags, [None, '"1"'])
+
+
+if __name__ == '__main__':
+    unittest.main()